@@ -34,6 +34,12 @@ app.config['VNPAY_HASH_SECRET'] = os.getenv('VNPAY_HASH_SECRET')
 app.config['VNPAY_URL'] = os.getenv('VNPAY_URL', 'https://sandbox.vnpayment.vn/paymentv2/vpcpay.html')
 app.config['VNPAY_RETURN_URL'] = os.getenv('VNPAY_RETURN_URL', 'http://localhost:5000/payment/vnpay_return')
 
+# Broker sự kiện slot khi chạy nhiều worker (vd: 127.0.0.1:5055), bỏ trống thì chỉ phát trong process
+app.config['SLOT_EVENT_BROKER'] = os.getenv('SLOT_EVENT_BROKER')
+
+# Cho phép đặt vượt số chỗ ở các khung giờ có tỉ lệ không đến khám cao (xem dao_overbooking)
+app.config['OVERBOOKING_ENABLED'] = os.getenv('OVERBOOKING_ENABLED') == 'True'
+
 
 GOOGLE_CLIENT_SECRETS_FILE = os.path.join(pathlib.Path(__file__).parent, "oauth_config.json")
 
@@ -47,6 +53,35 @@ flow = Flow.from_client_secrets_file(
 )
 # App settings
 PAGE_SIZE = 8
+SLOT_DURATION_MINUTES = 30  # Độ dài mỗi slot khám
+SLOT_HORIZON_WEEKS = 8  # Số tuần sinh slot trước từ lịch làm việc
+SLOT_HOLD_MINUTES = 5  # Thời gian giữ chỗ slot khi bệnh nhân mở form đặt lịch
+WAITLIST_OFFER_MINUTES = 60  # Thời gian giữ slot riêng cho bệnh nhân trong danh sách chờ
+SLOT_EVENT_KEEPALIVE_SECONDS = 15  # Chu kỳ gửi comment giữ kết nối SSE
+SERIES_MAX_COUNT = 26  # Số buổi tối đa khi đặt lịch lặp lại hàng tuần
+MAX_SLOTS_PER_APPOINTMENT = 3  # Số slot liên tiếp tối đa cho một lịch khám dài
+WAITING_ROOM_OPEN_MINUTES = 30  # Bệnh nhân khám online được check-in trước giờ hẹn bao nhiêu phút
+WAITING_ROOM_POLL_SECONDS = 10  # Chu kỳ trang chi tiết lịch hẹn hỏi lại vị trí trong hàng chờ
+OVERBOOKING_HISTORY_DAYS = 180  # Số ngày lịch sử dùng để tính tỉ lệ không đến khám
+OVERBOOKING_BAND_HOURS = 2  # Độ rộng mỗi khung giờ khi tính tỉ lệ không đến khám
+OVERBOOKING_MIN_HISTORY = 20  # Số lịch hẹn tối thiểu của một khung giờ để tin được tỉ lệ
+OVERBOOKING_MAX_EXPECTED = 1.25  # Số bệnh nhân đến khám kỳ vọng tối đa trên một slot
+OVERBOOKING_MAX_EXTRA = 1  # Số lượt đặt vượt tối đa trên một slot
+SCHEDULE_HISTORY_WEEKS = 12  # Số tuần slot đã qua dùng để gợi ý lịch làm việc
+SCHEDULE_MIN_SLOTS = 4  # Số slot tối thiểu của một giờ (theo thứ) để đưa ra gợi ý
+SCHEDULE_HOT_RATE = 0.9  # Giờ "cháy" slot: tỉ lệ đặt từ mức này...
+SCHEDULE_HOT_DAYS = 3  # ...và hết slot trong số ngày này kể từ khi mở
+SCHEDULE_COLD_RATE = 0.2  # Giờ có tỉ lệ đặt không quá mức này thì gợi ý bỏ
+SCHEDULE_EARLIEST_HOUR = 7  # Không gợi ý bắt đầu sớm hơn
+SCHEDULE_LATEST_HOUR = 20  # Không gợi ý kết thúc muộn hơn
+NO_SHOW_GRACE_MINUTES = 120  # Lịch hẹn quá giờ hẹn bao nhiêu phút mà vẫn Scheduled thì chuyển NoShow
+NO_SHOW_BATCH_SIZE = 1000  # Số lịch hẹn tối đa mỗi lệnh UPDATE khi quét NoShow
+INVOICE_OVERDUE_BATCH_SIZE = 1000  # Số hóa đơn tối đa mỗi lệnh UPDATE khi quét hóa đơn quá hạn
+REMINDER_HOURS = (24, 2)  # Gửi nhắc hẹn trước giờ khám bao nhiêu giờ
+REMINDER_WINDOW_MINUTES = 10  # Độ dài mỗi cửa sổ lượt nhắc được nạp từ DB
+REMINDER_TICK_SECONDS = 30  # Chu kỳ kiểm tra lượt nhắc đến hạn
+REMINDER_BATCH_SIZE = 50  # Số email nhắc gửi qua một kết nối SMTP
+NOTIFICATION_BATCH_SIZE = 50  # Số email thông báo (hủy lịch hàng loạt) gửi qua một kết nối SMTP
 # Khởi tạo các extension
 db.init_app(app)
 mail.init_app(app)
@@ -56,6 +91,7 @@ login.init_app(app)
 # Import routes và models
 from app import  models
 from app import admin
+from app import commands
 
 
 
@@ -1,22 +1,24 @@
 from flask_login import logout_user, current_user
 from flask_admin.contrib.sqla import ModelView
 from flask_admin import expose, BaseView, Admin
-from sqlalchemy import extract
+from sqlalchemy import extract, inspect
 from sqlalchemy.exc import IntegrityError
 
 from app.form import DoctorUserForm
 from app.models import (
     RoleEnum, User, Specialty, Hospital, Doctor, DoctorLicense,
-    Patient, Appointment, HealthRecord, Invoice, Payment, Review, AppointmentStatus, GenderEnum
+    Patient, Appointment, HealthRecord, Invoice, Payment, Review, AppointmentStatus, GenderEnum,
+    AvailabilityException, DayOfWeekEnum
 )
 from flask_admin.actions import action
+from wtforms.validators import ValidationError
 from flask_admin.model.template import EndpointLinkRowAction
 from app.extensions import db
-from app import app
+from app import app, SLOT_DURATION_MINUTES
 from flask import redirect, request, flash, url_for
 import hashlib
-from app.dao import dao_stats , dao_doctor , dao_license
-from datetime import datetime
+from app.dao import dao_stats , dao_doctor , dao_license, dao_simulation, dao_invoice, dao_appointment
+from datetime import datetime, date, timedelta
 
 
 # Base class for authenticated views
@@ -395,6 +397,26 @@ class InvoiceView(AuthenticatedView):
         }
     }
 
+    list_template = 'admin/invoice_list.html'
+
+    @expose('/')
+    def index_view(self):
+        # Bảng tuổi nợ đọc từ InvoiceAging, không quét bảng invoice
+        self._template_args['aging'] = dao_invoice.get_invoice_aging_summary()
+        return super().index_view()
+
+    def on_model_change(self, form, model, is_created):
+        # Sửa tay có thể đổi trạng thái, số tiền hoặc hạn: tính lại tuổi nợ của hạn cũ và hạn mới
+        due_dates = {model.due_date, *inspect(model).attrs.due_date.history.deleted}
+        db.session.flush()
+        dao_invoice.sync_invoice_aging(due_dates)
+        return super().on_model_change(form, model, is_created)
+
+    def on_model_delete(self, model):
+        if model.status in dao_invoice.OUTSTANDING:
+            dao_invoice.adjust_invoice_aging(model.due_date, model.amount, -1)
+        return super().on_model_delete(model)
+
 
 # Payment management view
 class PaymentView(AuthenticatedView):
@@ -477,6 +499,54 @@ class ReviewView(AuthenticatedView):
         }
     }
 
+# Ngày nghỉ của bác sĩ / bệnh viện
+class AvailabilityExceptionView(AuthenticatedView):
+    column_list = ['doctor', 'hospital', 'start_date', 'end_date', 'reason']
+    column_labels = {
+        'doctor': 'Bác sĩ',
+        'hospital': 'Bệnh viện',
+        'start_date': 'Từ ngày',
+        'end_date': 'Đến ngày',
+        'reason': 'Lý do'
+    }
+    column_filters = ['start_date', 'end_date']
+    form_columns = ['doctor', 'hospital', 'start_date', 'end_date', 'reason']
+    column_default_sort = ('start_date', True)
+
+    def _doctor_formatter(view, context, model, name):
+        if model.doctor and model.doctor.user:
+            return f"BS {model.doctor.user.first_name} {model.doctor.user.last_name}"
+        return ""
+
+    column_formatters = {
+        'doctor': _doctor_formatter
+    }
+
+    form_args = {
+        'doctor': {
+            'query_factory': lambda: Doctor.query.join(User).filter(User.role == RoleEnum.DOCTOR),
+            'get_label': lambda d: f"BS {d.user.first_name} {d.user.last_name}"
+        }
+    }
+
+    def on_model_change(self, form, model, is_created):
+        if not model.doctor and not model.hospital:
+            raise ValidationError('Vui lòng chọn bác sĩ hoặc bệnh viện')
+        if model.end_date < model.start_date:
+            raise ValidationError('Ngày kết thúc phải sau ngày bắt đầu')
+        # Hủy slot trống trong khoảng nghỉ cùng transaction với ngày nghỉ
+        deleted, booked = dao_doctor.invalidate_exception_slots(
+            model.start_date, model.end_date,
+            doctor_id=model.doctor.doctor_id if model.doctor else None,
+            hospital_id=model.hospital.hospital_id if model.hospital else None
+        )
+        message = f'Đã hủy {deleted} slot trống trong khoảng nghỉ'
+        if booked:
+            message += f'; còn {booked} slot đã có lịch hẹn cần xử lý'
+        flash(message, 'warning' if booked else 'success')
+        return super().on_model_change(form, model, is_created)
+
+
 class StatsView(AuthenticatedBaseView):
     @expose('/')
     def index(self):
@@ -547,6 +617,97 @@ class StatsView(AuthenticatedBaseView):
             chart_revenues=chart_revenues
         )
 
+    @expose('/simulation')
+    def simulation(self):
+        """Mô phỏng nhu cầu slot theo chuyên khoa: so sánh lịch hiện tại với lịch giả định"""
+        today = date.today()
+        try:
+            start_date = datetime.strptime(request.args.get('start_date', ''), '%Y-%m-%d').date()
+        except ValueError:
+            start_date = today - timedelta(days=365)
+        try:
+            end_date = datetime.strptime(request.args.get('end_date', ''), '%Y-%m-%d').date()
+        except ValueError:
+            end_date = today - timedelta(days=1)
+        hospital_id = request.args.get('hospital_id', type=int)
+        specialty_id = request.args.get('specialty_id', type=int)
+        slot_minutes = request.args.get('slot_minutes', SLOT_DURATION_MINUTES, type=int)
+        extra_day = request.args.get('extra_day', '')
+        extra_hours = request.args.get('extra_hours', 0, type=float)
+        days = list(DayOfWeekEnum)
+        extra_weekday = [d.value for d in days].index(extra_day) if extra_day in [d.value for d in days] else None
+
+        rows, totals = [], None
+        if start_date <= end_date and slot_minutes > 0:
+            result = dao_simulation.run_simulation(start_date, end_date, hospital_id, specialty_id,
+                                                   slot_minutes=slot_minutes, extra_weekday=extra_weekday,
+                                                   extra_hours=extra_hours)
+            rows = result.to_dict('records')
+            if rows:
+                totals = result[['requests', 'cancelled', 'served_base', 'unmet_base', 'supply_base',
+                                 'served_sim', 'unmet_sim', 'supply_sim']].sum().to_dict()
+        else:
+            flash('Khoảng ngày hoặc độ dài slot không hợp lệ', 'error')
+
+        return self.render(
+            'admin/simulation.html',
+            rows=rows,
+            totals=totals,
+            hospitals=Hospital.query.order_by(Hospital.name).all(),
+            specialties=Specialty.query.order_by(Specialty.name).all(),
+            days=days,
+            start_date=start_date,
+            end_date=end_date,
+            selected_hospital=hospital_id,
+            selected_specialty=specialty_id,
+            slot_minutes=slot_minutes,
+            extra_day=extra_day,
+            extra_hours=extra_hours
+        )
+
+
+# Hủy toàn bộ lịch khám của bác sĩ trong một khoảng ngày (bác sĩ nghỉ đột xuất)
+class BulkCancelView(AuthenticatedBaseView):
+    DEFAULT_REASON = 'Bác sĩ nghỉ đột xuất'
+
+    @expose('/', methods=('GET', 'POST'))
+    def index(self):
+        source = request.form if request.method == 'POST' else request.args
+        doctor_id = source.get('doctor_id', type=int)
+        reason = source.get('reason', '').strip() or self.DEFAULT_REASON
+        try:
+            start_date = datetime.strptime(source.get('start_date', ''), '%Y-%m-%d').date()
+        except ValueError:
+            start_date = date.today()
+        try:
+            end_date = datetime.strptime(source.get('end_date', ''), '%Y-%m-%d').date()
+        except ValueError:
+            end_date = start_date
+
+        if request.method == 'POST':
+            if not doctor_id:
+                flash('Vui lòng chọn bác sĩ', 'error')
+            else:
+                count, message = dao_appointment.cancel_doctor_appointments(doctor_id, start_date, end_date, reason)
+                flash(message, 'success' if count is not None else 'error')
+            return redirect(url_for('.index', doctor_id=doctor_id, start_date=start_date, end_date=end_date,
+                                    reason=reason))
+
+        # Xem trước các lịch hẹn sẽ bị hủy
+        appointments = []
+        if doctor_id and start_date <= end_date:
+            appointments = dao_appointment.get_doctor_appointments_in_range(doctor_id, start_date, end_date)
+
+        return self.render(
+            'admin/bulk_cancel.html',
+            doctors=Doctor.query.join(User).filter(User.role == RoleEnum.DOCTOR).all(),
+            appointments=appointments,
+            selected_doctor=doctor_id,
+            start_date=start_date,
+            end_date=end_date,
+            reason=reason
+        )
+
 
 class CreateDoctorView(AuthenticatedBaseView):
 
@@ -640,6 +801,8 @@ admin.add_view(HealthRecordView(HealthRecord, db.session, name='Hồ sơ sức k
 admin.add_view(InvoiceView(Invoice, db.session, name='Hóa đơn'))
 admin.add_view(PaymentView(Payment, db.session, name='Thanh toán'))
 admin.add_view(ReviewView(Review, db.session, name='Đánh giá'))
+admin.add_view(AvailabilityExceptionView(AvailabilityException, db.session, name='Ngày nghỉ'))
+admin.add_view(BulkCancelView(name='Hủy lịch theo ngày', endpoint='bulk_cancel'))
 admin.add_view(StatsView(name='Thống kê', endpoint='stats'))
 admin.add_view(CreateDoctorView(name='Tạo Bác Sĩ Mới', endpoint='create_doctor'))
 admin.add_view(LogoutView(name='Đăng xuất'))
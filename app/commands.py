@@ -0,0 +1,157 @@
+import time
+import click
+from app import app, SLOT_HORIZON_WEEKS, NO_SHOW_GRACE_MINUTES, NO_SHOW_BATCH_SIZE, INVOICE_OVERDUE_BATCH_SIZE, \
+    REMINDER_TICK_SECONDS
+from app.dao import dao_slot_generator, dao_appointment, dao_available_slot, dao_waitlist, dao_doctor, dao_overbooking, \
+    dao_schedule_optimizer, dao_invoice
+from app.slot_events import SlotEventBroker
+
+
+# Chạy: flask --app app.index generate-slots [--doctor-id 1] [--weeks 8]
+@app.cli.command("generate-slots")
+@click.option("--doctor-id", type=int, default=None, help="Chỉ sinh slot cho một bác sĩ")
+@click.option("--weeks", type=int, default=SLOT_HORIZON_WEEKS, help="Số tuần sinh trước")
+def generate_slots_command(doctor_id, weeks):
+    """Sinh AvailableSlot từ lịch làm việc hàng tuần của bác sĩ"""
+    count, message = dao_slot_generator.generate_slots(doctor_id=doctor_id, weeks=weeks)
+    click.echo(message)
+
+
+# Chạy một lần sau khi thêm cột appointment.slot_id
+@app.cli.command("backfill-appointment-slots")
+@click.option("--batch-size", type=int, default=500)
+def backfill_appointment_slots_command(batch_size):
+    """Điền slot_id cho các lịch hẹn cũ theo từng lô"""
+    count, message = dao_appointment.backfill_appointment_slot_ids(batch_size=batch_size)
+    click.echo(message)
+
+
+# Chạy định kỳ (cron) để dọn giữ chỗ hết hạn
+@app.cli.command("release-expired-holds")
+def release_expired_holds_command():
+    """Xóa giữ chỗ slot đã hết hạn"""
+    count = dao_available_slot.release_expired_holds()
+    click.echo(f"Đã xóa {count} giữ chỗ hết hạn")
+
+
+# Chạy định kỳ (cron): lịch hẹn quá giờ mà vẫn Scheduled là bệnh nhân không đến khám
+@app.cli.command("mark-no-shows")
+@click.option("--grace-minutes", type=int, default=NO_SHOW_GRACE_MINUTES, help="Số phút chờ sau giờ hẹn")
+@click.option("--batch-size", type=int, default=NO_SHOW_BATCH_SIZE)
+def mark_no_shows_command(grace_minutes, batch_size):
+    """Chuyển lịch hẹn quá hạn sang NoShow theo từng lô"""
+    count, message = dao_appointment.mark_no_shows(grace_minutes=grace_minutes, batch_size=batch_size)
+    click.echo(message)
+
+
+# Chạy định kỳ (cron) mỗi ngày: hóa đơn Pending đã qua hạn thanh toán chuyển sang Overdue
+@app.cli.command("mark-overdue-invoices")
+@click.option("--batch-size", type=int, default=INVOICE_OVERDUE_BATCH_SIZE)
+def mark_overdue_invoices_command(batch_size):
+    """Chuyển hóa đơn quá hạn sang Overdue theo từng lô"""
+    count, message = dao_invoice.mark_overdue_invoices(batch_size=batch_size)
+    click.echo(message)
+
+
+# Chạy một lần sau khi thêm bảng invoiceaging, hoặc sau khi xóa/sửa hóa đơn ngoài ứng dụng
+@app.cli.command("rebuild-invoice-aging")
+def rebuild_invoice_aging_command():
+    """Tính lại InvoiceAging từ bảng invoice"""
+    count, message = dao_invoice.rebuild_invoice_aging()
+    click.echo(message)
+
+
+# Chạy một lần sau khi thêm cột availableslot.slot_start
+@app.cli.command("backfill-slot-start")
+@click.option("--batch-size", type=int, default=5000)
+def backfill_slot_start_command(batch_size):
+    """Điền slot_start cho các slot cũ theo từng lô"""
+    count, message = dao_available_slot.backfill_slot_start(batch_size=batch_size)
+    click.echo(message)
+
+
+# Dựng lại bảng slot trống sớm nhất của từng bác sĩ (sau khi thêm bảng hoặc sửa dữ liệu tay)
+@app.cli.command("rebuild-next-slots")
+def rebuild_next_slots_command():
+    """Tính lại DoctorNextSlot từ AvailableSlot"""
+    count, message = dao_available_slot.rebuild_next_slots()
+    click.echo(message)
+
+
+# Dựng lại bảng đếm slot trống theo ngày (dùng cho lịch tháng)
+@app.cli.command("rebuild-day-counts")
+def rebuild_day_counts_command():
+    """Tính lại DoctorDayCount từ AvailableSlot"""
+    count, message = dao_available_slot.rebuild_day_counts()
+    click.echo(message)
+
+
+# Chạy định kỳ (cron): đề nghị quá hạn được chuyển cho người chờ kế tiếp
+@app.cli.command("expire-waitlist-offers")
+def expire_waitlist_offers_command():
+    """Hết hạn đề nghị slot của danh sách chờ và đề nghị lại"""
+    expired, reoffered = dao_waitlist.expire_offers()
+    click.echo(f"Đã hết hạn {expired} đề nghị, đề nghị lại {reoffered} slot")
+
+
+# Chạy một lần sau khi thêm cột doctoravailability.slot_mask
+@app.cli.command("rebuild-availability-masks")
+def rebuild_availability_masks_command():
+    """Tính lại bitmask giờ làm việc cho bộ lọc tìm bác sĩ theo giờ"""
+    count, message = dao_doctor.rebuild_availability_masks()
+    click.echo(message)
+
+
+# Chạy một lần sau khi thêm cột availableslot.capacity / booked_count
+@app.cli.command("backfill-slot-booked-count")
+def backfill_slot_booked_count_command():
+    """Điền số lượt đã đặt cho các slot cũ"""
+    count, message = dao_available_slot.backfill_slot_booked_count()
+    click.echo(message)
+
+
+# Chạy định kỳ (cron) sau generate-slots: cho phép đặt vượt ở khung giờ hay vắng (OVERBOOKING_ENABLED)
+@app.cli.command("apply-overbooking-policy")
+@click.option("--doctor-id", type=int, default=None, help="Chỉ áp dụng cho một bác sĩ")
+def apply_overbooking_policy_command(doctor_id):
+    """Tính tỉ lệ không đến khám và đặt capacity cho các slot tương lai"""
+    count, message = dao_overbooking.apply_overbooking_policy(doctor_id=doctor_id)
+    click.echo(message)
+
+
+# Báo cáo gợi ý lịch làm việc cho mọi bác sĩ; bác sĩ tự áp dụng ở trang xem lịch
+@app.cli.command("recommend-schedules")
+@click.option("--doctor-id", type=int, default=None, help="Chỉ gợi ý cho một bác sĩ")
+def recommend_schedules_command(doctor_id):
+    """Gợi ý thêm/bớt giờ làm việc từ lịch sử đặt slot"""
+    recommendations = dao_schedule_optimizer.recommend_schedules(doctor_id=doctor_id)
+    for rec in recommendations:
+        new_hours = (f"{rec['new_start_time']:%H:%M}-{rec['new_end_time']:%H:%M}"
+                     if rec['is_available'] else "Nghỉ")
+        click.echo(f"Bác sĩ {rec['doctor_id']} {rec['day_of_week'].value}: "
+                   f"{rec['start_time']:%H:%M}-{rec['end_time']:%H:%M} -> {new_hours} "
+                   f"({'; '.join(rec['reasons'])})")
+    click.echo(f"Có {len(recommendations)} gợi ý lịch làm việc")
+
+# Chạy một process duy nhất (systemd/supervisor): gửi email nhắc hẹn REMINDER_HOURS giờ trước giờ khám
+@app.cli.command("run-reminders")
+@click.option("--once", is_flag=True, help="Chạy một vòng rồi thoát (dùng với cron)")
+def run_reminders_command(once):
+    """Nạp lượt nhắc theo cửa sổ thời gian và gửi email nhắc hẹn theo lô"""
+    while True:
+        count, message = dao_appointment.run_reminder_tick()
+        if count or once:
+            click.echo(message)
+        if once:
+            break
+        time.sleep(REMINDER_TICK_SECONDS)
+
+
+# Chạy một process riêng khi web chạy nhiều worker, rồi đặt SLOT_EVENT_BROKER cho các worker
+@app.cli.command("slot-event-broker")
+@click.option("--address", default="127.0.0.1:5055", help="Địa chỉ host:port để lắng nghe")
+def slot_event_broker_command(address):
+    """Broker phát sự kiện slot giữa các worker cho endpoint SSE"""
+    with SlotEventBroker(address) as broker:
+        click.echo(f"Broker sự kiện slot đang chạy tại {address}")
+        broker.serve_forever()
@@ -4,22 +4,25 @@ from math import ceil
 from sqlalchemy.orm import joinedload, subqueryload
 from flask_login import current_user, login_required, logout_user, login_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask import flash, current_app
+from flask import flash, current_app, Response, stream_with_context, abort
 from app.form import LoginForm, ScheduleForm
 from flask import render_template , redirect , request , url_for  , session , jsonify
 from app.decorators import role_only
 # Thêm import
 from app.dao import dao_payment
 from app.vnpay_service import VNPay  # Import VNPay
+from app import ical_service, slot_events
 import math
-from app.dao import dao_authen, dao_search, dao_doctor, dao_available_slot, dao_appointment, dao_payment, dao_patient, dao_healthrecord
+from app.dao import dao_authen, dao_search, dao_doctor, dao_available_slot, dao_appointment, dao_payment, dao_patient, dao_healthrecord, \
+    dao_waitlist, dao_slot_generator, dao_schedule_optimizer, dao_invoice
 from app.models import Hospital, Specialty, User, Doctor, RoleEnum, Patient, DayOfWeekEnum, HealthRecord, AvailableSlot, \
     ConsultationType, DoctorLicense, Appointment, Review, AppointmentStatus
 
 import google.oauth2.id_token
 import google.auth.transport.requests
 import requests
-from app import app, flow, PAGE_SIZE  # là import __init__
+from app import app, flow, PAGE_SIZE, SLOT_HOLD_MINUTES, SLOT_EVENT_KEEPALIVE_SECONDS, SERIES_MAX_COUNT, \
+    MAX_SLOTS_PER_APPOINTMENT, SLOT_DURATION_MINUTES, WAITING_ROOM_POLL_SECONDS  # là import __init__
 from app.extensions import db
 from app.models import Hospital, Specialty, User, Doctor, RoleEnum, GenderEnum
 from app.form import LoginForm, RegisterForm
@@ -154,25 +157,134 @@ def api_specialties():
     return jsonify([s.name for s in results])
 
 
+def _availability_filter_args():
+    """Đọc bộ lọc giờ làm việc từ query string: day (Monday..Sunday), from_time, to_time (HH:MM)"""
+    def parse_time(value):
+        try:
+            return datetime.strptime(value, "%H:%M").time() if value else None
+        except ValueError:
+            return None
+
+    day = request.args.get("day")
+    day_of_week = DayOfWeekEnum(day) if day in {d.value for d in DayOfWeekEnum} else None
+    return day_of_week, parse_time(request.args.get("from_time")), parse_time(request.args.get("to_time"))
+
+
 @app.route("/api/doctors")
 def api_doctors():
     q = (request.args.get("q", "") or "").strip()
-    if not q:
+    day_of_week, from_time, to_time = _availability_filter_args()
+    if not q and not day_of_week:
         return jsonify([])
 
-    results = (db.session.query(User)
-               .join(Doctor)
-               .filter(
-                   User.role == RoleEnum.DOCTOR,
-                   (User.first_name.ilike(f"%{q}%")) |
-                   (User.last_name.ilike(f"%{q}%"))
-               )
+    query = (db.session.query(User)
+             .join(Doctor)
+             .filter(User.role == RoleEnum.DOCTOR))
+    if q:
+        query = query.filter((User.first_name.ilike(f"%{q}%")) | (User.last_name.ilike(f"%{q}%")))
+    if day_of_week:
+        query = query.filter(dao_search.available_on(day_of_week, from_time, to_time))
+    results = (query
                .order_by(User.first_name.asc(), User.last_name.asc())
                .limit(10)
                .all())
 
     return jsonify([f"{u.first_name} {u.last_name}" for u in results])
 
+
+# k slot trống sớm nhất theo chuyên khoa và/hoặc bệnh viện
+@app.route("/api/earliest_slots")
+def api_earliest_slots():
+    specialty_id = request.args.get("specialty_id", type=int)
+    hospital_id = request.args.get("hospital_id", type=int)
+    k = max(1, min(request.args.get("k", 10, type=int), 50))
+    if not specialty_id and not hospital_id:
+        return jsonify({"error": "Cần chọn chuyên khoa hoặc bệnh viện"}), 400
+
+    patient_id = current_user.user_id if current_user.is_authenticated else None
+    slots = dao_available_slot.get_earliest_slots(specialty_id=specialty_id, hospital_id=hospital_id,
+                                                  k=k, patient_id=patient_id)
+
+    return jsonify([{
+        "slot_id": s.slot_id,
+        "doctor_id": s.doctor_id,
+        "doctor_name": f"{s.doctor.user.first_name} {s.doctor.user.last_name}",
+        "hospital": s.doctor.hospital.name,
+        "specialty": s.doctor.specialty.name,
+        "slot_date": s.slot_date.isoformat(),
+        "start_time": s.start_time.strftime("%H:%M"),
+        "end_time": s.end_time.strftime("%H:%M"),
+        "book_url": url_for("book_appointment", slot_id=s.slot_id),
+    } for s in slots])
+
+
+# Lịch tháng: số slot trống theo từng ngày của bác sĩ / chuyên khoa / bệnh viện
+@app.route("/api/calendar")
+def api_calendar():
+    doctor_id = request.args.get("doctor_id", type=int)
+    specialty_id = request.args.get("specialty_id", type=int)
+    hospital_id = request.args.get("hospital_id", type=int)
+    month = request.args.get("month") or date.today().strftime("%Y-%m")
+    try:
+        month_start = datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        return jsonify({"error": "Tháng không hợp lệ (định dạng YYYY-MM)"}), 400
+
+    counts = dao_available_slot.get_free_count_calendar(month_start.year, month_start.month,
+                                                        doctor_id=doctor_id, specialty_id=specialty_id,
+                                                        hospital_id=hospital_id)
+    return jsonify({slot_date.isoformat(): count for slot_date, count in sorted(counts.items())})
+
+
+@app.route("/api/slot_runs")
+def api_slot_runs():
+    """Các giờ bắt đầu còn đủ `slots` slot liên tiếp của bác sĩ trong ngày (lịch khám dài)"""
+    doctor_id = request.args.get("doctor_id", type=int)
+    slots = request.args.get("slots", 2, type=int)
+    try:
+        slot_date = datetime.strptime(request.args.get("date", ""), "%Y-%m-%d").date()
+    except ValueError:
+        return jsonify({"error": "Ngày không hợp lệ (định dạng YYYY-MM-DD)"}), 400
+    if not doctor_id:
+        return jsonify({"error": "Thiếu doctor_id"}), 400
+    if not 1 <= slots <= MAX_SLOTS_PER_APPOINTMENT:
+        return jsonify({"error": f"Số slot phải từ 1 đến {MAX_SLOTS_PER_APPOINTMENT}"}), 400
+
+    patient_id = current_user.user_id if current_user.is_authenticated else None
+    runs = dao_available_slot.find_slot_runs(doctor_id, slot_date, slots, patient_id=patient_id)
+    return jsonify([{
+        "slot_id": run[0].slot_id,
+        "slot_ids": [slot.slot_id for slot in run],
+        "start_time": run[0].start_time.strftime("%H:%M"),
+        "end_time": run[-1].end_time.strftime("%H:%M"),
+    } for run in runs])
+
+
+@app.route("/api/slot_events")
+def api_slot_events():
+    """
+    Server-Sent Events: đẩy sự kiện slot được đặt/mở lại, lọc theo hospital_id, specialty_id, doctor_id.
+    Trang danh sách slot giữ một kết nối thay vì tải lại cả trang.
+    """
+    subscription = slot_events.hub.subscribe(hospital_id=request.args.get("hospital_id", type=int),
+                                             specialty_id=request.args.get("specialty_id", type=int),
+                                             doctor_id=request.args.get("doctor_id", type=int))
+
+    def stream():
+        try:
+            # Trình duyệt tự kết nối lại sau 3s nếu mất kết nối
+            yield "retry: 3000\n\n"
+            while True:
+                event = subscription.get(timeout=SLOT_EVENT_KEEPALIVE_SECONDS)
+                yield slot_events.format_sse(event) if event else ": keep-alive\n\n"
+        finally:
+            slot_events.hub.unsubscribe(subscription)
+
+    response = Response(stream(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # nginx không gom buffer
+    return response
+
 # -------- VIEW ROUTES --------
 
 def index():
@@ -190,6 +302,8 @@ def search_doctor():
     doctor_name = request.args.get('doctor_name')
     search_type = request.args.get('search_type', 'hospital')  # Mặc định tìm theo bệnh viện
     page = request.args.get('page', 1, type=int)
+    # Lọc bác sĩ làm việc vào một ngày trong tuần, trong khung giờ (vd: sáng thứ Bảy)
+    day_of_week, from_time, to_time = _availability_filter_args()
 
     # Lấy danh sách bác sĩ với phân trang
     doctors, total_count = dao_search.search_doctors_paginated(
@@ -197,7 +311,10 @@ def search_doctor():
         specialty_name=specialty_name,
         doctor_name=doctor_name,
         page=page,
-        per_page=PAGE_SIZE
+        per_page=PAGE_SIZE,
+        day_of_week=day_of_week,
+        from_time=from_time,
+        to_time=to_time
     )
 
     # Tính tổng số trang
@@ -211,7 +328,11 @@ def search_doctor():
                          hospital_name=hospital_name,
                          specialty_name=specialty_name,
                          doctor_name=doctor_name,
-                         search_type=search_type)  # Thêm search_type vào template
+                         search_type=search_type,  # Thêm search_type vào template
+                         days=list(DayOfWeekEnum),
+                         selected_day=day_of_week.value if day_of_week else None,
+                         from_time=from_time.strftime('%H:%M') if from_time else None,
+                         to_time=to_time.strftime('%H:%M') if to_time else None)
 
 # Navigate cho đăng nhập hoặc chưa
 def index_controller():
@@ -549,7 +670,48 @@ def view_schedule():
             'is_available': availability.is_available if availability else False
         })
 
-    return render_template('view_schedule.html', days=days, doctor=doctor)
+    # Gợi ý lịch từ lịch sử đặt slot, lỗi phân tích không được chặn trang lịch
+    try:
+        recommendations = dao_schedule_optimizer.recommend_schedules(doctor.doctor_id)
+    except Exception as e:
+        app.logger.warning(f"Không tính được gợi ý lịch làm việc: {e}")
+        recommendations = []
+
+    return render_template('view_schedule.html', days=days, doctor=doctor, recommendations=recommendations)
+
+
+@app.route('/view_schedule/apply', methods=['POST'])
+@login_required
+@role_only([RoleEnum.DOCTOR])
+def apply_schedule_recommendation():
+    doctor = dao_authen.get_doctor_by_userid(current_user.user_id)
+    if not doctor:
+        flash("Bạn không phải là bác sĩ", "error")
+        return redirect(url_for('home'))
+    try:
+        day_of_week = request.form['day_of_week']
+        DayOfWeekEnum[day_of_week]
+        start_time = datetime.strptime(request.form['start_time'], '%H:%M').time()
+        end_time = datetime.strptime(request.form['end_time'], '%H:%M').time()
+    except (KeyError, ValueError):
+        flash("Gợi ý lịch không hợp lệ", "error")
+        return redirect(url_for('view_schedule'))
+    if start_time >= end_time:
+        flash("Giờ bắt đầu phải trước giờ kết thúc", "error")
+        return redirect(url_for('view_schedule'))
+
+    try:
+        dao_doctor.create_doctor_availability(
+            doctor_id=doctor.doctor_id,
+            day_of_week=day_of_week,
+            start_time=start_time,
+            end_time=end_time,
+            is_available=request.form.get('is_available') == 'True'
+        )
+        flash("Đã áp dụng gợi ý lịch làm việc", "success")
+    except Exception as e:
+        flash(f"Có lỗi xảy ra: {str(e)}", "error")
+    return redirect(url_for('view_schedule'))
 
 
 @app.route('/availableslot')
@@ -578,7 +740,8 @@ def available_slots():
         doctor_id=doctor_id,
         date=date_filter,
         page=page,
-        per_page=per_page
+        per_page=per_page,
+        patient_id=current_user.user_id
     )
 
     # Lấy tổng số slot để tính toán phân trang
@@ -586,7 +749,8 @@ def available_slots():
         hospital_id=hospital_id,
         specialty_id=specialty_id,
         doctor_id=doctor_id,
-        date=date_filter
+        date=date_filter,
+        patient_id=current_user.user_id
     )
 
     # Lấy danh sách bệnh viện và chuyên khoa cho dropdown
@@ -611,6 +775,44 @@ def available_slots():
                            total_pages=total_pages,
                            total_slots=total_slots)
 
+# Danh sách chờ slot trống
+@app.route('/waitlist', methods=['GET', 'POST'])
+@login_required
+@role_only([RoleEnum.PATIENT])
+def waitlist():
+    if request.method == 'POST':
+        try:
+            date_from = datetime.strptime(request.form.get('date_from'), '%Y-%m-%d').date()
+            date_to = datetime.strptime(request.form.get('date_to'), '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            flash('Khoảng ngày không hợp lệ', 'error')
+            return redirect(url_for('waitlist'))
+
+        entry, message = dao_waitlist.join_waitlist(
+            current_user.user_id, date_from, date_to,
+            doctor_id=request.form.get('doctor_id', type=int),
+            specialty_id=request.form.get('specialty_id', type=int)
+        )
+        flash(message, 'success' if entry else 'error')
+        return redirect(url_for('waitlist'))
+
+    doctor_id = request.args.get('doctor_id', type=int)
+    return render_template('waitlist.html',
+                           entries=dao_waitlist.get_patient_waitlist(current_user.user_id),
+                           specialties=Specialty.query.order_by(Specialty.name).all(),
+                           selected_doctor=Doctor.query.get(doctor_id) if doctor_id else None,
+                           selected_specialty=request.args.get('specialty_id', type=int),
+                           current_date=date.today().strftime('%Y-%m-%d'))
+
+
+@app.route('/waitlist/<int:waitlist_id>/cancel', methods=['POST'])
+@login_required
+@role_only([RoleEnum.PATIENT])
+def cancel_waitlist(waitlist_id):
+    success, message = dao_waitlist.cancel_waitlist_entry(waitlist_id, current_user.user_id)
+    flash(message, 'success' if success else 'error')
+    return redirect(url_for('waitlist'))
+
 @app.route('/cancel_appointment/<int:appointment_id>', methods=['POST'])
 @login_required
 @role_only([RoleEnum.PATIENT])
@@ -633,13 +835,34 @@ def book_appointment(slot_id):
     if request.method == 'POST':
         reason = request.form.get('reason', '')
         consultation_type = request.form.get('consultation_type', ConsultationType.Offline.value)
+        repeat_weeks = request.form.get('repeat_weeks', 1, type=int)
+        slot_count = request.form.get('slot_count', 1, type=int)
+
+        # Đặt lặp lại hàng tuần từ slot này: cùng bác sĩ, cùng thứ và giờ
+        if repeat_weeks > 1:
+            appointments, message = dao_appointment.book_appointment_series(
+                patient_id=current_user.user_id,
+                doctor_id=slot.doctor_id,
+                day_of_week=dao_slot_generator.WEEKDAYS[slot.slot_date.weekday()],
+                start_time=slot.start_time,
+                count=repeat_weeks,
+                reason=reason,
+                consultation_type=ConsultationType(consultation_type),
+                start_date=slot.slot_date
+            )
+            if appointments:
+                flash(message, 'success')
+                return redirect(url_for('my_appointments'))
+            flash(message, 'error')
+            return redirect(url_for('book_appointment', slot_id=slot_id))
 
         # Đặt lịch
         appointment, message = dao_appointment.book_appointment(
             patient_id=current_user.user_id,
             slot_id=slot_id,
             reason=reason,
-            consultation_type=ConsultationType(consultation_type)
+            consultation_type=ConsultationType(consultation_type),
+            slot_count=slot_count
         )
 
         if appointment:
@@ -647,8 +870,100 @@ def book_appointment(slot_id):
             return redirect(url_for('appointment_detail', appointment_id=appointment.appointment_id))
         else:
             flash(message, 'error')
+            return redirect(url_for('available_slots'))
+
+    # Giữ chỗ slot trong lúc bệnh nhân điền form
+    if not dao_available_slot.hold_slot(slot_id, current_user.user_id):
+        flash('Slot đã được đặt hoặc đang được bệnh nhân khác giữ chỗ', 'error')
+        return redirect(url_for('available_slots'))
+
+    # Các thời lượng khám dài còn đặt được từ slot này (đủ slot liên tiếp)
+    free_slots = [run[0] for run in dao_available_slot.find_slot_runs(slot.doctor_id, slot.slot_date, 1,
+                                                                        current_user.user_id)]
+    slot_counts = [1] + [k for k in range(2, MAX_SLOTS_PER_APPOINTMENT + 1)
+                         if any(run[0].slot_id == slot_id for run in dao_available_slot.contiguous_runs(free_slots, k))]
+
+    return render_template('book_appointment.html', slot=slot, hold_minutes=SLOT_HOLD_MINUTES,
+                           series_max_count=SERIES_MAX_COUNT, slot_counts=slot_counts,
+                           slot_minutes=SLOT_DURATION_MINUTES)
+
 
-    return render_template('book_appointment.html', slot=slot)
+@app.route('/api/appointments/series', methods=['POST'])
+@login_required
+@role_only([RoleEnum.PATIENT])
+def api_book_appointment_series():
+    """
+    Đặt lịch hàng tuần. JSON: doctor_id, day_of_week (Monday..Sunday), start_time (HH:MM), count,
+    reason, consultation_type (Offline/Online), start_date (YYYY-MM-DD, không bắt buộc)
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        doctor_id = int(data['doctor_id'])
+        day_of_week = DayOfWeekEnum(data['day_of_week'])
+        start_time = datetime.strptime(data['start_time'], '%H:%M').time()
+        count = int(data['count'])
+        consultation_type = ConsultationType(data.get('consultation_type', ConsultationType.Offline.value))
+        start_date = datetime.strptime(data['start_date'], '%Y-%m-%d').date() if data.get('start_date') else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Dữ liệu không hợp lệ"}), 400
+
+    appointments, message = dao_appointment.book_appointment_series(
+        patient_id=current_user.user_id,
+        doctor_id=doctor_id,
+        day_of_week=day_of_week,
+        start_time=start_time,
+        count=count,
+        reason=data.get('reason', ''),
+        consultation_type=consultation_type,
+        start_date=start_date
+    )
+    if not appointments:
+        return jsonify({"error": message}), 409
+    return jsonify({
+        "message": message,
+        "appointments": [{"appointment_id": a.appointment_id,
+                          "appointment_time": a.appointment_time.isoformat()} for a in appointments]
+    }), 201
+
+
+@app.route('/api/appointments/assign', methods=['POST'])
+@login_required
+@role_only([RoleEnum.PATIENT])
+def api_book_any_doctor():
+    """
+    Đặt lịch với bác sĩ bất kỳ. JSON: hospital_id, specialty_id, date (YYYY-MM-DD),
+    from_time, to_time (HH:MM), reason, consultation_type (Offline/Online)
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        hospital_id = int(data['hospital_id'])
+        specialty_id = int(data['specialty_id'])
+        slot_date = datetime.strptime(data['date'], '%Y-%m-%d').date()
+        start_time = datetime.strptime(data['from_time'], '%H:%M').time()
+        end_time = datetime.strptime(data['to_time'], '%H:%M').time()
+        consultation_type = ConsultationType(data.get('consultation_type', ConsultationType.Offline.value))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Dữ liệu không hợp lệ"}), 400
+
+    appointment, message = dao_appointment.book_any_doctor(
+        patient_id=current_user.user_id,
+        hospital_id=hospital_id,
+        specialty_id=specialty_id,
+        slot_date=slot_date,
+        start_time=start_time,
+        end_time=end_time,
+        reason=data.get('reason', ''),
+        consultation_type=consultation_type
+    )
+    if not appointment:
+        return jsonify({"error": message}), 409
+    return jsonify({
+        "message": message,
+        "appointment_id": appointment.appointment_id,
+        "doctor_id": appointment.doctor_id,
+        "appointment_time": appointment.appointment_time.isoformat(),
+        "detail_url": url_for('appointment_detail', appointment_id=appointment.appointment_id)
+    }), 201
 
 
 @app.route('/appointment/<int:appointment_id>')
@@ -667,7 +982,66 @@ def appointment_detail(appointment_id):
         flash('Bạn không có quyền xem lịch hẹn này', 'error')
         return redirect(url_for('home'))
 
-    return render_template('appointment_detail.html', appointment=appointment)
+    # Hóa đơn còn phải thu (Pending hoặc đã quá hạn) vẫn thanh toán được
+    invoice_payable = bool(appointment.invoice and appointment.invoice.status in dao_invoice.OUTSTANDING)
+    return render_template('appointment_detail.html', appointment=appointment,
+                           invoice_payable=invoice_payable,
+                           queue_poll_seconds=WAITING_ROOM_POLL_SECONDS)
+
+
+# -------- Phòng chờ khám online --------
+
+@app.route('/api/appointments/<int:appointment_id>/check_in', methods=['POST'])
+@login_required
+@role_only([RoleEnum.PATIENT])
+def api_check_in(appointment_id):
+    position, message = dao_appointment.check_in_appointment(appointment_id, current_user.user_id)
+    if position is None:
+        return jsonify({"error": message}), 400
+    return jsonify(dao_appointment.get_queue_status(dao_appointment.get_appointment_by_id(appointment_id)))
+
+
+@app.route('/api/appointments/<int:appointment_id>/queue')
+@login_required
+def api_queue_position(appointment_id):
+    """Vị trí trong phòng chờ; trang chi tiết lịch hẹn hỏi lại mỗi WAITING_ROOM_POLL_SECONDS giây"""
+    appointment = dao_appointment.get_appointment_by_id(appointment_id)
+    if not appointment or current_user.user_id not in (appointment.patient_id, appointment.doctor_id):
+        return jsonify({"error": "Lịch hẹn không tồn tại"}), 404
+    response = jsonify(dao_appointment.get_queue_status(appointment))
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+@app.route('/waiting_room')
+@login_required
+@role_only([RoleEnum.DOCTOR])
+def waiting_room():
+    return render_template('waiting_room.html',
+                           appointments=dao_appointment.get_waiting_appointments(current_user.user_id),
+                           poll_seconds=WAITING_ROOM_POLL_SECONDS)
+
+
+@app.route('/waiting_room/next', methods=['POST'])
+@login_required
+@role_only([RoleEnum.DOCTOR])
+def waiting_room_next():
+    appointment, message = dao_appointment.call_next_patient(current_user.user_id)
+    if not appointment:
+        flash(message, 'error')
+        return redirect(url_for('waiting_room'))
+    flash(message, 'success')
+    return redirect(url_for('appointment_detail', appointment_id=appointment.appointment_id))
+
+
+@app.route('/waiting_room/<int:appointment_id>/priority', methods=['POST'])
+@login_required
+@role_only([RoleEnum.DOCTOR])
+def waiting_room_priority(appointment_id):
+    success, message = dao_appointment.set_queue_priority(appointment_id, current_user.user_id,
+                                                          request.form.get('priority', 0, type=int))
+    flash(message, 'success' if success else 'error')
+    return redirect(url_for('waiting_room'))
 
 
 @app.route('/my_appointments')
@@ -689,12 +1063,49 @@ def my_appointments():
         return redirect(url_for('home'))
 
     total_pages = math.ceil(total_appointments / per_page) if total_appointments > 0 else 1
+    calendar_url = url_for('calendar_feed', token=ical_service.make_feed_token(current_user.user_id),
+                           _external=True)
 
     return render_template(template,
                            appointments=appointments,
                            current_page=page,
                            total_pages=total_pages,
-                           total_appointments=total_appointments)
+                           total_appointments=total_appointments,
+                           calendar_url=calendar_url)
+
+
+@app.route('/calendar/<token>.ics')
+def calendar_feed(token):
+    """
+    Feed iCalendar cho ứng dụng lịch (Google Calendar, Outlook...). Không cần đăng nhập,
+    user được xác định bằng token ký. Nếu dữ liệu không đổi thì chỉ tốn một câu aggregate và trả 304.
+    """
+    user_id = ical_service.load_feed_token(token)
+    user = User.query.get(user_id) if user_id else None
+    if not user or user.role not in (RoleEnum.PATIENT, RoleEnum.DOCTOR):
+        abort(404)
+
+    version = dao_appointment.get_calendar_version(user.user_id, user.role)
+    etag = ical_service.make_etag(user.user_id, user.role, version)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    for_doctor = user.role == RoleEnum.DOCTOR
+    event_groups = [(ical_service.appointment_event(row, for_doctor)
+                     for row in dao_appointment.iter_calendar_appointments(user.user_id, user.role))]
+    if for_doctor:
+        event_groups.append(ical_service.free_slot_event(row)
+                            for row in dao_appointment.iter_calendar_free_slots(user.user_id))
+
+    name = f'Lịch khám - {user.first_name} {user.last_name}'
+    response = Response(stream_with_context(ical_service.stream_calendar(name, *event_groups)),
+                        mimetype='text/calendar')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Content-Disposition'] = 'inline; filename="lich-kham.ics"'
+    return response
 
 
 @app.route('/cancel_appointment/<int:appointment_id>', methods=['POST'])
@@ -771,9 +1182,6 @@ def reschedule_appointment(appointment_id):
         flash('Chỉ có thể sửa lịch hẹn trước 24 giờ', 'error')
         return redirect(url_for('appointment_detail', appointment_id=appointment_id))
 
-    # Lấy danh sách slot khả dụng
-    available_slots = dao_available_slot.get_available_slots()
-
     if request.method == 'POST':
         new_slot_id = request.form.get('new_slot_id')
         reason = request.form.get('reason', appointment.reason)
@@ -785,12 +1193,21 @@ def reschedule_appointment(appointment_id):
         if success:
             flash(message, 'success')
             return redirect(url_for('appointment_detail', appointment_id=appointment_id))
-        else:
-            flash(message, 'error')
+        flash(message, 'error')
+        return redirect(url_for('reschedule_appointment', appointment_id=appointment_id))
+
+    # Slot gợi ý: cùng bác sĩ, rồi cùng chuyên khoa, gần giờ hẹn cũ nhất; "Xem thêm" đọc PAGE_SIZE slot tiếp theo
+    # sau con trỏ của trang trước
+    after = dao_available_slot.parse_reschedule_cursor(request.args.get('after'))
+    available_slots, next_cursor = dao_available_slot.get_reschedule_candidates(
+        appointment, limit=PAGE_SIZE, patient_id=current_user.user_id, after=after
+    )
 
     return render_template('reschedule_appointment.html',
                            appointment=appointment,
-                           available_slots=available_slots)
+                           available_slots=available_slots,
+                           is_first_page=after is None,
+                           next_cursor=dao_available_slot.format_reschedule_cursor(next_cursor))
 
 
 
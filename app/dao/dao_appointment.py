@@ -1,27 +1,59 @@
+from sqlalchemy import update, select, func, insert, and_, or_
 from sqlalchemy.orm import joinedload
 from app import db
-from app.email_service import send_appointment_notification
+from app.dao import dao_available_slot, dao_waitlist, dao_slot_generator, dao_invoice, dao_doctor
+from app import slot_events, waiting_room, reminders, notifications, SERIES_MAX_COUNT, MAX_SLOTS_PER_APPOINTMENT, \
+    WAITING_ROOM_OPEN_MINUTES, NO_SHOW_GRACE_MINUTES, NO_SHOW_BATCH_SIZE, REMINDER_BATCH_SIZE
+from app.email_service import send_appointment_notification, send_series_notification, send_reminder_batch
 from app.models import AvailableSlot, Appointment, AppointmentStatus, Invoice, InvoiceStatus, Payment, PaymentStatus, \
-    ConsultationType , User, Doctor,Patient
-from datetime import datetime
+    ConsultationType , User, Doctor,Patient, Hospital, RoleEnum, AvailabilityException
+from datetime import datetime, timedelta
 
 
 #Đặt lịch
-def book_appointment(patient_id, slot_id, reason, consultation_type=ConsultationType.Offline):
+def book_appointment(patient_id, slot_id, reason, consultation_type=ConsultationType.Offline, slot_count=1):
+    """
+    Đặt lịch từ slot_id. slot_count > 1: lịch khám dài chiếm slot_count slot liên tiếp trong ngày,
+    tất cả được chiếm bằng một câu UPDATE có điều kiện.
+    """
+    if not 1 <= slot_count <= MAX_SLOTS_PER_APPOINTMENT:
+        return None, f"Số slot phải từ 1 đến {MAX_SLOTS_PER_APPOINTMENT}"
     try:
-        slot = AvailableSlot.query.get(slot_id)
-        if not slot:
-            return None, "Slot không tồn tại"
-
-        if slot.is_booked:
+        if slot_count > 1:
+            run = dao_available_slot.get_slot_run(slot_id, slot_count, patient_id)
+            if not run:
+                return None, f"Không còn đủ {slot_count} slot liên tiếp từ giờ đã chọn"
+            if not dao_available_slot.claim_slots([s.slot_id for s in run], patient_id):
+                db.session.rollback()
+                return None, "Một số slot vừa được bệnh nhân khác đặt, vui lòng thử lại"
+        # Chiếm slot trước bằng UPDATE có điều kiện, tránh 2 request cùng đặt một slot
+        elif not dao_available_slot.claim_slot(slot_id, patient_id):
+            slot = AvailableSlot.query.get(slot_id)
+            if not slot:
+                return None, "Slot không tồn tại"
+            if not slot.is_booked:
+                # Slot đặt vượt còn lượt: có thể chính bệnh nhân đã đặt lượt trước đó
+                if slot.booked_count and Appointment.query.filter_by(
+                        slot_id=slot_id, patient_id=patient_id, status=AppointmentStatus.Scheduled).first():
+                    return None, "Bạn đã đặt slot này"
+                return None, "Slot đang được bệnh nhân khác giữ chỗ"
             return None, "Slot đã được đặt"
+        else:
+            run = [AvailableSlot.query.get(slot_id)]
+
+        slot = run[0]
+        # Nếu slot được đề nghị từ danh sách chờ thì đánh dấu đã dùng
+        dao_waitlist.mark_offer_fulfilled(patient_id, slot_id)
 
         # Tạo appointment
+        end_time = run[-1].end_time
         appointment = Appointment(
             patient_id=patient_id,
             doctor_id=slot.doctor_id,
+            slot_id=slot.slot_id,
+            slot_count=len(run),
             appointment_time=datetime.combine(slot.slot_date, slot.start_time),
-            duration_minutes=(slot.end_time.hour * 60 + slot.end_time.minute) -
+            duration_minutes=(end_time.hour * 60 + end_time.minute) -
                              (slot.start_time.hour * 60 + slot.start_time.minute),
             reason=reason,
             consultation_type=consultation_type,
@@ -39,16 +71,129 @@ def book_appointment(patient_id, slot_id, reason, consultation_type=Consultation
             status=InvoiceStatus.Pending
         )
         db.session.add(invoice)
-
-        # Đánh dấu slot đã được đặt
-        slot.is_booked = True
+        dao_invoice.adjust_invoice_aging(invoice.due_date, invoice.amount, 1)
+        dao_available_slot.adjust_free_count(slot.doctor_id, slot.slot_date, -len(run))
+        dao_available_slot.refresh_next_slot(slot.doctor_id)
+        events = [slot_events.slot_event(slot_events.BOOKED, s) for s in run]
         db.session.commit()
+        for event in events:
+            slot_events.hub.publish(event)
         send_appointment_notification(appointment, 'booking')
         return appointment, "Đặt lịch thành công"
     except Exception as e:
         db.session.rollback()
         return None, f"Lỗi khi đặt lịch: {str(e)}"
 
+
+#Đặt lịch với bác sĩ bất kỳ
+def book_any_doctor(patient_id, hospital_id, specialty_id, slot_date, start_time, end_time, reason,
+                    consultation_type=ConsultationType.Offline):
+    """
+    Đặt lịch với bác sĩ bất kỳ của bệnh viện và chuyên khoa trong khung giờ: chọn bác sĩ có ít lịch đã đặt nhất
+    trong ngày (bộ đếm DoctorDayCount.booked_count), lấy slot sớm nhất trong khung giờ và chiếm như book_appointment.
+    Nếu slot vừa bị người khác chiếm thì thử slot kế tiếp theo cùng thứ tự.
+    """
+    if start_time >= end_time:
+        return None, "Khung giờ không hợp lệ"
+    slot_ids = [slot.slot_id for slot in dao_available_slot.find_assignable_slots(
+        hospital_id, specialty_id, slot_date, start_time, end_time, patient_id=patient_id)]
+    if not slot_ids:
+        return None, "Không còn bác sĩ nào trống trong khung giờ này"
+
+    for slot_id in slot_ids:
+        appointment, message = book_appointment(patient_id, slot_id, reason, consultation_type)
+        if appointment:
+            return appointment, message
+    return None, "Các slot phù hợp vừa được đặt hết, vui lòng thử lại"
+
+
+def _series_slots(doctor_id, dates, start_time, patient_id, now):
+    """Slot trống của bác sĩ đúng giờ start_time trong các ngày dates, một câu truy vấn trên (doctor_id, slot_date)"""
+    return (AvailableSlot.query
+            .options(joinedload(AvailableSlot.doctor))
+            .filter(AvailableSlot.doctor_id == doctor_id,
+                    AvailableSlot.slot_date.in_(dates),
+                    AvailableSlot.start_time == start_time,
+                    AvailableSlot.slot_start > now,
+                    AvailableSlot.is_booked == False,
+                    dao_available_slot.not_held_by_others(patient_id, now),
+                    dao_available_slot.outside_exceptions())
+            .order_by(AvailableSlot.slot_start)
+            .all())
+
+
+#Đặt lịch lặp lại hàng tuần
+def book_appointment_series(patient_id, doctor_id, day_of_week, start_time, count, reason,
+                            consultation_type=ConsultationType.Offline, start_date=None):
+    """
+    Đặt count buổi khám hàng tuần với cùng bác sĩ, cùng thứ và giờ, bắt đầu từ start_date.
+    Tất cả hoặc không: chiếm slot bằng một câu UPDATE, tạo lịch hẹn và hóa đơn bằng insert nhiều dòng,
+    một lần commit và một email tổng hợp.
+    """
+    if not 1 <= count <= SERIES_MAX_COUNT:
+        return None, f"Số buổi phải từ 1 đến {SERIES_MAX_COUNT}"
+    try:
+        now = datetime.now()
+        dates = dao_slot_generator.get_horizon_dates(day_of_week, start_date or now.date(), weeks=count)
+        slots = _series_slots(doctor_id, dates, start_time, patient_id, now)
+
+        found = {slot.slot_date for slot in slots}
+        missing = [d.strftime('%d/%m/%Y') for d in dates if d not in found]
+        if missing:
+            return None, f"Không còn slot trống vào các ngày: {', '.join(missing)}"
+
+        slot_ids = [slot.slot_id for slot in slots]
+        if not dao_available_slot.claim_slots(slot_ids, patient_id):
+            db.session.rollback()
+            return None, "Một số slot vừa được bệnh nhân khác đặt, vui lòng thử lại"
+        # Slot nào được đề nghị từ danh sách chờ thì đánh dấu đề nghị đã dùng
+        for slot_id in slot_ids:
+            dao_waitlist.mark_offer_fulfilled(patient_id, slot_id)
+
+        db.session.execute(insert(Appointment), [
+            dict(patient_id=patient_id,
+                 doctor_id=doctor_id,
+                 slot_id=slot.slot_id,
+                 appointment_time=datetime.combine(slot.slot_date, slot.start_time),
+                 duration_minutes=(slot.end_time.hour * 60 + slot.end_time.minute) -
+                                  (slot.start_time.hour * 60 + slot.start_time.minute),
+                 reason=reason,
+                 consultation_type=consultation_type,
+                 status=AppointmentStatus.Scheduled)
+            for slot in slots
+        ])
+        # Đọc lại id vừa tạo (MySQL không có RETURNING) để tạo hóa đơn
+        appointments = (Appointment.query
+                        .filter(Appointment.slot_id.in_(slot_ids),
+                                Appointment.patient_id == patient_id,
+                                Appointment.status == AppointmentStatus.Scheduled)
+                        .order_by(Appointment.appointment_time)
+                        .all())
+        fee = slots[0].doctor.consultation_fee
+        db.session.execute(insert(Invoice), [
+            dict(appointment_id=appointment.appointment_id,
+                 amount=fee,
+                 issue_date=now,
+                 due_date=appointment.appointment_time.date(),
+                 status=InvoiceStatus.Pending)
+            for appointment in appointments
+        ])
+        # Mỗi buổi một hạn thanh toán: tính lại tuổi nợ của các ngày này bằng một câu INSERT ... SELECT
+        dao_invoice.sync_invoice_aging([appointment.appointment_time.date() for appointment in appointments])
+
+        dao_available_slot.sync_day_counts(doctor_id, dates[0], dates[-1])
+        dao_available_slot.refresh_next_slot(doctor_id)
+        events = [slot_events.slot_event(slot_events.BOOKED, slot) for slot in slots]
+        db.session.commit()
+
+        for event in events:
+            slot_events.hub.publish(event)
+        send_series_notification(appointments)
+        return appointments, f"Đã đặt {len(appointments)} buổi khám hàng tuần"
+    except Exception as e:
+        db.session.rollback()
+        return None, f"Lỗi khi đặt lịch: {str(e)}"
+
 def get_appointment_by_id(appointment_id):
     return Appointment.query.get(appointment_id)
 
@@ -65,6 +210,17 @@ def get_doctor_appointments(doctor_id):
                 .all())
 
 
+def _release_appointment_slots(appointment):
+    """
+    Mở lại các slot của lịch hẹn: theo slot_id nếu một slot, theo khoảng giờ nếu là lịch khám dài.
+    Trả về danh sách slot đã mở. Không commit.
+    """
+    if (appointment.slot_count or 1) > 1:
+        end = appointment.appointment_time + timedelta(minutes=appointment.duration_minutes)
+        return dao_available_slot.release_slot_range(appointment.doctor_id, appointment.appointment_time, end)
+    return [appointment.slot] if dao_available_slot.release_slot(appointment.slot_id) else []
+
+
 #Hủy lịch
 def cancel_appointment(appointment_id, reason, cancelled_by_patient=True):
     try:
@@ -81,24 +237,13 @@ def cancel_appointment(appointment_id, reason, cancelled_by_patient=True):
         if time_difference.total_seconds() < 24 * 3600:
             return False, "Chỉ có thể hủy lịch hẹn trước 24 giờ"
 
-        # QUAN TRỌNG: Tìm slot dựa trên thời gian và bác sĩ
-        slot_date = appointment.appointment_time.date()
-        start_time = appointment.appointment_time.time()
-
-        # Tìm slot khớp với thông tin appointment
-        slot = AvailableSlot.query.filter_by(
-            doctor_id=appointment.doctor_id,
-            slot_date=slot_date,
-            start_time=start_time,
-            is_booked=True  # Chỉ tìm những slot đã được đặt
-        ).first()
-
-        if slot:
-            slot.is_booked = False  # Đặt lại trạng thái slot về chưa đặt
-            db.session.add(slot)
-            slot_found = True
-        else:
-            slot_found = False
+        # Mở lại slot theo slot_id đã lưu lúc đặt lịch
+        released = _release_appointment_slots(appointment)
+        if released:
+            dao_available_slot.adjust_free_count(appointment.doctor_id, appointment.appointment_time.date(),
+                                                 len(released))
+            dao_available_slot.refresh_next_slot(appointment.doctor_id)
+        events = [slot_events.slot_event(slot_events.RELEASED, slot) for slot in released]
 
         # Cập nhật trạng thái appointment
         if cancelled_by_patient:
@@ -110,13 +255,20 @@ def cancel_appointment(appointment_id, reason, cancelled_by_patient=True):
 
         # Cập nhật invoice status nếu có
         if appointment.invoice:
+            if appointment.invoice.status in dao_invoice.OUTSTANDING:
+                dao_invoice.adjust_invoice_aging(appointment.invoice.due_date, appointment.invoice.amount, -1)
             appointment.invoice.status = InvoiceStatus.Cancelled
 
         db.session.commit()
+        for event in events:
+            slot_events.hub.publish(event)
 
         send_appointment_notification(appointment, 'cancellation')
 
-        if slot_found:
+        if released:
+            # Đề nghị slot vừa mở cho người trong danh sách chờ
+            for slot in released:
+                dao_waitlist.offer_released_slot(slot.slot_id)
             return True, "Hủy lịch hẹn thành công và slot đã được mở lại"
         else:
             return True, "Hủy lịch hẹn thành công (không tìm thấy slot liên quan)"
@@ -125,6 +277,104 @@ def cancel_appointment(appointment_id, reason, cancelled_by_patient=True):
         db.session.rollback()
         return False, f"Lỗi khi hủy lịch hẹn: {str(e)}"
 
+def _doctor_range_filter(doctor_id, start_date, end_date, now):
+    """Lịch hẹn Scheduled chưa diễn ra của bác sĩ trong [start_date, end_date]"""
+    start = max(datetime.combine(start_date, datetime.min.time()), now)
+    end = datetime.combine(end_date + timedelta(days=1), datetime.min.time())
+    return (Appointment.doctor_id == doctor_id,
+            Appointment.status == AppointmentStatus.Scheduled,
+            Appointment.appointment_time >= start,
+            Appointment.appointment_time < end)
+
+
+def get_doctor_appointments_in_range(doctor_id, start_date, end_date, now=None):
+    """Các lịch hẹn sẽ bị hủy khi hủy lịch bác sĩ trong khoảng ngày (xem trước ở trang admin)"""
+    return (Appointment.query
+            .options(joinedload(Appointment.patient).joinedload(Patient.user))
+            .filter(*_doctor_range_filter(doctor_id, start_date, end_date, now or datetime.now()))
+            .order_by(Appointment.appointment_time)
+            .all())
+
+
+def cancel_doctor_appointments(doctor_id, start_date, end_date, reason, now=None):
+    """
+    Hủy mọi lịch hẹn chưa diễn ra của bác sĩ trong [start_date, end_date] (bác sĩ nghỉ đột xuất)
+    trong một transaction bằng vài câu lệnh theo tập: cập nhật lịch hẹn, hóa đơn, trả slot,
+    thêm ngày nghỉ để slot trống bị xóa và không được sinh lại. Đề nghị danh sách chờ cho các slot bị xóa
+    quay lại hàng chờ; sự kiện xóa slot được phát cho lịch SSE sau khi commit.
+    Email hủy lịch được đưa vào hàng đợi gửi nền theo lô (app.notifications) thay vì gửi tuần tự.
+    Trả về (số lịch hẹn đã hủy hoặc None nếu lỗi, message)
+    """
+    if end_date < start_date:
+        return None, "Ngày kết thúc phải sau ngày bắt đầu"
+    now = now or datetime.now()
+    try:
+        scope = _doctor_range_filter(doctor_id, start_date, end_date, now)
+        ids = db.session.execute(select(Appointment.appointment_id).where(*scope)).scalars().all()
+
+        # Slot sẽ bị ngày nghỉ xóa: mọi slot tương lai trong khoảng nếu có lịch hẹn được trả, không thì chỉ slot trống
+        removed = (AvailableSlot.doctor_id == doctor_id,
+                   AvailableSlot.slot_date >= start_date,
+                   AvailableSlot.slot_date <= end_date,
+                   AvailableSlot.slot_start > now)
+        if not ids:
+            removed += (AvailableSlot.is_booked == False, AvailableSlot.booked_count == 0)
+        slots = db.session.execute(
+            select(AvailableSlot).options(joinedload(AvailableSlot.doctor))
+            .where(*removed).order_by(AvailableSlot.slot_start)
+        ).scalars().all()
+        events = [slot_events.slot_event(slot_events.DELETED, slot) for slot in slots]
+        dao_waitlist.requeue_offers([slot.slot_id for slot in slots])
+
+        if ids:
+            due_dates = db.session.execute(
+                select(Invoice.due_date).distinct()
+                .where(Invoice.appointment_id.in_(ids), Invoice.status.in_(dao_invoice.OUTSTANDING))
+            ).scalars().all()
+            db.session.execute(
+                update(Appointment)
+                .where(Appointment.appointment_id.in_(ids), Appointment.status == AppointmentStatus.Scheduled)
+                .values(status=AppointmentStatus.CancelledByDoctor, cancellation_reason=reason, slot_id=None)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.execute(
+                update(Invoice)
+                .where(Invoice.appointment_id.in_(ids), Invoice.status.in_(dao_invoice.OUTSTANDING))
+                .values(status=InvoiceStatus.Cancelled)
+                .execution_options(synchronize_session=False)
+            )
+            dao_invoice.sync_invoice_aging(due_dates)
+
+            # Trả mọi lượt đặt của các slot tương lai trong khoảng để ngày nghỉ xóa được chúng
+            db.session.execute(
+                update(AvailableSlot)
+                .where(*removed)
+                .values(is_booked=False, booked_count=0, held_by=None, held_until=None)
+                .execution_options(synchronize_session=False)
+            )
+
+        queue_version = _bump_queue_version(doctor_id) if ids else None
+        db.session.add(AvailabilityException(doctor_id=doctor_id, start_date=start_date, end_date=end_date,
+                                             reason=reason))
+        deleted, booked = dao_doctor.invalidate_exception_slots(start_date, end_date, doctor_id=doctor_id)
+        db.session.commit()
+        db.session.expire_all()
+        for event in events:
+            slot_events.hub.publish(event)
+
+        if queue_version is not None:
+            with waiting_room.rooms.lock:
+                queue = waiting_room.rooms.advance(doctor_id, now.date(), queue_version)
+                if queue is not None:
+                    for appointment_id in ids:
+                        queue.remove(appointment_id)
+        notifications.outbox.enqueue('cancellation', ids)
+        return len(ids), f"Đã hủy {len(ids)} lịch hẹn và {deleted} slot trống"
+    except Exception as e:
+        db.session.rollback()
+        return None, f"Lỗi khi hủy lịch bác sĩ: {str(e)}"
+
+
 def complete_appointment(appointment_id):
     try:
         appointment = Appointment.query.get(appointment_id)
@@ -132,7 +382,13 @@ def complete_appointment(appointment_id):
             return False, "Lịch hẹn không tồn tại"
 
         appointment.status = AppointmentStatus.Completed
+        queue_version = _bump_queue_version(appointment.doctor_id)
         db.session.commit()
+        with waiting_room.rooms.lock:
+            queue = waiting_room.rooms.advance(appointment.doctor_id, appointment.appointment_time.date(),
+                                               queue_version)
+            if queue is not None:
+                queue.remove(appointment.appointment_id)
         return True, "Cập nhật trạng thái thành công"
 
     except Exception as e:
@@ -140,6 +396,170 @@ def complete_appointment(appointment_id):
         return False, f"Lỗi khi cập nhật trạng thái: {str(e)}"
 
 
+# ------------------ Phòng chờ khám online ---------------------
+
+
+def _waiting_rows(doctor_id, day):
+    """Lịch online trong ngày đã check-in, chưa được gọi vào khám"""
+    start = datetime.combine(day, datetime.min.time())
+    return (db.session.query(Appointment.appointment_id, Appointment.appointment_time,
+                             Appointment.checked_in_at, Appointment.queue_priority)
+            .filter(Appointment.doctor_id == doctor_id,
+                    Appointment.consultation_type == ConsultationType.Online,
+                    Appointment.status == AppointmentStatus.Scheduled,
+                    Appointment.appointment_time >= start,
+                    Appointment.appointment_time < start + timedelta(days=1),
+                    Appointment.checked_in_at.isnot(None),
+                    Appointment.called_at.is_(None))
+            .all())
+
+
+def _queue_version(doctor_id):
+    """Bộ đếm thay đổi phòng chờ của bác sĩ (một câu truy vấn theo khóa chính)"""
+    return db.session.execute(select(Doctor.queue_version).where(Doctor.doctor_id == doctor_id)).scalar()
+
+
+def _bump_queue_version(doctor_id):
+    """
+    Tăng bộ đếm thay đổi phòng chờ trong transaction hiện tại, trả về giá trị mới.
+    Câu UPDATE khóa dòng bác sĩ nên các worker tăng lần lượt, mỗi giá trị ứng với đúng một thay đổi.
+    """
+    db.session.execute(
+        update(Doctor)
+        .where(Doctor.doctor_id == doctor_id)
+        .values(queue_version=Doctor.queue_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    return _queue_version(doctor_id)
+
+
+def get_waiting_queue(doctor_id, day=None):
+    """
+    Hàng đợi trong bộ nhớ của bác sĩ cho ngày day. Mỗi lần đọc chỉ so Doctor.queue_version; heap chỉ được
+    dựng lại từ DB khi worker khác đã check-in, đổi ưu tiên hay gọi bệnh nhân.
+    Gọi khi đang giữ waiting_room.rooms.lock.
+    """
+    day = day or datetime.now().date()
+    return waiting_room.rooms.sync(doctor_id, day, _queue_version(doctor_id),
+                                   lambda: _waiting_rows(doctor_id, day))
+
+
+def get_queue_status(appointment):
+    """Vị trí của lịch hẹn trong phòng chờ (dùng cho endpoint polling)"""
+    status = {
+        "appointment_id": appointment.appointment_id,
+        "checked_in": appointment.checked_in_at is not None,
+        "called": appointment.called_at is not None,
+        "position": None,
+        "waiting": 0,
+    }
+    if appointment.consultation_type != ConsultationType.Online or \
+            appointment.appointment_time.date() != datetime.now().date():
+        return status
+    with waiting_room.rooms.lock:
+        queue = get_waiting_queue(appointment.doctor_id)
+        status["position"] = queue.position(appointment.appointment_id)
+        status["waiting"] = len(queue)
+    return status
+
+
+def get_waiting_appointments(doctor_id):
+    """Các lịch hẹn trong phòng chờ của bác sĩ, theo thứ tự sẽ được gọi"""
+    with waiting_room.rooms.lock:
+        ordered = get_waiting_queue(doctor_id).ordered()
+    if not ordered:
+        return []
+    appointments = {a.appointment_id: a for a in
+                    Appointment.query.filter(Appointment.appointment_id.in_(ordered)).all()}
+    return [appointments[appointment_id] for appointment_id in ordered if appointment_id in appointments]
+
+
+def check_in_appointment(appointment_id, patient_id, now=None):
+    """Bệnh nhân vào phòng chờ khám online. Trả về (vị trí trong hàng, message)"""
+    try:
+        now = now or datetime.now()
+        appointment = Appointment.query.get(appointment_id)
+        if not appointment or appointment.patient_id != patient_id:
+            return None, "Lịch hẹn không tồn tại"
+        if appointment.consultation_type != ConsultationType.Online:
+            return None, "Chỉ lịch khám online mới có phòng chờ"
+        if appointment.status != AppointmentStatus.Scheduled or appointment.called_at:
+            return None, "Lịch hẹn không còn ở trạng thái chờ khám"
+        if appointment.appointment_time.date() != now.date() or \
+                now < appointment.appointment_time - timedelta(minutes=WAITING_ROOM_OPEN_MINUTES):
+            return None, f"Chỉ có thể vào phòng chờ trong ngày khám, trước giờ hẹn {WAITING_ROOM_OPEN_MINUTES} phút"
+
+        with waiting_room.rooms.lock:
+            if not appointment.checked_in_at:
+                appointment.checked_in_at = now
+                queue_version = _bump_queue_version(appointment.doctor_id)
+                db.session.commit()
+                queue = waiting_room.rooms.advance(appointment.doctor_id, now.date(), queue_version)
+                if queue is not None:
+                    queue.push(appointment.appointment_id, appointment.appointment_time,
+                               appointment.checked_in_at, appointment.queue_priority)
+            position = get_waiting_queue(appointment.doctor_id, now.date()).position(appointment.appointment_id)
+        return position, "Đã vào phòng chờ"
+
+    except Exception as e:
+        db.session.rollback()
+        return None, f"Lỗi khi vào phòng chờ: {str(e)}"
+
+
+def set_queue_priority(appointment_id, doctor_id, priority):
+    """Bác sĩ ưu tiên một bệnh nhân (cấp cứu, tái khám ngắn...) trong hàng chờ"""
+    try:
+        appointment = Appointment.query.get(appointment_id)
+        if not appointment or appointment.doctor_id != doctor_id:
+            return False, "Lịch hẹn không tồn tại"
+
+        with waiting_room.rooms.lock:
+            appointment.queue_priority = priority
+            queue_version = _bump_queue_version(doctor_id)
+            db.session.commit()
+            queue = waiting_room.rooms.advance(doctor_id, appointment.appointment_time.date(), queue_version)
+            if queue is not None and appointment.appointment_id in queue:
+                queue.push(appointment.appointment_id, appointment.appointment_time,
+                           appointment.checked_in_at, priority)
+        return True, "Đã cập nhật độ ưu tiên"
+
+    except Exception as e:
+        db.session.rollback()
+        return False, f"Lỗi khi cập nhật độ ưu tiên: {str(e)}"
+
+
+def call_next_patient(doctor_id, now=None):
+    """
+    Gọi bệnh nhân tiếp theo trong phòng chờ. called_at chỉ được ghi nếu còn trống nên hai worker
+    không gọi trùng một bệnh nhân. Trả về (appointment, message)
+    """
+    try:
+        now = now or datetime.now()
+        with waiting_room.rooms.lock:
+            queue = get_waiting_queue(doctor_id, now.date())
+            while True:
+                appointment_id = queue.pop()
+                if appointment_id is None:
+                    return None, "Không có bệnh nhân nào trong phòng chờ"
+                result = db.session.execute(
+                    update(Appointment)
+                    .where(Appointment.appointment_id == appointment_id,
+                           Appointment.status == AppointmentStatus.Scheduled,
+                           Appointment.called_at.is_(None))
+                    .values(called_at=now)
+                )
+                if result.rowcount == 1:
+                    queue_version = _bump_queue_version(doctor_id)
+                    db.session.commit()
+                    # Phần tử đã được pop khỏi heap, chỉ cần ghi nhận phiên bản mới
+                    waiting_room.rooms.advance(doctor_id, now.date(), queue_version)
+                    return Appointment.query.get(appointment_id), "Đã gọi bệnh nhân vào khám"
+
+    except Exception as e:
+        db.session.rollback()
+        return None, f"Lỗi khi gọi bệnh nhân: {str(e)}"
+
+
 # ------------------sử lý với role DOCTOR ---------------------
 
 
@@ -166,35 +586,53 @@ def reschedule_appointment(appointment_id, new_slot_id, reason=None):
         if new_slot.is_booked:
             return False, "Slot mới đã được đặt"
 
-        # Tìm slot cũ dựa trên thời gian và bác sĩ
-        old_slot_date = appointment.appointment_time.date()
-        old_start_time = appointment.appointment_time.time()
-
-        # Tìm slot cũ khớp với thông tin appointment
-        old_slot = AvailableSlot.query.filter_by(
-            doctor_id=appointment.doctor_id,
-            slot_date=old_slot_date,
-            start_time=old_start_time,
-            is_booked=True
-        ).first()
+        # Lịch khám dài giữ nguyên số slot: chiếm dãy slot liên tiếp từ slot mới, không đủ thì từ chối
+        slot_count = appointment.slot_count or 1
+        if slot_count > 1:
+            run = dao_available_slot.get_slot_run(new_slot.slot_id, slot_count, appointment.patient_id)
+            if not run:
+                return False, f"Không còn đủ {slot_count} slot liên tiếp từ giờ mới đã chọn"
+            if not dao_available_slot.claim_slots([slot.slot_id for slot in run], appointment.patient_id):
+                db.session.rollback()
+                return False, "Slot mới đã được đặt"
+        elif dao_available_slot.claim_slot(new_slot.slot_id, appointment.patient_id):
+            run = [new_slot]
+        else:
+            return False, "Slot mới đã được đặt"
 
-        # Cập nhật thông tin appointment
+        # Mở lại các slot cũ
+        old_doctor_id = appointment.doctor_id
+        released = _release_appointment_slots(appointment)
+        if released:
+            dao_available_slot.adjust_free_count(old_doctor_id, appointment.appointment_time.date(), len(released))
+        dao_available_slot.adjust_free_count(new_slot.doctor_id, new_slot.slot_date, -len(run))
+        events = [slot_events.slot_event(slot_events.BOOKED, slot) for slot in run] + \
+                 [slot_events.slot_event(slot_events.RELEASED, slot) for slot in released]
+
+        # Cập nhật thông tin appointment theo dãy slot mới
+        end_time = run[-1].end_time
         appointment.doctor_id = new_slot.doctor_id
+        appointment.slot_id = new_slot.slot_id
+        appointment.slot_count = len(run)
         appointment.appointment_time = datetime.combine(new_slot.slot_date, new_slot.start_time)
-        appointment.duration_minutes = (new_slot.end_time.hour * 60 + new_slot.end_time.minute) - \
+        appointment.duration_minutes = (end_time.hour * 60 + end_time.minute) - \
                                        (new_slot.start_time.hour * 60 + new_slot.start_time.minute)
 
         if reason:
             appointment.reason = reason
+        # Giờ mới: nhắc lại theo giờ mới, trừ các lượt đã qua thời điểm nhắc (email đổi lịch thay cho chúng).
+        # Process nhắc hẹn thấy thay đổi này ở lần nạp cửa sổ kế tiếp (load_reminder_window)
+        appointment.reminder_mask = reminders.scheduler.passed_mask(appointment.appointment_time, current_time)
 
-        # Cập nhật trạng thái slot
-        if old_slot:
-            old_slot.is_booked = False  # Mở lại slot cũ
-
-        new_slot.is_booked = True  # Đặt slot mới
+        for doctor_id in {old_doctor_id, new_slot.doctor_id}:
+            dao_available_slot.refresh_next_slot(doctor_id)
 
         db.session.commit()
+        for event in events:
+            slot_events.hub.publish(event)
         send_appointment_notification(appointment, 'reschedule')
+        for slot in released:
+            dao_waitlist.offer_released_slot(slot.slot_id)
         return True, "Sửa lịch hẹn thành công"
 
     except Exception as e:
@@ -237,4 +675,258 @@ def count_patient_appointments(patient_id):
 
 def count_doctor_appointments(doctor_id):
     """Đếm tổng số lịch hẹn của bác sĩ"""
-    return Appointment.query.filter_by(doctor_id=doctor_id).count()
\ No newline at end of file
+    return Appointment.query.filter_by(doctor_id=doctor_id).count()
+
+
+# Feed iCalendar: lịch hẹn trong CALENDAR_PAST_DAYS ngày gần nhất trở đi
+CALENDAR_PAST_DAYS = 90
+CALENDAR_BATCH_SIZE = 500
+
+
+def get_calendar_version(user_id, role):
+    """
+    Phiên bản feed lịch của user: (updated_at lớn nhất, số dòng) của lịch hẹn,
+    cộng thêm slot trống sắp tới nếu là bác sĩ. Một câu truy vấn aggregate trên index,
+    dùng làm ETag để ứng dụng lịch không tải lại khi không có gì thay đổi.
+    """
+    owner = Appointment.doctor_id if role == RoleEnum.DOCTOR else Appointment.patient_id
+    columns = [
+        select(func.max(Appointment.updated_at)).where(owner == user_id).scalar_subquery(),
+        select(func.count(Appointment.appointment_id)).where(owner == user_id).scalar_subquery(),
+    ]
+    if role == RoleEnum.DOCTOR:
+        free_slots = (AvailableSlot.doctor_id == user_id,
+                      AvailableSlot.is_booked == False,
+                      AvailableSlot.slot_start > datetime.now())
+        columns += [
+            select(func.max(AvailableSlot.updated_at)).where(*free_slots).scalar_subquery(),
+            select(func.count(AvailableSlot.slot_id)).where(*free_slots).scalar_subquery(),
+        ]
+    row = db.session.execute(select(*columns)).one()
+    return '-'.join(str(value.timestamp() if isinstance(value, datetime) else value) for value in row)
+
+
+def iter_calendar_appointments(user_id, role):
+    """
+    Lịch hẹn cho feed iCalendar, đọc theo từng lô CALENDAR_BATCH_SIZE dòng (yield_per)
+    thay vì nạp hết. Chỉ lấy cột cần thiết; tên là tên bệnh nhân nếu user là bác sĩ và ngược lại.
+    """
+    if role == RoleEnum.DOCTOR:
+        owner, other = Appointment.doctor_id, Appointment.patient_id
+    else:
+        owner, other = Appointment.patient_id, Appointment.doctor_id
+    return (db.session.query(Appointment.appointment_id,
+                             Appointment.appointment_time,
+                             Appointment.duration_minutes,
+                             Appointment.reason,
+                             Appointment.status,
+                             Appointment.updated_at,
+                             User.first_name,
+                             User.last_name,
+                             Hospital.name.label('hospital_name'))
+            .join(User, User.user_id == other)
+            .join(Doctor, Doctor.doctor_id == Appointment.doctor_id)
+            .join(Hospital, Hospital.hospital_id == Doctor.hospital_id)
+            .filter(owner == user_id,
+                    Appointment.appointment_time >= datetime.now() - timedelta(days=CALENDAR_PAST_DAYS))
+            .order_by(Appointment.appointment_time)
+            .yield_per(CALENDAR_BATCH_SIZE))
+
+
+def iter_calendar_free_slots(doctor_id):
+    """Slot trống sắp tới của bác sĩ cho feed iCalendar, đọc theo lô"""
+    return (db.session.query(AvailableSlot.slot_id,
+                             AvailableSlot.slot_date,
+                             AvailableSlot.slot_start,
+                             AvailableSlot.end_time,
+                             AvailableSlot.updated_at)
+            .filter(AvailableSlot.doctor_id == doctor_id,
+                    AvailableSlot.is_booked == False,
+                    AvailableSlot.slot_start > datetime.now())
+            .order_by(AvailableSlot.slot_start)
+            .yield_per(CALENDAR_BATCH_SIZE))
+
+
+def _stale_scheduled_ids(cutoff, day_start, batch_size):
+    """
+    Một lô lịch hẹn còn Scheduled chưa được gọi vào khám: bệnh nhân chưa check-in và giờ hẹn trước cutoff,
+    hoặc đã check-in nhưng ngày khám đã qua (giờ hẹn trước day_start). Dùng idx_appointment_status_time
+    """
+    return db.session.execute(
+        select(Appointment.appointment_id)
+        .where(Appointment.status == AppointmentStatus.Scheduled,
+               Appointment.appointment_time < max(cutoff, day_start),
+               Appointment.called_at.is_(None),
+               or_(and_(Appointment.checked_in_at.is_(None), Appointment.appointment_time < cutoff),
+                   Appointment.appointment_time < day_start))
+        .order_by(Appointment.appointment_time)
+        .limit(batch_size)
+    ).scalars().all()
+
+
+def mark_no_shows(now=None, grace_minutes=NO_SHOW_GRACE_MINUTES, batch_size=NO_SHOW_BATCH_SIZE):
+    """
+    Chuyển lịch hẹn Scheduled đã quá giờ hẹn grace_minutes phút sang NoShow. Chạy định kỳ (cron).
+    Mỗi lô là một câu SELECT id và một lệnh UPDATE theo khóa chính, commit sau mỗi lô để không giữ khóa lâu.
+    Lịch hẹn bệnh nhân đã check-in phòng chờ chỉ bị đánh dấu khi hết ngày khám mà vẫn chưa được gọi,
+    để không bị quét lại mãi ở các lần chạy sau.
+    Trả về (số lịch hẹn đã chuyển, message)
+    """
+    now = now or datetime.now()
+    cutoff = now - timedelta(minutes=grace_minutes)
+    day_start = datetime.combine(now.date(), datetime.min.time())
+    total = 0
+    try:
+        while True:
+            ids = _stale_scheduled_ids(cutoff, day_start, batch_size)
+            if not ids:
+                break
+            # Kiểm tra lại trạng thái: lịch hẹn có thể vừa được hoàn thành/hủy giữa SELECT và UPDATE
+            result = db.session.execute(
+                update(Appointment)
+                .where(Appointment.appointment_id.in_(ids), Appointment.status == AppointmentStatus.Scheduled)
+                .values(status=AppointmentStatus.NoShow)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            total += result.rowcount
+            if len(ids) < batch_size:
+                break
+        return total, f"Đã chuyển {total} lịch hẹn sang không đến khám"
+    except Exception as e:
+        db.session.rollback()
+        return total, f"Lỗi khi quét lịch hẹn không đến khám: {str(e)}"
+
+
+# ------------------ Nhắc hẹn ---------------------
+
+
+def _reminder_rows(start, end):
+    """
+    Lịch hẹn Scheduled có lượt nhắc (REMINDER_HOURS giờ trước giờ hẹn) rơi vào [start, end):
+    một truy vấn theo khoảng appointment_time (idx_appointment_status_time)
+    """
+    ranges = [and_(Appointment.appointment_time >= start + timedelta(hours=hours),
+                   Appointment.appointment_time < end + timedelta(hours=hours))
+              for hours in reminders.scheduler.hours]
+    return (db.session.query(Appointment.appointment_id, Appointment.appointment_time,
+                             Appointment.created_at, Appointment.reminder_mask)
+            .filter(Appointment.status == AppointmentStatus.Scheduled, or_(*ranges))
+            .all())
+
+
+def load_reminder_window(now=None):
+    """Nạp các lượt nhắc của cửa sổ kế tiếp vào heap, bỏ lượt đã gửi. Trả về số lịch hẹn đã đọc"""
+    now = now or datetime.now()
+    scheduler = reminders.scheduler
+    start, end = scheduler.load_range(now)
+    rows = _reminder_rows(start, end)
+    with scheduler.lock:
+        for row in rows:
+            for hours in scheduler.hours:
+                fire_at = row.appointment_time - timedelta(hours=hours)
+                if not start <= fire_at < end or row.reminder_mask & scheduler.bit(hours):
+                    continue
+                # Đặt lịch sau thời điểm nhắc thì email xác nhận đã thay cho lượt nhắc này
+                if row.created_at and row.created_at > fire_at:
+                    continue
+                scheduler.push(row.appointment_id, row.appointment_time, hours)
+        scheduler.loaded_until = end
+    return len(rows)
+
+
+def get_appointments_for_email(appointment_ids):
+    """Lịch hẹn kèm bệnh nhân, bác sĩ, bệnh viện cho một lô email (một truy vấn)"""
+    return (Appointment.query
+            .options(joinedload(Appointment.patient).joinedload(Patient.user),
+                     joinedload(Appointment.doctor).joinedload(Doctor.user),
+                     joinedload(Appointment.doctor).joinedload(Doctor.hospital))
+            .filter(Appointment.appointment_id.in_(appointment_ids))
+            .all())
+
+
+def send_due_reminders(now=None, batch_size=REMINDER_BATCH_SIZE):
+    """
+    Gửi các lượt nhắc đã đến hạn, mỗi lô batch_size email qua một kết nối SMTP và một lệnh UPDATE
+    đánh dấu reminder_mask. Lịch hẹn được đọc lại trước khi gửi: lịch đã hủy/đổi giờ/đã nhắc thì bỏ qua.
+    Trả về (số email đã gửi, message)
+    """
+    scheduler = reminders.scheduler
+    due = scheduler.pop_due(now or datetime.now())
+    by_hours = {}
+    for appointment_id, appointment_time, hours in due:
+        by_hours.setdefault(hours, {})[appointment_id] = appointment_time
+
+    total = 0
+    try:
+        for hours, expected in by_hours.items():
+            bit = scheduler.bit(hours)
+            ids = list(expected)
+            for i in range(0, len(ids), batch_size):
+                appointments = [a for a in get_appointments_for_email(ids[i:i + batch_size])
+                                if a.status == AppointmentStatus.Scheduled
+                                and a.appointment_time == expected[a.appointment_id] and not a.reminder_mask & bit]
+                sent = send_reminder_batch(appointments, hours) if appointments else []
+                if sent:
+                    db.session.execute(
+                        update(Appointment)
+                        .where(Appointment.appointment_id.in_(sent))
+                        .values(reminder_mask=Appointment.reminder_mask.op('|')(bit))
+                        .execution_options(synchronize_session=False)
+                    )
+                db.session.commit()
+                total += len(sent)
+        return total, f"Đã gửi {total} email nhắc hẹn"
+    except Exception as e:
+        db.session.rollback()
+        return total, f"Lỗi khi gửi nhắc hẹn: {str(e)}"
+
+
+def run_reminder_tick(now=None):
+    """Một vòng của process nhắc hẹn: nạp cửa sổ mới khi cần rồi gửi các lượt đã đến hạn"""
+    now = now or datetime.now()
+    if reminders.scheduler.needs_load(now):
+        load_reminder_window(now)
+    return send_due_reminders(now)
+
+
+def backfill_appointment_slot_ids(batch_size=500):
+    """
+    Điền slot_id cho các lịch hẹn cũ (trước khi có cột slot_id) theo từng lô,
+    mỗi lô một câu SELECT slot và một lệnh UPDATE nhiều dòng, commit sau mỗi lô
+    """
+    total = 0
+    last_id = 0
+    try:
+        while True:
+            batch = (db.session.query(Appointment.appointment_id, Appointment.doctor_id,
+                                      Appointment.appointment_time)
+                     .filter(Appointment.slot_id.is_(None), Appointment.appointment_id > last_id)
+                     .order_by(Appointment.appointment_id)
+                     .limit(batch_size)
+                     .all())
+            if not batch:
+                break
+            last_id = batch[-1].appointment_id
+
+            slots = (db.session.query(AvailableSlot.slot_id, AvailableSlot.doctor_id,
+                                      AvailableSlot.slot_date, AvailableSlot.start_time)
+                     .filter(AvailableSlot.doctor_id.in_({a.doctor_id for a in batch}),
+                             AvailableSlot.slot_date.in_({a.appointment_time.date() for a in batch}))
+                     .all())
+            slot_by_key = {(s.doctor_id, s.slot_date, s.start_time): s.slot_id for s in slots}
+
+            mappings = []
+            for a in batch:
+                slot_id = slot_by_key.get((a.doctor_id, a.appointment_time.date(), a.appointment_time.time()))
+                if slot_id:
+                    mappings.append({'appointment_id': a.appointment_id, 'slot_id': slot_id})
+
+            if mappings:
+                db.session.execute(update(Appointment), mappings)
+            db.session.commit()
+            total += len(mappings)
+        return total, f"Đã cập nhật slot_id cho {total} lịch hẹn"
+    except Exception as e:
+        db.session.rollback()
+        return total, f"Lỗi khi cập nhật slot_id: {str(e)}"
@@ -1,26 +1,26 @@
-from datetime import datetime
-from app.models import AvailableSlot, Doctor, User, Hospital, Specialty
+import calendar
+import heapq
+from datetime import datetime, date, timedelta
+from app.models import AvailableSlot, Doctor, User, Hospital, Specialty, DoctorNextSlot, DoctorDayCount, \
+    AvailabilityException, Appointment, AppointmentStatus
 from app.extensions import db
-from sqlalchemy import desc
+from app import SLOT_HOLD_MINUTES
+from sqlalchemy import desc, update, insert, select, exists, or_, and_, func, case, true
+from sqlalchemy.orm import joinedload
 
 
 #Lấy tất cả slot khả dụng với thời gian lớn hơn hiện tại
 
 def get_available_slots():
     now = datetime.now()
-    current_date = now.date()
-    current_time = now.time()
     available_slots = (AvailableSlot.query
                        .join(Doctor, AvailableSlot.doctor_id == Doctor.doctor_id)
                        .join(User, Doctor.doctor_id == User.user_id)
                        .join(Hospital, Doctor.hospital_id == Hospital.hospital_id)
                        .join(Specialty, Doctor.specialty_id == Specialty.specialty_id)
                        .filter(AvailableSlot.is_booked == 0)
-                       .filter(
-        (AvailableSlot.slot_date > current_date) |
-        ((AvailableSlot.slot_date == current_date) &
-         (AvailableSlot.start_time > current_time))
-    )
+                       .filter(AvailableSlot.slot_start > now)
+                       .filter(outside_exceptions())
                        .order_by(desc(AvailableSlot.slot_date), AvailableSlot.start_time)  # <--- thay đổi ở đây
                        .all())
 
@@ -28,19 +28,14 @@ def get_available_slots():
 
 def get_available_slots_by_filters(hospital_id=None, specialty_id=None, doctor_id=None, date=None):
     now = datetime.now()
-    current_date = now.date()
-    current_time = now.time()
     query = (AvailableSlot.query
              .join(Doctor, AvailableSlot.doctor_id == Doctor.doctor_id)
              .join(User, Doctor.doctor_id == User.user_id)
              .join(Hospital, Doctor.hospital_id == Hospital.hospital_id)
              .join(Specialty, Doctor.specialty_id == Specialty.specialty_id)
              .filter(AvailableSlot.is_booked == 0)
-             .filter(
-                 (AvailableSlot.slot_date > current_date) |
-                 ((AvailableSlot.slot_date == current_date) &
-                  (AvailableSlot.start_time > current_time))
-             ))
+             .filter(AvailableSlot.slot_start > now)
+             .filter(outside_exceptions()))
     if hospital_id:
         query = query.filter(Doctor.hospital_id == hospital_id)
     if specialty_id:
@@ -50,14 +45,39 @@ def get_available_slots_by_filters(hospital_id=None, specialty_id=None, doctor_i
     if date:
         query = query.filter(AvailableSlot.slot_date == date)
 
-    return query.order_by(desc(AvailableSlot.slot_date), desc(AvailableSlot.start_time))
+    # Ngày mới nhất trước, trong ngày theo giờ tăng dần
+    return query.order_by(desc(AvailableSlot.slot_date), AvailableSlot.slot_start)
+
+
+def not_held_by_others(patient_id=None, now=None):
+    """
+    Điều kiện slot không bị bệnh nhân khác giữ chỗ (chưa giữ, hết hạn giữ, hoặc do chính patient_id giữ)
+    """
+    now = now or datetime.now()
+    condition = or_(AvailableSlot.held_until.is_(None), AvailableSlot.held_until <= now)
+    if patient_id:
+        condition = or_(condition, AvailableSlot.held_by == patient_id)
+    return condition
+
+
+def outside_exceptions():
+    """
+    Điều kiện slot không rơi vào ngày nghỉ của bác sĩ hoặc của bệnh viện (NOT EXISTS theo index
+    (doctor_id|hospital_id, start_date, end_date)). Nếu câu truy vấn ngoài đã join Doctor thì dùng luôn bảng đó.
+    """
+    doctor_off = exists().where(AvailabilityException.doctor_id == AvailableSlot.doctor_id,
+                                AvailabilityException.start_date <= AvailableSlot.slot_date,
+                                AvailabilityException.end_date >= AvailableSlot.slot_date)
+    hospital_off = exists().where(AvailabilityException.hospital_id == Doctor.hospital_id,
+                                  Doctor.doctor_id == AvailableSlot.doctor_id,
+                                  AvailabilityException.start_date <= AvailableSlot.slot_date,
+                                  AvailabilityException.end_date >= AvailableSlot.slot_date)
+    return and_(~doctor_off, ~hospital_off)
 
 
 def get_available_slots_by_filters_paginated(hospital_id=None, specialty_id=None, doctor_id=None, date=None, page=1,
-                                             per_page=6):
+                                             per_page=6, patient_id=None):
     now = datetime.now()
-    current_date = now.date()
-    current_time = now.time()
 
     query = (AvailableSlot.query
     .join(Doctor, AvailableSlot.doctor_id == Doctor.doctor_id)
@@ -65,11 +85,9 @@ def get_available_slots_by_filters_paginated(hospital_id=None, specialty_id=None
     .join(Hospital, Doctor.hospital_id == Hospital.hospital_id)
     .join(Specialty, Doctor.specialty_id == Specialty.specialty_id)
     .filter(AvailableSlot.is_booked == 0)
-    .filter(
-        (AvailableSlot.slot_date > current_date) |
-        ((AvailableSlot.slot_date == current_date) &
-         (AvailableSlot.start_time > current_time))
-    ))
+    .filter(AvailableSlot.slot_start > now)
+    .filter(outside_exceptions())
+    .filter(not_held_by_others(patient_id, now)))
 
     if hospital_id:
         query = query.filter(Doctor.hospital_id == hospital_id)
@@ -81,25 +99,22 @@ def get_available_slots_by_filters_paginated(hospital_id=None, specialty_id=None
         query = query.filter(AvailableSlot.slot_date == date)
 
     # Phân trang
-    return query.order_by(desc(AvailableSlot.slot_date), desc(AvailableSlot.start_time)) \
+    return query.order_by(desc(AvailableSlot.slot_date), AvailableSlot.slot_start) \
         .offset((page - 1) * per_page) \
         .limit(per_page) \
         .all()
 
 
-def count_available_slots_by_filters(hospital_id=None, specialty_id=None, doctor_id=None, date=None):
+def count_available_slots_by_filters(hospital_id=None, specialty_id=None, doctor_id=None, date=None,
+                                     patient_id=None):
     now = datetime.now()
-    current_date = now.date()
-    current_time = now.time()
 
     query = (AvailableSlot.query
     .join(Doctor, AvailableSlot.doctor_id == Doctor.doctor_id)
     .filter(AvailableSlot.is_booked == 0)
-    .filter(
-        (AvailableSlot.slot_date > current_date) |
-        ((AvailableSlot.slot_date == current_date) &
-         (AvailableSlot.start_time > current_time))
-    ))
+    .filter(AvailableSlot.slot_start > now)
+    .filter(outside_exceptions())
+    .filter(not_held_by_others(patient_id, now)))
 
     if hospital_id:
         query = query.filter(Doctor.hospital_id == hospital_id)
@@ -110,4 +125,576 @@ def count_available_slots_by_filters(hospital_id=None, specialty_id=None, doctor
     if date:
         query = query.filter(AvailableSlot.slot_date == date)
 
-    return query.count()
\ No newline at end of file
+    return query.count()
+
+
+def not_booked_by(patient_id=None):
+    """
+    Điều kiện bệnh nhân chưa có lịch hẹn ở slot này (slot đặt vượt nhận nhiều bệnh nhân,
+    nhưng không nhận hai lượt của cùng một người)
+    """
+    if not patient_id:
+        return true()
+    return ~exists().where(Appointment.slot_id == AvailableSlot.slot_id,
+                           Appointment.patient_id == patient_id,
+                           Appointment.status == AppointmentStatus.Scheduled)
+
+
+def _claim_values():
+    """
+    Tăng booked_count thêm 1, slot kín (is_booked) khi đạt capacity. is_booked được gán trước
+    để cả MySQL (gán từ trái sang phải) lẫn các CSDL khác đều tính theo booked_count cũ.
+    """
+    return ((AvailableSlot.is_booked, case((AvailableSlot.booked_count + 1 >= AvailableSlot.capacity, True),
+                                           else_=False)),
+            (AvailableSlot.booked_count, AvailableSlot.booked_count + 1),
+            (AvailableSlot.held_by, None),
+            (AvailableSlot.held_until, None))
+
+
+def _release_values():
+    """Trả lại một lượt đặt: slot không còn kín"""
+    return {'is_booked': False,
+            'booked_count': case((AvailableSlot.booked_count > 0, AvailableSlot.booked_count - 1), else_=0)}
+
+
+def claim_slot(slot_id, patient_id=None):
+    """
+    Chiếm một lượt của slot bằng một câu UPDATE có điều kiện slot chưa kín (booked_count < capacity)
+    và không bị người khác giữ chỗ. Khi nhiều request cùng đặt lượt cuối của slot chỉ một request
+    cập nhật được dòng, không cần khóa dòng trong lúc chạy code Python. Không commit.
+    """
+    result = db.session.execute(
+        update(AvailableSlot)
+        .where(AvailableSlot.slot_id == slot_id,
+               AvailableSlot.is_booked == False,
+               AvailableSlot.booked_count < AvailableSlot.capacity,
+               not_held_by_others(patient_id),
+               not_booked_by(patient_id))
+        .ordered_values(*_claim_values())
+    )
+    return result.rowcount == 1
+
+
+def claim_slots(slot_ids, patient_id=None):
+    """
+    Chiếm một lượt của nhiều slot bằng một câu UPDATE ... WHERE slot_id IN (...) có điều kiện như claim_slot.
+    Trả về True chỉ khi chiếm được tất cả; nếu không nơi gọi phải rollback. Không commit.
+    """
+    result = db.session.execute(
+        update(AvailableSlot)
+        .where(AvailableSlot.slot_id.in_(slot_ids),
+               AvailableSlot.is_booked == False,
+               AvailableSlot.booked_count < AvailableSlot.capacity,
+               not_held_by_others(patient_id),
+               not_booked_by(patient_id))
+        .ordered_values(*_claim_values())
+    )
+    return result.rowcount == len(slot_ids)
+
+
+def release_slot(slot_id):
+    """
+    Trả lại một lượt đặt của slot bằng UPDATE theo khóa chính. Không commit.
+    """
+    if not slot_id:
+        return False
+    result = db.session.execute(
+        update(AvailableSlot)
+        .where(AvailableSlot.slot_id == slot_id,
+               or_(AvailableSlot.is_booked == True, AvailableSlot.booked_count > 0))
+        .values(**_release_values())
+    )
+    return result.rowcount == 1
+
+
+def release_slot_range(doctor_id, start, end):
+    """
+    Trả lại một lượt đặt của các slot có giờ bắt đầu trong [start, end) (lịch hẹn nhiều slot).
+    Trả về danh sách slot đã mở. Không commit.
+    """
+    slots = (AvailableSlot.query
+             .filter(AvailableSlot.doctor_id == doctor_id,
+                     AvailableSlot.slot_start >= start,
+                     AvailableSlot.slot_start < end,
+                     or_(AvailableSlot.is_booked == True, AvailableSlot.booked_count > 0))
+             .all())
+    if not slots:
+        return []
+    db.session.execute(
+        update(AvailableSlot)
+        .where(AvailableSlot.slot_id.in_([slot.slot_id for slot in slots]))
+        .values(**_release_values())
+    )
+    return slots
+
+
+def contiguous_runs(slots, k):
+    """
+    Các dãy k slot liên tiếp (slot sau bắt đầu đúng lúc slot trước kết thúc, cùng ngày)
+    trong danh sách slot đã sắp theo (slot_date, start_time). Một lượt duyệt, mỗi vị trí bắt đầu là một dãy.
+    """
+    runs = []
+    current = []
+    for slot in slots:
+        if current and (slot.slot_date != current[-1].slot_date or slot.start_time != current[-1].end_time):
+            current = []
+        current.append(slot)
+        if len(current) >= k:
+            runs.append(current[-k:])
+    return runs
+
+
+def find_slot_runs(doctor_id, slot_date, k, patient_id=None):
+    """
+    Tìm các dãy k slot trống liên tiếp của bác sĩ trong một ngày cho lịch khám dài.
+    Một câu truy vấn theo index (doctor_id, slot_date, is_booked) sắp theo start_time, sau đó gom dãy liên tiếp.
+    """
+    now = datetime.now()
+    slots = (AvailableSlot.query
+             .filter(AvailableSlot.doctor_id == doctor_id,
+                     AvailableSlot.slot_date == slot_date,
+                     AvailableSlot.is_booked == False,
+                     AvailableSlot.slot_start > now,
+                     not_held_by_others(patient_id, now),
+                     outside_exceptions())
+             .order_by(AvailableSlot.start_time)
+             .all())
+    return contiguous_runs(slots, k)
+
+
+def get_slot_run(slot_id, k, patient_id=None):
+    """Dãy k slot trống liên tiếp bắt đầu từ slot_id, None nếu không đủ"""
+    slot = AvailableSlot.query.get(slot_id)
+    if not slot:
+        return None
+    for run in find_slot_runs(slot.doctor_id, slot.slot_date, k, patient_id):
+        if run[0].slot_id == slot_id:
+            return run
+    return None
+
+
+def hold_slot(slot_id, patient_id, minutes=SLOT_HOLD_MINUTES):
+    """
+    Giữ chỗ slot trong vài phút cho bệnh nhân đang mở form đặt lịch.
+    Giữ lại slot của chính mình sẽ gia hạn thời gian giữ.
+    """
+    try:
+        held = hold_slot_for(slot_id, patient_id, minutes)
+        db.session.commit()
+        return held
+    except Exception:
+        db.session.rollback()
+        return False
+
+
+def hold_slot_for(slot_id, patient_id, minutes):
+    """
+    Câu UPDATE giữ chỗ có điều kiện (slot chưa đặt, không bị người khác giữ).
+    Giữ lại slot của chính mình không rút ngắn hạn giữ đang có (vd. đề nghị từ danh sách chờ). Không commit.
+    """
+    now = datetime.now()
+    until = now + timedelta(minutes=minutes)
+    result = db.session.execute(
+        update(AvailableSlot)
+        .where(AvailableSlot.slot_id == slot_id,
+               AvailableSlot.is_booked == False,
+               not_held_by_others(patient_id, now))
+        .values(held_by=patient_id,
+                held_until=case((and_(AvailableSlot.held_by == patient_id, AvailableSlot.held_until > until),
+                                 AvailableSlot.held_until), else_=until))
+    )
+    return result.rowcount == 1
+
+
+def release_expired_holds():
+    """
+    Xóa toàn bộ giữ chỗ đã hết hạn bằng một câu UPDATE
+    """
+    try:
+        result = db.session.execute(
+            update(AvailableSlot)
+            .where(AvailableSlot.held_until <= datetime.now())
+            .values(held_by=None, held_until=None)
+        )
+        db.session.commit()
+        return result.rowcount
+    except Exception:
+        db.session.rollback()
+        return 0
+
+
+def backfill_slot_start(batch_size=5000):
+    """
+    Điền slot_start cho các slot cũ (trước khi có cột slot_start) theo từng lô, commit sau mỗi lô
+    """
+    total = 0
+    last_id = 0
+    try:
+        while True:
+            batch = (db.session.query(AvailableSlot.slot_id, AvailableSlot.slot_date, AvailableSlot.start_time)
+                     .filter(AvailableSlot.slot_start.is_(None), AvailableSlot.slot_id > last_id)
+                     .order_by(AvailableSlot.slot_id)
+                     .limit(batch_size)
+                     .all())
+            if not batch:
+                break
+            last_id = batch[-1].slot_id
+
+            db.session.execute(update(AvailableSlot), [
+                {'slot_id': s.slot_id, 'slot_start': datetime.combine(s.slot_date, s.start_time)}
+                for s in batch
+            ])
+            db.session.commit()
+            total += len(batch)
+        return total, f"Đã cập nhật slot_start cho {total} slot"
+    except Exception as e:
+        db.session.rollback()
+        return total, f"Lỗi khi cập nhật slot_start: {str(e)}"
+
+
+def backfill_slot_booked_count():
+    """
+    Điền booked_count cho các slot cũ (trước khi có cột capacity/booked_count): slot đã đặt là kín một lượt
+    """
+    try:
+        result = db.session.execute(
+            update(AvailableSlot)
+            .where(AvailableSlot.is_booked == True, AvailableSlot.booked_count == 0)
+            .values(booked_count=AvailableSlot.capacity)
+        )
+        db.session.commit()
+        return result.rowcount, f"Đã cập nhật booked_count cho {result.rowcount} slot"
+    except Exception as e:
+        db.session.rollback()
+        return 0, f"Lỗi khi cập nhật booked_count: {str(e)}"
+
+
+def find_next_free_slot(doctor_id, after=None):
+    """
+    Slot chưa đặt sớm nhất của bác sĩ sau thời điểm after (dùng index doctor_id, is_booked, slot_start)
+    """
+    after = after or datetime.now()
+    return (db.session.query(AvailableSlot.slot_id, AvailableSlot.slot_start)
+            .filter(AvailableSlot.doctor_id == doctor_id,
+                    AvailableSlot.is_booked == False,
+                    AvailableSlot.slot_start > after)
+            .order_by(AvailableSlot.slot_start)
+            .first())
+
+
+def refresh_next_slot(doctor_id):
+    """
+    Cập nhật slot trống sớm nhất của một bác sĩ sau khi đặt/hủy/đổi lịch. Không commit.
+    """
+    if not doctor_id:
+        return
+    row = find_next_free_slot(doctor_id)
+    db.session.merge(DoctorNextSlot(doctor_id=doctor_id,
+                                    slot_id=row.slot_id if row else None,
+                                    slot_start=row.slot_start if row else None))
+
+
+def sync_next_slots(doctor_id=None, doctor_ids=None):
+    """
+    Tính lại bảng DoctorNextSlot cho một bác sĩ, danh sách bác sĩ doctor_ids (hoặc tất cả)
+    bằng một truy vấn GROUP BY. Không commit.
+    """
+    now = datetime.now()
+    first = (db.session.query(AvailableSlot.doctor_id, func.min(AvailableSlot.slot_start).label('slot_start'))
+             .filter(AvailableSlot.is_booked == False, AvailableSlot.slot_start > now))
+    if doctor_id:
+        first = first.filter(AvailableSlot.doctor_id == doctor_id)
+    if doctor_ids is not None:
+        first = first.filter(AvailableSlot.doctor_id.in_(doctor_ids))
+    first = first.group_by(AvailableSlot.doctor_id).subquery()
+
+    rows = (db.session.query(AvailableSlot.doctor_id, AvailableSlot.slot_id, AvailableSlot.slot_start)
+            .join(first, (AvailableSlot.doctor_id == first.c.doctor_id) &
+                  (AvailableSlot.slot_start == first.c.slot_start))
+            .all())
+
+    stale = DoctorNextSlot.query
+    if doctor_id:
+        stale = stale.filter(DoctorNextSlot.doctor_id == doctor_id)
+    if doctor_ids is not None:
+        stale = stale.filter(DoctorNextSlot.doctor_id.in_(doctor_ids))
+    stale.delete(synchronize_session=False)
+    if rows:
+        db.session.execute(insert(DoctorNextSlot), [
+            {'doctor_id': r.doctor_id, 'slot_id': r.slot_id, 'slot_start': r.slot_start} for r in rows
+        ])
+    return len(rows)
+
+
+def rebuild_next_slots():
+    """
+    Dựng lại toàn bộ bảng DoctorNextSlot
+    """
+    try:
+        count = sync_next_slots()
+        db.session.commit()
+        return count, f"Đã cập nhật slot sớm nhất cho {count} bác sĩ"
+    except Exception as e:
+        db.session.rollback()
+        return 0, f"Lỗi khi cập nhật slot sớm nhất: {str(e)}"
+
+
+def _doctor_free_slots(doctor_id, after, limit, patient_id=None, now=None):
+    """Tối đa limit slot trống liên tiếp của một bác sĩ từ thời điểm after"""
+    now = now or datetime.now()
+    return (AvailableSlot.query
+            .options(joinedload(AvailableSlot.doctor).joinedload(Doctor.user),
+                     joinedload(AvailableSlot.doctor).joinedload(Doctor.hospital),
+                     joinedload(AvailableSlot.doctor).joinedload(Doctor.specialty))
+            .filter(AvailableSlot.doctor_id == doctor_id,
+                    AvailableSlot.is_booked == False,
+                    AvailableSlot.slot_start >= after,
+                    AvailableSlot.slot_start > now)
+            .filter(outside_exceptions())
+            .filter(not_held_by_others(patient_id, now))
+            .order_by(AvailableSlot.slot_start)
+            .limit(limit)
+            .all())
+
+
+def get_earliest_slots(specialty_id=None, hospital_id=None, k=10, patient_id=None):
+    """
+    Lấy k slot trống sớm nhất của các bác sĩ thuộc chuyên khoa / bệnh viện.
+    Trộn k đường (k-way merge) theo bác sĩ: slot_start trong DoctorNextSlot là cận dưới của mỗi bác sĩ,
+    chỉ khi tới lượt một bác sĩ mới truy vấn các slot tiếp theo của bác sĩ đó.
+    """
+    now = datetime.now()
+    heads = (db.session.query(DoctorNextSlot.doctor_id, DoctorNextSlot.slot_start)
+             .join(Doctor, DoctorNextSlot.doctor_id == Doctor.doctor_id)
+             .filter(DoctorNextSlot.slot_start.isnot(None)))
+    if specialty_id:
+        heads = heads.filter(Doctor.specialty_id == specialty_id)
+    if hospital_id:
+        heads = heads.filter(Doctor.hospital_id == hospital_id)
+
+    # Phần tử heap: (slot_start, 0 = cận dưới chưa mở / 1 = slot thật, doctor_id, slot)
+    heap = [(max(head.slot_start, now), 0, head.doctor_id, None) for head in heads.all()]
+    heapq.heapify(heap)
+
+    result = []
+    while heap and len(result) < k:
+        slot_start, _, doctor_id, slot = heapq.heappop(heap)
+        if slot is not None:
+            result.append(slot)
+            continue
+        for slot in _doctor_free_slots(doctor_id, slot_start, k - len(result), patient_id, now):
+            heapq.heappush(heap, (slot.slot_start, 1, doctor_id, slot))
+    return result
+
+
+def adjust_free_count(doctor_id, slot_date, delta):
+    """
+    Cộng/trừ số slot trống của bác sĩ trong ngày (delta = -1 khi đặt, +1 khi hủy),
+    số slot đã đặt (tải của bác sĩ) đổi ngược lại. Không commit.
+    """
+    db.session.execute(
+        update(DoctorDayCount)
+        .where(DoctorDayCount.doctor_id == doctor_id, DoctorDayCount.slot_date == slot_date)
+        .values(free_count=DoctorDayCount.free_count + delta,
+                booked_count=DoctorDayCount.booked_count - delta)
+    )
+
+
+def sync_day_counts(doctor_id=None, start_date=None, end_date=None, doctor_ids=None):
+    """
+    Tính lại DoctorDayCount (số lượt còn đặt được và đã đặt, slot đặt vượt tính theo capacity)
+    của một bác sĩ, danh sách bác sĩ doctor_ids (hoặc tất cả)
+    trong khoảng ngày [start_date, end_date] bằng một câu INSERT ... SELECT GROUP BY.
+    Ngày có slot nhưng đã kín vẫn có dòng (free_count = 0) để hủy lịch cộng lại được. Không commit.
+    """
+    stale = DoctorDayCount.query
+    counts = (select(AvailableSlot.doctor_id, AvailableSlot.slot_date,
+                     func.sum(AvailableSlot.capacity - AvailableSlot.booked_count),
+                     func.sum(AvailableSlot.booked_count))
+              .group_by(AvailableSlot.doctor_id, AvailableSlot.slot_date))
+    if doctor_id:
+        stale = stale.filter(DoctorDayCount.doctor_id == doctor_id)
+        counts = counts.where(AvailableSlot.doctor_id == doctor_id)
+    if doctor_ids is not None:
+        stale = stale.filter(DoctorDayCount.doctor_id.in_(doctor_ids))
+        counts = counts.where(AvailableSlot.doctor_id.in_(doctor_ids))
+    if start_date:
+        stale = stale.filter(DoctorDayCount.slot_date >= start_date)
+        counts = counts.where(AvailableSlot.slot_date >= start_date)
+    if end_date:
+        stale = stale.filter(DoctorDayCount.slot_date <= end_date)
+        counts = counts.where(AvailableSlot.slot_date <= end_date)
+
+    stale.delete(synchronize_session=False)
+    result = db.session.execute(
+        insert(DoctorDayCount).from_select(['doctor_id', 'slot_date', 'free_count', 'booked_count'], counts)
+    )
+    return result.rowcount
+
+
+def rebuild_day_counts():
+    """
+    Dựng lại toàn bộ bảng DoctorDayCount từ ngày hôm nay
+    """
+    try:
+        count = sync_day_counts(start_date=date.today())
+        db.session.commit()
+        return count, f"Đã cập nhật số slot trống cho {count} ngày"
+    except Exception as e:
+        db.session.rollback()
+        return 0, f"Lỗi khi cập nhật số slot trống: {str(e)}"
+
+
+def find_assignable_slots(hospital_id, specialty_id, slot_date, start_time, end_time, patient_id=None, limit=20):
+    """
+    Slot trống trong khung giờ [start_time, end_time) của các bác sĩ thuộc bệnh viện và chuyên khoa,
+    sắp theo tải của bác sĩ trong ngày (DoctorDayCount.booked_count) rồi theo giờ.
+    Một câu truy vấn: đọc bộ đếm thay vì đếm lại slot đã đặt của từng bác sĩ.
+    """
+    now = datetime.now()
+    return (AvailableSlot.query
+            .join(DoctorDayCount, and_(DoctorDayCount.doctor_id == AvailableSlot.doctor_id,
+                                       DoctorDayCount.slot_date == AvailableSlot.slot_date))
+            .join(Doctor, Doctor.doctor_id == AvailableSlot.doctor_id)
+            .filter(Doctor.hospital_id == hospital_id,
+                    Doctor.specialty_id == specialty_id,
+                    AvailableSlot.slot_date == slot_date,
+                    AvailableSlot.start_time >= start_time,
+                    AvailableSlot.start_time < end_time,
+                    AvailableSlot.is_booked == False,
+                    AvailableSlot.slot_start > now,
+                    not_held_by_others(patient_id, now),
+                    outside_exceptions())
+            .order_by(DoctorDayCount.booked_count, AvailableSlot.doctor_id, AvailableSlot.start_time)
+            .limit(limit)
+            .all())
+
+
+def get_free_count_calendar(year, month, doctor_id=None, specialty_id=None, hospital_id=None):
+    """
+    Số slot trống theo từng ngày trong tháng (ngày -> số slot) bằng một truy vấn GROUP BY trên DoctorDayCount.
+    Ngày hôm nay được đếm trực tiếp để bỏ các slot đã qua giờ, các ngày đã qua bị bỏ.
+    """
+    today = date.today()
+    first_day = max(date(year, month, 1), today)
+    last_day = date(year, month, calendar.monthrange(year, month)[1])
+    if first_day > last_day:
+        return {}
+
+    query = (db.session.query(DoctorDayCount.slot_date, func.sum(DoctorDayCount.free_count))
+             .filter(DoctorDayCount.slot_date >= first_day, DoctorDayCount.slot_date <= last_day))
+    if doctor_id:
+        query = query.filter(DoctorDayCount.doctor_id == doctor_id)
+    if specialty_id or hospital_id:
+        query = query.join(Doctor, DoctorDayCount.doctor_id == Doctor.doctor_id)
+        if specialty_id:
+            query = query.filter(Doctor.specialty_id == specialty_id)
+        if hospital_id:
+            query = query.filter(Doctor.hospital_id == hospital_id)
+    counts = {slot_date: int(total or 0) for slot_date, total in query.group_by(DoctorDayCount.slot_date).all()}
+
+    if first_day == today:
+        live = (db.session.query(func.sum(AvailableSlot.capacity - AvailableSlot.booked_count))
+                .join(Doctor, AvailableSlot.doctor_id == Doctor.doctor_id)
+                .filter(AvailableSlot.is_booked == False,
+                        AvailableSlot.slot_date == today,
+                        AvailableSlot.slot_start > datetime.now()))
+        if doctor_id:
+            live = live.filter(AvailableSlot.doctor_id == doctor_id)
+        if specialty_id:
+            live = live.filter(Doctor.specialty_id == specialty_id)
+        if hospital_id:
+            live = live.filter(Doctor.hospital_id == hospital_id)
+        counts[today] = int(live.scalar() or 0)
+
+    return counts
+
+
+def _slot_distance(slot, target):
+    """Khóa sắp xếp theo độ gần target: (số giây lệch, slot_id) - slot_id phân định các slot cùng khoảng cách"""
+    return abs((slot.slot_start - target).total_seconds()), slot.slot_id
+
+
+def _closest_slots(query, target, limit, after=None):
+    """
+    limit slot gần target nhất: đọc hai phía (sau và trước target) theo index slot_start,
+    mỗi phía đã tăng dần theo khoảng cách nên chỉ cần trộn hai danh sách.
+    after = (số giây lệch, slot_id) của slot cuối trang trước: chỉ lấy các slot xa hơn (keyset)
+    """
+    after_side = [AvailableSlot.slot_start >= target]
+    before_side = [AvailableSlot.slot_start < target]
+    if after:
+        distance, slot_id = after
+        edge = timedelta(seconds=distance)
+        after_side.append(or_(AvailableSlot.slot_start > target + edge,
+                              and_(AvailableSlot.slot_start == target + edge, AvailableSlot.slot_id > slot_id)))
+        before_side.append(or_(AvailableSlot.slot_start < target - edge,
+                               and_(AvailableSlot.slot_start == target - edge, AvailableSlot.slot_id > slot_id)))
+    later = (query.filter(*after_side)
+             .order_by(AvailableSlot.slot_start, AvailableSlot.slot_id)
+             .limit(limit)
+             .all())
+    earlier = (query.filter(*before_side)
+               .order_by(desc(AvailableSlot.slot_start), AvailableSlot.slot_id)
+               .limit(limit)
+               .all())
+    merged = heapq.merge(later, earlier, key=lambda slot: _slot_distance(slot, target))
+    return list(merged)[:limit]
+
+
+def _bookable_slots_query(patient_id=None):
+    """Slot tương lai còn đặt được, nạp sẵn bác sĩ, user, bệnh viện, chuyên khoa"""
+    now = datetime.now()
+    return (AvailableSlot.query
+            .options(joinedload(AvailableSlot.doctor).joinedload(Doctor.user),
+                     joinedload(AvailableSlot.doctor).joinedload(Doctor.hospital),
+                     joinedload(AvailableSlot.doctor).joinedload(Doctor.specialty))
+            .filter(AvailableSlot.is_booked == False, AvailableSlot.slot_start > now)
+            .filter(outside_exceptions())
+            .filter(not_held_by_others(patient_id, now)))
+
+
+def parse_reschedule_cursor(value):
+    """Đọc con trỏ "nhóm:số giây lệch:slot_id" của trang gợi ý đổi lịch, None nếu không hợp lệ"""
+    try:
+        group, distance, slot_id = (int(part) for part in (value or '').split(':'))
+    except ValueError:
+        return None
+    return (group, distance, slot_id) if group in (0, 1) else None
+
+
+def format_reschedule_cursor(cursor):
+    return ':'.join(str(part) for part in cursor) if cursor else None
+
+
+def get_reschedule_candidates(appointment, limit=8, patient_id=None, after=None):
+    """
+    Slot để đổi lịch: cùng bác sĩ (nhóm 0) trước, sau đó cùng chuyên khoa (nhóm 1); mỗi nhóm sắp theo
+    độ gần với giờ hẹn cũ. after = con trỏ (nhóm, số giây lệch, slot_id) của slot cuối trang trước,
+    mỗi trang chỉ đọc limit slot tiếp theo.
+    Trả về (danh sách tối đa limit slot, con trỏ trang sau hoặc None nếu đã hết)
+    """
+    target = appointment.appointment_time
+    base = _bookable_slots_query(patient_id)
+    group, position = (after[0], after[1:]) if after else (0, None)
+
+    # Lấy dư một slot để biết còn trang sau
+    candidates = []
+    if group == 0:
+        candidates = [(0, slot) for slot in _closest_slots(
+            base.filter(AvailableSlot.doctor_id == appointment.doctor_id), target, limit + 1, position)]
+        position = None
+    if len(candidates) <= limit:
+        same_specialty = (base.join(Doctor, AvailableSlot.doctor_id == Doctor.doctor_id)
+                          .filter(Doctor.specialty_id == appointment.doctor.specialty_id,
+                                  AvailableSlot.doctor_id != appointment.doctor_id))
+        candidates += [(1, slot) for slot in _closest_slots(same_specialty, target, limit + 1 - len(candidates),
+                                                             position)]
+
+    page = candidates[:limit]
+    if len(candidates) <= limit:
+        return [slot for _, slot in page], None
+    last_group, last = page[-1]
+    distance, slot_id = _slot_distance(last, target)
+    return [slot for _, slot in page], (last_group, int(distance), slot_id)
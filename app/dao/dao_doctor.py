@@ -1,5 +1,9 @@
+from datetime import datetime, date
+from sqlalchemy import select, or_
 from app.extensions import db
-from app.models import User, Doctor, DoctorAvailability, DayOfWeekEnum
+from app.models import User, Doctor, DoctorAvailability, DayOfWeekEnum, AvailableSlot, AvailabilityException
+from app.dao import dao_slot_generator, dao_available_slot
+from app.dao.dao_search import time_range_mask
 
 
 def get_list_doctor():
@@ -11,11 +15,15 @@ def create_doctor_availability(doctor_id, day_of_week, start_time, end_time, is_
         doctor_id=doctor_id,
         day_of_week=DayOfWeekEnum[day_of_week]
     ).first()
+    old_template = None
+    slot_mask = time_range_mask(start_time, end_time) if is_available else 0
     if existing:
+        old_template = (existing.start_time, existing.end_time, existing.is_available)
         # Cập nhật nếu đã tồn tại
         existing.start_time = start_time
         existing.end_time = end_time
         existing.is_available = is_available
+        existing.slot_mask = slot_mask
     else:
         # Tạo mới nếu chưa tồn tại
         availability = DoctorAvailability(
@@ -23,12 +31,90 @@ def create_doctor_availability(doctor_id, day_of_week, start_time, end_time, is_
             day_of_week=DayOfWeekEnum[day_of_week],
             start_time=start_time,
             end_time=end_time,
-            is_available=is_available
+            is_available=is_available,
+            slot_mask=slot_mask
         )
         db.session.add(availability)
+    # Chỉ thêm/xóa phần slot tương lai thay đổi theo lịch mới
+    dao_slot_generator.reconcile_day_slots(
+        doctor_id,
+        DayOfWeekEnum[day_of_week],
+        old_template,
+        (start_time, end_time, is_available)
+    )
     db.session.commit()
     return True
 
+def rebuild_availability_masks():
+    """
+    Tính lại slot_mask cho toàn bộ lịch làm việc (chạy một lần sau khi thêm cột)
+    """
+    try:
+        availabilities = DoctorAvailability.query.all()
+        for availability in availabilities:
+            availability.slot_mask = (time_range_mask(availability.start_time, availability.end_time)
+                                      if availability.is_available else 0)
+        db.session.commit()
+        return len(availabilities), f"Đã cập nhật bitmask cho {len(availabilities)} lịch làm việc"
+    except Exception as e:
+        db.session.rollback()
+        return 0, f"Lỗi khi cập nhật bitmask: {str(e)}"
+
+
+def invalidate_exception_slots(start_date, end_date, doctor_id=None, hospital_id=None):
+    """
+    Xóa các slot tương lai chưa đặt trong khoảng nghỉ bằng một câu DELETE (theo bác sĩ hoặc
+    mọi bác sĩ của bệnh viện), rồi cập nhật lại bảng đếm slot của chính các bác sĩ đó. Không commit.
+    Trả về (số slot đã xóa, số slot đã có lịch hẹn trong khoảng nghỉ).
+    """
+    if doctor_id:
+        doctor_ids = [doctor_id]
+    else:
+        doctor_ids = db.session.execute(
+            select(Doctor.doctor_id).where(Doctor.hospital_id == hospital_id)
+        ).scalars().all()
+        if not doctor_ids:
+            return 0, 0
+    scope = AvailableSlot.doctor_id.in_(doctor_ids)
+    in_range = (AvailableSlot.query
+                .filter(scope,
+                        AvailableSlot.slot_date >= start_date,
+                        AvailableSlot.slot_date <= end_date,
+                        AvailableSlot.slot_start > datetime.now()))
+
+    # Slot đặt vượt chưa kín nhưng đã có người đặt vẫn phải giữ lại
+    deleted = in_range.filter(AvailableSlot.is_booked == False,
+                              AvailableSlot.booked_count == 0).delete(synchronize_session=False)
+    booked = in_range.filter(or_(AvailableSlot.is_booked == True, AvailableSlot.booked_count > 0)).count()
+
+    dao_available_slot.sync_day_counts(start_date=max(start_date, date.today()), end_date=end_date,
+                                       doctor_ids=doctor_ids)
+    dao_available_slot.sync_next_slots(doctor_ids=doctor_ids)
+    return deleted, booked
+
+
+def add_availability_exception(start_date, end_date, doctor_id=None, hospital_id=None, reason=None):
+    """
+    Thêm ngày nghỉ cho bác sĩ hoặc bệnh viện và hủy các slot trống trong khoảng đó
+    """
+    if not doctor_id and not hospital_id:
+        return None, "Vui lòng chọn bác sĩ hoặc bệnh viện"
+    if end_date < start_date:
+        return None, "Ngày kết thúc phải sau ngày bắt đầu"
+    try:
+        exception = AvailabilityException(doctor_id=doctor_id, hospital_id=hospital_id,
+                                          start_date=start_date, end_date=end_date, reason=reason)
+        db.session.add(exception)
+        deleted, booked = invalidate_exception_slots(start_date, end_date, doctor_id, hospital_id)
+        db.session.commit()
+        message = f"Đã thêm ngày nghỉ, hủy {deleted} slot trống"
+        if booked:
+            message += f" ({booked} slot đã có lịch hẹn cần xử lý)"
+        return exception, message
+    except Exception as e:
+        db.session.rollback()
+        return None, f"Lỗi khi thêm ngày nghỉ: {str(e)}"
+
 #Lấy tất cả lịch làm của bác sĩ
 def get_doctor_availabilities(doctor_id):
     return DoctorAvailability.query.filter_by(doctor_id=doctor_id).all()
@@ -0,0 +1,146 @@
+from datetime import date
+from sqlalchemy import update, select, insert, func
+from sqlalchemy.exc import IntegrityError
+from app import INVOICE_OVERDUE_BATCH_SIZE
+from app.extensions import db
+from app.models import Invoice, InvoiceStatus, InvoiceAging
+
+# Hóa đơn còn phải thu
+OUTSTANDING = [InvoiceStatus.Pending, InvoiceStatus.Overdue]
+
+# Nhóm tuổi nợ theo số ngày quá hạn (hôm nay - hạn thanh toán): (nhãn, từ, đến), None là không giới hạn
+AGING_BUCKETS = [
+    ('Chưa đến hạn', None, -1),
+    ('0-7 ngày', 0, 7),
+    ('8-30 ngày', 8, 30),
+    ('Trên 30 ngày', 31, None),
+]
+
+
+def _add_aging(due_date, amount, delta):
+    return db.session.execute(
+        update(InvoiceAging)
+        .where(InvoiceAging.due_date == due_date)
+        .values(outstanding_count=InvoiceAging.outstanding_count + delta,
+                outstanding_amount=InvoiceAging.outstanding_amount + amount * delta)
+    ).rowcount
+
+
+def adjust_invoice_aging(due_date, amount, delta):
+    """
+    Cộng/trừ một hóa đơn chưa thanh toán vào bảng tuổi nợ (delta = 1 khi tạo, -1 khi thanh toán/hủy).
+    Không commit.
+    """
+    if due_date is None:
+        return
+    if _add_aging(due_date, amount, delta):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(InvoiceAging).values(due_date=due_date, outstanding_count=delta,
+                                                           outstanding_amount=amount * delta))
+    except IntegrityError:
+        # Transaction khác vừa tạo dòng cho ngày này
+        _add_aging(due_date, amount, delta)
+
+
+def sync_invoice_aging(due_dates=None):
+    """
+    Tính lại InvoiceAging từ bảng invoice (cho các hạn thanh toán due_dates, hoặc toàn bộ)
+    bằng một câu INSERT ... SELECT GROUP BY. Không commit.
+    """
+    stale = InvoiceAging.query
+    counts = (select(Invoice.due_date, func.count(Invoice.invoice_id), func.sum(Invoice.amount))
+              .where(Invoice.status.in_(OUTSTANDING), Invoice.due_date.isnot(None))
+              .group_by(Invoice.due_date))
+    if due_dates is not None:
+        due_dates = [d for d in due_dates if d is not None]
+        if not due_dates:
+            return 0
+        stale = stale.filter(InvoiceAging.due_date.in_(due_dates))
+        counts = counts.where(Invoice.due_date.in_(due_dates))
+
+    stale.delete(synchronize_session=False)
+    result = db.session.execute(
+        insert(InvoiceAging).from_select(['due_date', 'outstanding_count', 'outstanding_amount'], counts)
+    )
+    return result.rowcount
+
+
+def rebuild_invoice_aging():
+    """
+    Dựng lại toàn bộ bảng InvoiceAging
+    """
+    try:
+        count = sync_invoice_aging()
+        db.session.commit()
+        return count, f"Đã cập nhật tuổi nợ cho {count} ngày đến hạn"
+    except Exception as e:
+        db.session.rollback()
+        return 0, f"Lỗi khi cập nhật tuổi nợ: {str(e)}"
+
+
+def _pending_past_due_ids(today, batch_size):
+    """Một lô hóa đơn Pending đã qua hạn thanh toán (dùng idx_invoice_status_due)"""
+    return db.session.execute(
+        select(Invoice.invoice_id)
+        .where(Invoice.status == InvoiceStatus.Pending, Invoice.due_date < today)
+        .order_by(Invoice.due_date)
+        .limit(batch_size)
+    ).scalars().all()
+
+
+def mark_overdue_invoices(today=None, batch_size=INVOICE_OVERDUE_BATCH_SIZE):
+    """
+    Chuyển hóa đơn Pending đã qua hạn thanh toán sang Overdue. Chạy định kỳ (cron).
+    Mỗi lô là một câu SELECT id và một lệnh UPDATE theo khóa chính, commit sau mỗi lô.
+    Trả về (số hóa đơn đã chuyển, message)
+    """
+    today = today or date.today()
+    total = 0
+    try:
+        while True:
+            ids = _pending_past_due_ids(today, batch_size)
+            if not ids:
+                break
+            # Hóa đơn có thể vừa được thanh toán/hủy giữa SELECT và UPDATE
+            result = db.session.execute(
+                update(Invoice)
+                .where(Invoice.invoice_id.in_(ids), Invoice.status == InvoiceStatus.Pending)
+                .values(status=InvoiceStatus.Overdue)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            total += result.rowcount
+            if len(ids) < batch_size:
+                break
+        return total, f"Đã chuyển {total} hóa đơn sang quá hạn"
+    except Exception as e:
+        db.session.rollback()
+        return total, f"Lỗi khi quét hóa đơn quá hạn: {str(e)}"
+
+
+def aging_bucket(days_overdue):
+    """Vị trí nhóm tuổi nợ trong AGING_BUCKETS của số ngày quá hạn"""
+    for index, (label, low, high) in enumerate(AGING_BUCKETS):
+        if (low is None or days_overdue >= low) and (high is None or days_overdue <= high):
+            return index
+
+
+def get_invoice_aging_summary(today=None):
+    """
+    Số hóa đơn chưa thanh toán và tổng tiền theo nhóm tuổi nợ, đọc từ InvoiceAging
+    (mỗi hạn thanh toán một dòng, không quét bảng invoice).
+    Trả về danh sách {'label', 'count', 'amount'} theo thứ tự AGING_BUCKETS
+    """
+    today = today or date.today()
+    summary = [{'label': label, 'count': 0, 'amount': 0} for label, low, high in AGING_BUCKETS]
+    rows = db.session.execute(
+        select(InvoiceAging.due_date, InvoiceAging.outstanding_count, InvoiceAging.outstanding_amount)
+        .where(InvoiceAging.outstanding_count > 0)
+    ).all()
+    for row in rows:
+        bucket = summary[aging_bucket((today - row.due_date).days)]
+        bucket['count'] += row.outstanding_count
+        bucket['amount'] += row.outstanding_amount
+    return summary
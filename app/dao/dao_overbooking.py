@@ -0,0 +1,104 @@
+from datetime import datetime, date, time, timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, update, bindparam, case
+from app import app, OVERBOOKING_HISTORY_DAYS, OVERBOOKING_BAND_HOURS, OVERBOOKING_MIN_HISTORY, \
+    OVERBOOKING_MAX_EXPECTED, OVERBOOKING_MAX_EXTRA
+from app.extensions import db
+from app.dao import dao_available_slot
+from app.models import Appointment, AppointmentStatus, AvailableSlot
+
+
+def _history_frame(since, until, doctor_id=None):
+    """Lịch hẹn đã có kết quả (đã khám / không đến) trong [since, until): doctor_id, appointment_time, no_show"""
+    query = (select(Appointment.doctor_id, Appointment.appointment_time,
+                    case((Appointment.status == AppointmentStatus.NoShow, 1), else_=0).label('no_show'))
+             .where(Appointment.status.in_([AppointmentStatus.Completed, AppointmentStatus.NoShow]),
+                    Appointment.appointment_time >= since,
+                    Appointment.appointment_time < until))
+    if doctor_id:
+        query = query.where(Appointment.doctor_id == doctor_id)
+    return pd.read_sql(query, db.session.connection(), parse_dates=['appointment_time'])
+
+
+def compute_overbooking_policy(history):
+    """
+    Tỉ lệ không đến khám theo (bác sĩ, khung giờ) và số lượt được đặt vượt trên mỗi slot, tính một lượt
+    trên toàn bộ lịch sử bằng pandas/numpy.
+    capacity là số lượt lớn nhất mà số bệnh nhân đến kỳ vọng capacity * (1 - rate) không quá
+    OVERBOOKING_MAX_EXPECTED; khung giờ có ít hơn OVERBOOKING_MIN_HISTORY lịch hẹn thì không đặt vượt.
+    """
+    columns = ['doctor_id', 'band', 'total', 'no_shows', 'rate', 'extra']
+    if history.empty:
+        return pd.DataFrame(columns=columns)
+
+    bands = pd.to_datetime(history['appointment_time']).dt.hour // OVERBOOKING_BAND_HOURS
+    policy = (history.assign(band=bands)
+              .groupby(['doctor_id', 'band'])
+              .agg(total=('no_show', 'size'), no_shows=('no_show', 'sum'))
+              .reset_index())
+    policy['rate'] = policy['no_shows'] / policy['total']
+
+    show_rate = np.clip(1 - policy['rate'].to_numpy(), 1e-9, 1)
+    capacity = np.floor(OVERBOOKING_MAX_EXPECTED / show_rate)
+    extra = np.clip(capacity - 1, 0, OVERBOOKING_MAX_EXTRA).astype(int)
+    policy['extra'] = np.where(policy['total'].to_numpy() >= OVERBOOKING_MIN_HISTORY, extra, 0)
+    return policy[columns]
+
+
+def band_bounds(band):
+    """Khoảng giờ [start, end) của một khung giờ"""
+    start_hour = int(band) * OVERBOOKING_BAND_HOURS
+    end_hour = start_hour + OVERBOOKING_BAND_HOURS
+    return time(start_hour), time(end_hour) if end_hour < 24 else time.max
+
+
+def apply_overbooking_policy(doctor_id=None, enabled=None):
+    """
+    Đặt capacity cho các slot tương lai theo tỉ lệ không đến khám. Chạy định kỳ (cron) sau khi sinh slot.
+    Tắt chế độ đặt vượt (OVERBOOKING_ENABLED) thì chỉ đưa capacity về 1.
+    capacity không bao giờ nhỏ hơn số lượt đã đặt. Trả về (số khung giờ được đặt vượt, message)
+    """
+    enabled = app.config.get('OVERBOOKING_ENABLED') if enabled is None else enabled
+    now = datetime.now()
+    slots = AvailableSlot.__table__
+    try:
+        # Bỏ đặt vượt cũ, giữ đủ chỗ cho các lượt đã đặt
+        reset = (update(slots)
+                 .where(slots.c.capacity > 1, slots.c.slot_start > now)
+                 .values(is_booked=slots.c.booked_count >= 1,
+                         capacity=case((slots.c.booked_count > 1, slots.c.booked_count), else_=1)))
+        if doctor_id:
+            reset = reset.where(slots.c.doctor_id == doctor_id)
+        db.session.execute(reset)
+
+        bands = []
+        if enabled:
+            policy = compute_overbooking_policy(
+                _history_frame(now - timedelta(days=OVERBOOKING_HISTORY_DAYS), now, doctor_id))
+            bands = [
+                {'b_doctor_id': int(row.doctor_id), 'b_start': band_bounds(row.band)[0],
+                 'b_end': band_bounds(row.band)[1], 'b_capacity': 1 + int(row.extra)}
+                for row in policy[policy['extra'] > 0].itertuples()
+            ]
+        if bands:
+            # Một câu UPDATE chạy executemany cho mọi (bác sĩ, khung giờ)
+            db.session.execute(
+                update(slots)
+                .where(slots.c.doctor_id == bindparam('b_doctor_id'),
+                       slots.c.start_time >= bindparam('b_start'),
+                       slots.c.start_time < bindparam('b_end'),
+                       slots.c.slot_start > now)
+                .values(is_booked=slots.c.booked_count >= bindparam('b_capacity'),
+                        capacity=case((slots.c.booked_count > bindparam('b_capacity'), slots.c.booked_count),
+                                      else_=bindparam('b_capacity'))),
+                bands
+            )
+
+        dao_available_slot.sync_day_counts(doctor_id, start_date=date.today())
+        dao_available_slot.sync_next_slots(doctor_id)
+        db.session.commit()
+        return len(bands), f"Đã áp dụng đặt vượt cho {len(bands)} khung giờ"
+    except Exception as e:
+        db.session.rollback()
+        return 0, f"Lỗi khi áp dụng đặt vượt: {str(e)}"
@@ -3,6 +3,7 @@ from decimal import Decimal
 from app import db
 from app.models import Payment, PaymentStatus, PaymentMethodEnum, Invoice, InvoiceStatus, AppointmentStatus
 from app.vnpay_service import VNPay  # Import VNPay từ service
+from app.dao import dao_invoice
 
 
 def create_vnpay_payment(appointment):
@@ -11,7 +12,8 @@ def create_vnpay_payment(appointment):
     if appointment.status not in [AppointmentStatus.Scheduled, AppointmentStatus.Completed]:
         return None, "Chỉ có thể thanh toán cho lịch hẹn đã lên lịch hoặc hoàn thành"
 
-    if not appointment.invoice or appointment.invoice.status != InvoiceStatus.Pending:
+    # Hóa đơn quá hạn (Overdue) vẫn được thanh toán
+    if not appointment.invoice or appointment.invoice.status not in dao_invoice.OUTSTANDING:
         return None, "Hóa đơn không tồn tại hoặc đã được thanh toán"
 
     #Nếu tại dùng luôn
@@ -61,6 +63,8 @@ def process_vnpay_callback(params):
         payment.payment_date = datetime.now()
 
         # Cập nhật invoice status thành Paid
+        if invoice.status in dao_invoice.OUTSTANDING:
+            dao_invoice.adjust_invoice_aging(invoice.due_date, invoice.amount, -1)
         invoice.status = InvoiceStatus.Paid
 
         # Nếu appointment chưa completed và đã thanh toán, có thể cập nhật trạng thái
@@ -0,0 +1,154 @@
+from datetime import date, time, timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, func, case, extract, or_
+from app import SCHEDULE_HISTORY_WEEKS, SCHEDULE_MIN_SLOTS, SCHEDULE_HOT_RATE, SCHEDULE_HOT_DAYS, \
+    SCHEDULE_COLD_RATE, SCHEDULE_EARLIEST_HOUR, SCHEDULE_LATEST_HOUR
+from app.extensions import db
+from app.models import AvailableSlot, Appointment, DoctorAvailability, DayOfWeekEnum
+
+WEEKDAYS = list(DayOfWeekEnum)
+
+
+def _slot_history(since, until, doctor_id=None):
+    """
+    Slot đã qua trong [since, until): bác sĩ, ngày, giờ, đã được đặt hay chưa,
+    số ngày từ lúc slot được mở tới lượt đặt đầu tiên
+    """
+    query = (select(AvailableSlot.doctor_id, AvailableSlot.slot_date,
+                    extract('hour', AvailableSlot.start_time).label('hour'),
+                    case((or_(AvailableSlot.is_booked == True, AvailableSlot.booked_count > 0), 1),
+                         else_=0).label('booked'),
+                    AvailableSlot.created_at.label('opened_at'),
+                    func.min(Appointment.created_at).label('booked_at'))
+             .outerjoin(Appointment, Appointment.slot_id == AvailableSlot.slot_id)
+             .where(AvailableSlot.slot_date >= since, AvailableSlot.slot_date < until)
+             .group_by(AvailableSlot.slot_id, AvailableSlot.doctor_id, AvailableSlot.slot_date,
+                       AvailableSlot.start_time, AvailableSlot.is_booked, AvailableSlot.booked_count,
+                       AvailableSlot.created_at))
+    if doctor_id:
+        query = query.where(AvailableSlot.doctor_id == doctor_id)
+    return pd.read_sql(query, db.session.connection(), parse_dates=['slot_date', 'opened_at', 'booked_at'])
+
+
+def compute_hour_stats(history):
+    """
+    Tỉ lệ đặt và số ngày (trung vị) để slot được đặt theo (bác sĩ, thứ, giờ), tính một lượt bằng pandas.
+    hot: gần như kín và hết nhanh; cold: hầu như không ai đặt
+    """
+    columns = ['doctor_id', 'day', 'hour', 'slots', 'rate', 'days_to_book', 'hot', 'cold']
+    if history.empty:
+        return pd.DataFrame(columns=columns)
+
+    days_to_book = (history['booked_at'] - history['opened_at']).dt.total_seconds() / 86400
+    stats = (history.assign(day=history['slot_date'].dt.dayofweek, hour=history['hour'].astype(int),
+                            days_to_book=days_to_book.clip(lower=0))
+             .groupby(['doctor_id', 'day', 'hour'])
+             .agg(slots=('booked', 'size'), booked=('booked', 'sum'), days_to_book=('days_to_book', 'median'))
+             .reset_index())
+    stats['rate'] = stats['booked'] / stats['slots']
+    enough = stats['slots'].to_numpy() >= SCHEDULE_MIN_SLOTS
+    stats['hot'] = enough & (stats['rate'].to_numpy() >= SCHEDULE_HOT_RATE) & \
+        (stats['days_to_book'].fillna(np.inf).to_numpy() <= SCHEDULE_HOT_DAYS)
+    stats['cold'] = enough & (stats['rate'].to_numpy() <= SCHEDULE_COLD_RATE)
+    return stats[columns]
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def _to_time(minutes):
+    return time(23, 59) if minutes >= 24 * 60 else time(minutes // 60, minutes % 60)
+
+
+def build_recommendations(stats, templates):
+    """
+    Gợi ý lịch tuần từ thống kê theo giờ và lịch hiện tại (doctor_id, day, start_time, end_time, is_available).
+    Bỏ các giờ đầu/cuối ít người đặt, thêm một giờ trước/sau khi giờ đầu/cuối cháy slot.
+    Lịch mỗi ngày là một khoảng liền nên chỉ điều chỉnh hai đầu. Ngày không có dữ liệu thì giữ nguyên.
+    """
+    if stats.empty or templates.empty:
+        return []
+    templates = templates[templates['is_available']].copy()
+    templates['start_hour'] = [t.hour for t in templates['start_time']]
+    templates['last_hour'] = [(_minutes(t) - 1) // 60 for t in templates['end_time']]
+
+    hours = stats.merge(templates[['doctor_id', 'day', 'start_hour', 'last_hour']], on=['doctor_id', 'day'])
+    hours = hours[(hours['hour'] >= hours['start_hour']) & (hours['hour'] <= hours['last_hour'])]
+    keys = ['doctor_id', 'day']
+    known = set(hours.groupby(keys).size().index)
+    cold = set(hours.loc[hours['cold'], keys + ['hour']].itertuples(index=False, name=None))
+    hot = set(hours.loc[hours['hot'], keys + ['hour']].itertuples(index=False, name=None))
+    by_hour = hours.set_index(keys + ['hour'])
+
+    recommendations = []
+    for row in templates.itertuples(index=False):
+        key = (row.doctor_id, row.day)
+        if key not in known:
+            continue
+        start, end = _minutes(row.start_time), _minutes(row.end_time)
+        reasons = []
+        # Giờ không có dữ liệu không bị coi là ít người đặt
+        first, last = row.start_hour, row.last_hour
+        while first <= last and key + (first,) in cold:
+            first += 1
+        while last >= first and key + (last,) in cold:
+            last -= 1
+        if first > last:
+            recommendations.append({
+                'doctor_id': row.doctor_id, 'day_of_week': WEEKDAYS[row.day],
+                'start_time': row.start_time, 'end_time': row.end_time,
+                'new_start_time': row.start_time, 'new_end_time': row.end_time, 'is_available': False,
+                'reasons': ['Hầu như không có slot nào được đặt, gợi ý nghỉ ngày này'],
+            })
+            continue
+
+        if first > row.start_hour:
+            reasons.append(f'Bỏ {row.start_hour:02d}:00-{first:02d}:00: '
+                           f'{by_hour.loc[key + (row.start_hour,), "rate"]:.0%} slot được đặt')
+            start = first * 60
+        elif key + (first,) in hot and start - 60 >= SCHEDULE_EARLIEST_HOUR * 60:
+            stat = by_hour.loc[key + (row.start_hour,)]
+            reasons.append(f'Thêm 1 giờ buổi sáng: slot {row.start_hour:02d}:00 kín sau '
+                           f'{stat["days_to_book"]:.1f} ngày')
+            start -= 60
+        if last < row.last_hour:
+            reasons.append(f'Bỏ {last + 1:02d}:00-{_to_time(end).strftime("%H:%M")}: '
+                           f'{by_hour.loc[key + (row.last_hour,), "rate"]:.0%} slot được đặt')
+            end = (last + 1) * 60
+        elif key + (last,) in hot and end + 60 <= SCHEDULE_LATEST_HOUR * 60:
+            stat = by_hour.loc[key + (row.last_hour,)]
+            reasons.append(f'Thêm 1 giờ cuối ngày: slot {row.last_hour:02d}:00 kín sau '
+                           f'{stat["days_to_book"]:.1f} ngày')
+            end += 60
+        if reasons:
+            recommendations.append({
+                'doctor_id': row.doctor_id, 'day_of_week': WEEKDAYS[row.day],
+                'start_time': row.start_time, 'end_time': row.end_time,
+                'new_start_time': _to_time(start), 'new_end_time': _to_time(end), 'is_available': True,
+                'reasons': reasons,
+            })
+    return recommendations
+
+
+def _templates(doctor_id=None):
+    query = select(DoctorAvailability.doctor_id, DoctorAvailability.day_of_week, DoctorAvailability.start_time,
+                   DoctorAvailability.end_time, DoctorAvailability.is_available)
+    if doctor_id:
+        query = query.where(DoctorAvailability.doctor_id == doctor_id)
+    rows = db.session.execute(query).all()
+    return pd.DataFrame({
+        'doctor_id': [r.doctor_id for r in rows],
+        'day': [WEEKDAYS.index(r.day_of_week) for r in rows],
+        'start_time': [r.start_time for r in rows],
+        'end_time': [r.end_time for r in rows],
+        'is_available': [bool(r.is_available) for r in rows],
+    })
+
+
+def recommend_schedules(doctor_id=None, today=None):
+    """Gợi ý lịch làm việc từ SCHEDULE_HISTORY_WEEKS tuần slot đã qua (một bác sĩ hoặc tất cả)"""
+    today = today or date.today()
+    history = _slot_history(today - timedelta(weeks=SCHEDULE_HISTORY_WEEKS), today, doctor_id)
+    return build_recommendations(compute_hour_stats(history), _templates(doctor_id))
@@ -1,8 +1,36 @@
-from app.models import db, Doctor, Hospital, Specialty, User, RoleEnum
-from sqlalchemy import or_,func
+from app.models import db, Doctor, Hospital, Specialty, User, RoleEnum, DoctorAvailability
+from sqlalchemy import or_,func, select
+
+# Lịch làm việc mỗi ngày được nén thành 48 bit, mỗi bit là nửa giờ (bit 0 = 00:00-00:30)
+HALF_HOURS_PER_DAY = 48
+
+
+def time_range_mask(start_time=None, end_time=None):
+    """
+    Bitmask các nửa giờ giao với khoảng [start_time, end_time); None là đầu/cuối ngày
+    """
+    start = (start_time.hour * 60 + start_time.minute) // 30 if start_time else 0
+    end = -(-(end_time.hour * 60 + end_time.minute) // 30) if end_time else HALF_HOURS_PER_DAY
+    if end <= start:
+        return 0
+    return ((1 << end) - 1) & ~((1 << start) - 1)
+
+
+def available_on(day_of_week, from_time=None, to_time=None):
+    """
+    Điều kiện bác sĩ có làm việc vào day_of_week trong khung giờ: một phép AND bit
+    trên DoctorAvailability.slot_mask thay vì so sánh giờ bắt đầu/kết thúc từng dòng
+    """
+    mask = time_range_mask(from_time, to_time)
+    return Doctor.doctor_id.in_(
+        select(DoctorAvailability.doctor_id)
+        .where(DoctorAvailability.day_of_week == day_of_week,
+               DoctorAvailability.slot_mask.op('&')(mask) != 0)
+    )
+
 
 def search_doctors(hospital_name=None, specialty_name=None, doctor_name=None,
-                   limit=None, hospital_accepts_insurance=None):
+                   limit=None, hospital_accepts_insurance=None, day_of_week=None, from_time=None, to_time=None):
     query = (db.session.query(Doctor)
              .join(User)
              .join(Hospital)
@@ -21,7 +49,9 @@ def search_doctors(hospital_name=None, specialty_name=None, doctor_name=None,
             full_name.ilike(f"%{doctor_name}%")
         ))
 
-  
+    if day_of_week:
+        query = query.filter(available_on(day_of_week, from_time, to_time))
+
     if hospital_accepts_insurance is True:
         query = query.filter(Hospital.accepts_insurance.is_(True))
     elif hospital_accepts_insurance is False:
@@ -48,7 +78,8 @@ def search_doctors(hospital_name=None, specialty_name=None, doctor_name=None,
     return results
 
 
-def search_doctors_paginated(hospital_name=None, specialty_name=None, doctor_name=None, page=1, per_page=6):
+def search_doctors_paginated(hospital_name=None, specialty_name=None, doctor_name=None, page=1, per_page=6,
+                             day_of_week=None, from_time=None, to_time=None):
     query = db.session.query(Doctor).join(User).join(Specialty).join(Hospital)
 
     # Áp dụng bộ lọc
@@ -63,6 +94,8 @@ def search_doctors_paginated(hospital_name=None, specialty_name=None, doctor_nam
                 User.last_name.ilike(f"%{doctor_name}%")
             )
         )
+    if day_of_week:
+        query = query.filter(available_on(day_of_week, from_time, to_time))
 
     # Đếm tổng số kết quả
     total_count = query.count()
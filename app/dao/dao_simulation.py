@@ -0,0 +1,170 @@
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, func, case
+from app import SLOT_DURATION_MINUTES, SLOT_HORIZON_WEEKS
+from app.extensions import db
+from app.models import Appointment, AppointmentStatus, AvailableSlot, Doctor, Hospital, Specialty
+
+GROUP_KEYS = ['hospital_id', 'specialty_id']
+CANCELLED = [AppointmentStatus.CancelledByPatient, AppointmentStatus.CancelledByDoctor]
+
+
+def _scope(query, hospital_id=None, specialty_id=None):
+    if hospital_id:
+        query = query.where(Doctor.hospital_id == hospital_id)
+    if specialty_id:
+        query = query.where(Doctor.specialty_id == specialty_id)
+    return query
+
+
+def load_demand(start_date, end_date, hospital_id=None, specialty_id=None):
+    """
+    Yêu cầu đặt lịch trong [start_date, end_date]: mỗi lịch hẹn là một yêu cầu vào ngày tạo (created_at),
+    lịch đã hủy vẫn là nhu cầu nhưng không giữ slot
+    """
+    requested_at = func.coalesce(Appointment.created_at, Appointment.appointment_time)
+    query = (select(Doctor.hospital_id, Doctor.specialty_id, requested_at.label('requested_at'),
+                    case((Appointment.status.in_(CANCELLED), 1), else_=0).label('cancelled'))
+             .join(Doctor, Appointment.doctor_id == Doctor.doctor_id)
+             .where(requested_at >= start_date, requested_at < end_date + timedelta(days=1)))
+    query = _scope(query, hospital_id, specialty_id)
+    return pd.read_sql(query, db.session.connection(), parse_dates=['requested_at'])
+
+
+def load_supply(start_date, end_date, hospital_id=None, specialty_id=None):
+    """Số lượt khám theo (bệnh viện, chuyên khoa, ngày) từ AvailableSlot, một truy vấn GROUP BY"""
+    query = (select(Doctor.hospital_id, Doctor.specialty_id, AvailableSlot.slot_date,
+                    func.sum(AvailableSlot.capacity).label('slots'))
+             .join(Doctor, AvailableSlot.doctor_id == Doctor.doctor_id)
+             .where(AvailableSlot.slot_date >= start_date, AvailableSlot.slot_date <= end_date)
+             .group_by(Doctor.hospital_id, Doctor.specialty_id, AvailableSlot.slot_date))
+    query = _scope(query, hospital_id, specialty_id)
+    return pd.read_sql(query, db.session.connection(), parse_dates=['slot_date'])
+
+
+def load_doctor_counts(hospital_id=None, specialty_id=None):
+    """Số bác sĩ theo (bệnh viện, chuyên khoa), dùng khi thêm giờ làm việc giả định"""
+    query = (select(Doctor.hospital_id, Doctor.specialty_id, func.count(Doctor.doctor_id).label('doctors'))
+             .group_by(Doctor.hospital_id, Doctor.specialty_id))
+    query = _scope(query, hospital_id, specialty_id)
+    return pd.read_sql(query, db.session.connection())
+
+
+def _assign(group, arrival, cum, horizon_days):
+    """
+    Gán slot cho các yêu cầu (đã sắp theo nhóm rồi ngày yêu cầu): mỗi yêu cầu lấy slot trống sớm nhất
+    từ ngày yêu cầu, theo thứ tự đến.
+    Với thứ tự FIFO, slot của yêu cầu thứ i là s_i = max(f_i, s_{i-1} + 1) (f_i là slot đầu tiên của ngày
+    yêu cầu), tức s_i - i = max dồn của f_i - i: một lần np.maximum.accumulate cho mọi nhóm.
+    Các nhóm được đặt cách nhau (tổng slot + số yêu cầu của nhóm) để giá trị dồn không tràn sang nhóm sau.
+    Trả về (được phục vụ, ngày được khám)
+    """
+    n_groups, n_days = cum.shape
+    total = cum[:, -1]
+    counts = np.bincount(group, minlength=n_groups)
+    offset = np.concatenate(([0], np.cumsum(total + counts)[:-1]))
+
+    first = np.where(arrival > 0, cum[group, np.maximum(arrival - 1, 0)], 0) + offset[group]
+    index = np.arange(len(group))
+    slot = np.maximum.accumulate(first - index) + index if len(group) else first
+
+    # Ngày của slot: số mốc tích lũy <= slot trong hàng của nhóm (các hàng trước đều nhỏ hơn)
+    bounds = (cum + offset[:, None]).ravel()
+    day = np.searchsorted(bounds, slot, side='right') - group * n_days
+    served = (slot - offset[group] < total[group]) & (day - arrival <= horizon_days)
+    return served, day
+
+
+def simulate(demand, supply, doctors, start_date, days, horizon_days=SLOT_HORIZON_WEEKS * 7,
+             slot_minutes=SLOT_DURATION_MINUTES, extra_weekday=None, extra_hours=0):
+    """
+    Mô phỏng rời rạc theo ngày cho từng (bệnh viện, chuyên khoa), vector hóa bằng NumPy.
+    Kịch bản giả định: đổi độ dài slot (slot_minutes) và thêm extra_hours giờ làm việc cho mọi bác sĩ
+    vào thứ extra_weekday (0 = thứ Hai).
+    Yêu cầu không có slot trong horizon_days ngày là nhu cầu không đáp ứng và không giữ slot.
+    Trả về DataFrame theo nhóm: requests, cancelled, served, unmet, supply, utilization, mean_wait, p90_wait
+    """
+    keys = (pd.concat([demand[GROUP_KEYS], supply[GROUP_KEYS]])
+            .drop_duplicates().sort_values(GROUP_KEYS).reset_index(drop=True))
+    index = pd.MultiIndex.from_frame(keys)
+    n_groups, n_days = len(keys), days + horizon_days
+    start = pd.Timestamp(start_date)
+
+    # Số lượt khám theo (nhóm, ngày), kể cả horizon_days ngày sau cửa sổ cho các yêu cầu cuối kỳ
+    capacity = np.zeros((n_groups, n_days), dtype=np.int64)
+    supply_day = (supply['slot_date'] - start).dt.days.to_numpy()
+    in_range = (supply_day >= 0) & (supply_day < n_days)
+    np.add.at(capacity,
+              (index.get_indexer(pd.MultiIndex.from_frame(supply[GROUP_KEYS]))[in_range], supply_day[in_range]),
+              supply['slots'].to_numpy(dtype=np.int64)[in_range])
+    if slot_minutes != SLOT_DURATION_MINUTES:
+        capacity = np.floor(capacity * SLOT_DURATION_MINUTES / slot_minutes).astype(np.int64)
+    if extra_weekday is not None and extra_hours:
+        per_doctor = int(extra_hours * 60 // slot_minutes)
+        doctor_count = np.zeros(n_groups, dtype=np.int64)
+        known = index.get_indexer(pd.MultiIndex.from_frame(doctors[GROUP_KEYS]))
+        doctor_count[known[known >= 0]] = doctors['doctors'].to_numpy()[known >= 0]
+        weekday = (start.weekday() + np.arange(n_days)) % 7
+        capacity[:, weekday == extra_weekday] += doctor_count[:, None] * per_doctor
+    cum = np.cumsum(capacity, axis=1)
+
+    group = index.get_indexer(pd.MultiIndex.from_frame(demand[GROUP_KEYS]))
+    arrival = (demand['requested_at'].dt.normalize() - start).dt.days.to_numpy()
+    cancelled = demand['cancelled'].to_numpy().astype(bool)
+    valid = (arrival >= 0) & (arrival < days)
+    group, arrival, cancelled = group[valid], arrival[valid], cancelled[valid]
+
+    # Lịch bị hủy là nhu cầu đã rút lại: không chiếm slot
+    order = np.lexsort((arrival[~cancelled], group[~cancelled]))
+    c_group, c_arrival = group[~cancelled][order], arrival[~cancelled][order]
+    served, day = _assign(c_group, c_arrival, cum, horizon_days)
+    # Yêu cầu không được đáp ứng sẽ rời đi: gán lại mà không có chúng
+    kept = np.flatnonzero(served)
+    served_again, day_again = _assign(c_group[kept], c_arrival[kept], cum, horizon_days)
+    served[kept] = served_again
+    day[kept] = day_again
+    wait = day - c_arrival
+
+    requests = np.bincount(group, minlength=n_groups)
+    served_count = np.bincount(c_group[served], minlength=n_groups)
+    window_supply = cum[:, days - 1] if days else np.zeros(n_groups, dtype=np.int64)
+    used = np.bincount(c_group[served & (day < days)], minlength=n_groups)
+    wait_sum = np.bincount(c_group[served], weights=wait[served], minlength=n_groups)
+
+    result = keys.copy()
+    result['requests'] = requests
+    result['cancelled'] = np.bincount(group[cancelled], minlength=n_groups)
+    result['served'] = served_count
+    result['unmet'] = np.bincount(c_group[~served], minlength=n_groups)
+    result['supply'] = window_supply
+    result['utilization'] = np.divide(used, window_supply, out=np.zeros(n_groups), where=window_supply > 0)
+    result['mean_wait'] = np.divide(wait_sum, served_count, out=np.zeros(n_groups), where=served_count > 0)
+    result['p90_wait'] = (pd.Series(wait[served]).groupby(c_group[served]).quantile(0.9)
+                          .reindex(range(n_groups)).fillna(0).to_numpy())
+    return result
+
+
+def run_simulation(start_date, end_date, hospital_id=None, specialty_id=None, slot_minutes=SLOT_DURATION_MINUTES,
+                   extra_weekday=None, extra_hours=0):
+    """
+    Chạy lại dữ liệu lịch sử với lịch hiện tại và với kịch bản giả định.
+    Trả về DataFrame theo (bệnh viện, chuyên khoa) gồm tên và các chỉ số *_base (lịch hiện tại) / *_sim (kịch bản)
+    """
+    days = (end_date - start_date).days + 1
+    horizon_days = SLOT_HORIZON_WEEKS * 7
+    demand = load_demand(start_date, end_date, hospital_id, specialty_id)
+    supply = load_supply(start_date, end_date + timedelta(days=horizon_days), hospital_id, specialty_id)
+    doctors = load_doctor_counts(hospital_id, specialty_id)
+
+    baseline = simulate(demand, supply, doctors, start_date, days, horizon_days)
+    scenario = simulate(demand, supply, doctors, start_date, days, horizon_days,
+                        slot_minutes=slot_minutes, extra_weekday=extra_weekday, extra_hours=extra_hours)
+    result = baseline.merge(scenario.drop(columns=['requests', 'cancelled']), on=GROUP_KEYS,
+                            suffixes=('_base', '_sim'))
+
+    hospitals = dict(db.session.query(Hospital.hospital_id, Hospital.name).all())
+    specialties = dict(db.session.query(Specialty.specialty_id, Specialty.name).all())
+    result['hospital'] = result['hospital_id'].map(hospitals)
+    result['specialty'] = result['specialty_id'].map(specialties)
+    return result
@@ -0,0 +1,211 @@
+from datetime import datetime, date, timedelta
+from sqlalchemy import insert, or_
+from app.extensions import db
+from app.dao import dao_available_slot
+from app.models import AvailableSlot, DoctorAvailability, DayOfWeekEnum, AvailabilityException, Doctor
+from app import SLOT_DURATION_MINUTES, SLOT_HORIZON_WEEKS
+
+# Thứ tự trùng với date.weekday(): MONDAY = 0 ... SUNDAY = 6
+WEEKDAYS = list(DayOfWeekEnum)
+
+# Số dòng mỗi câu INSERT nhiều dòng
+INSERT_BATCH_SIZE = 5000
+
+
+def get_horizon_dates(day_of_week, start_date=None, weeks=SLOT_HORIZON_WEEKS):
+    """
+    Lấy các ngày trong khoảng [start_date, start_date + weeks) rơi vào day_of_week
+    """
+    start_date = start_date or date.today()
+    offset = (WEEKDAYS.index(day_of_week) - start_date.weekday()) % 7
+    first = start_date + timedelta(days=offset)
+    return [first + timedelta(weeks=i) for i in range(weeks)]
+
+
+def split_into_slots(start_time, end_time, slot_minutes=SLOT_DURATION_MINUTES):
+    """
+    Chia khung giờ làm việc thành các slot (start_time, end_time) liên tiếp,
+    phần lẻ cuối ngắn hơn slot_minutes bị bỏ qua
+    """
+    base = date.min
+    current = datetime.combine(base, start_time)
+    end = datetime.combine(base, end_time)
+    step = timedelta(minutes=slot_minutes)
+    slots = []
+    while current + step <= end:
+        slots.append((current.time(), (current + step).time()))
+        current += step
+    return slots
+
+
+def get_blocked_dates(start_date, end_date, doctor_id=None):
+    """
+    Ngày nghỉ (AvailabilityException của bác sĩ hoặc bệnh viện) trong [start_date, end_date)
+    theo từng bác sĩ: {doctor_id: {date, ...}}. Một truy vấn range trên các khoảng nghỉ, không xét từng slot.
+    """
+    query = (db.session.query(Doctor.doctor_id, AvailabilityException.start_date, AvailabilityException.end_date)
+             .join(AvailabilityException, or_(AvailabilityException.doctor_id == Doctor.doctor_id,
+                                              AvailabilityException.hospital_id == Doctor.hospital_id))
+             .filter(AvailabilityException.start_date < end_date,
+                     AvailabilityException.end_date >= start_date))
+    if doctor_id:
+        query = query.filter(Doctor.doctor_id == doctor_id)
+
+    blocked = {}
+    for row_doctor_id, off_from, off_to in query.all():
+        day = max(off_from, start_date)
+        last = min(off_to, end_date - timedelta(days=1))
+        while day <= last:
+            blocked.setdefault(row_doctor_id, set()).add(day)
+            day += timedelta(days=1)
+    return blocked
+
+
+def build_slot_rows(availabilities, start_date=None, weeks=SLOT_HORIZON_WEEKS,
+                    slot_minutes=SLOT_DURATION_MINUTES, now=None, blocked=None):
+    """
+    Trải lịch làm việc hàng tuần ra thành các dòng AvailableSlot (dạng dict để insert hàng loạt),
+    bỏ các ngày nghỉ trong blocked ({doctor_id: {date}})
+    """
+    now = now or datetime.now()
+    start_date = start_date or now.date()
+    blocked = blocked or {}
+    rows = []
+    for availability in availabilities:
+        if not availability.is_available:
+            continue
+        times = split_into_slots(availability.start_time, availability.end_time, slot_minutes)
+        off_days = blocked.get(availability.doctor_id, ())
+        slot_dates = [d for d in get_horizon_dates(availability.day_of_week, start_date, weeks) if d not in off_days]
+        rows.extend(expand_slot_rows(availability.doctor_id, slot_dates, times, now))
+    return rows
+
+
+def expand_slot_rows(doctor_id, slot_dates, times, now=None):
+    """
+    Tạo các dòng slot cho một bác sĩ từ danh sách ngày và danh sách khung giờ (start_time, end_time)
+    """
+    now = now or datetime.now()
+    rows = []
+    for slot_date in slot_dates:
+        for start_time, end_time in times:
+            slot_start = datetime.combine(slot_date, start_time)
+            # Không sinh slot đã trôi qua trong ngày hôm nay
+            if slot_start <= now:
+                continue
+            rows.append({
+                'doctor_id': doctor_id,
+                'slot_date': slot_date,
+                'start_time': start_time,
+                'end_time': end_time,
+                'slot_start': slot_start,
+                'is_booked': False
+            })
+    return rows
+
+
+def get_existing_slot_keys(start_date, end_date, doctor_id=None):
+    """
+    Lấy tập khóa (doctor_id, slot_date, start_time) của các slot đã có trong khoảng ngày
+    """
+    query = (db.session.query(AvailableSlot.doctor_id, AvailableSlot.slot_date, AvailableSlot.start_time)
+             .filter(AvailableSlot.slot_date >= start_date,
+                     AvailableSlot.slot_date < end_date))
+    if doctor_id:
+        query = query.filter(AvailableSlot.doctor_id == doctor_id)
+    return {tuple(row) for row in query.all()}
+
+
+def bulk_insert_slots(rows, batch_size=INSERT_BATCH_SIZE):
+    """
+    Insert nhiều dòng một lần (executemany -> INSERT ... VALUES (...), (...)), không tạo ORM object
+    """
+    for i in range(0, len(rows), batch_size):
+        db.session.execute(insert(AvailableSlot), rows[i:i + batch_size])
+
+
+def generate_slots(doctor_id=None, weeks=SLOT_HORIZON_WEEKS, slot_minutes=SLOT_DURATION_MINUTES,
+                   start_date=None):
+    """
+    Sinh AvailableSlot từ DoctorAvailability cho một bác sĩ (hoặc tất cả khi doctor_id=None),
+    bỏ qua các slot đã tồn tại
+    """
+    try:
+        start_date = start_date or date.today()
+        end_date = start_date + timedelta(weeks=weeks)
+
+        query = DoctorAvailability.query.filter_by(is_available=True)
+        if doctor_id:
+            query = query.filter_by(doctor_id=doctor_id)
+        availabilities = query.all()
+        if not availabilities:
+            return 0, "Không có lịch làm việc để sinh slot"
+
+        existing = get_existing_slot_keys(start_date, end_date, doctor_id)
+        blocked = get_blocked_dates(start_date, end_date, doctor_id)
+        rows = [row for row in build_slot_rows(availabilities, start_date, weeks, slot_minutes, blocked=blocked)
+                if (row['doctor_id'], row['slot_date'], row['start_time']) not in existing]
+
+        bulk_insert_slots(rows)
+        dao_available_slot.sync_day_counts(doctor_id, start_date, end_date - timedelta(days=1))
+        dao_available_slot.sync_next_slots(doctor_id)
+        db.session.commit()
+        return len(rows), f"Đã sinh {len(rows)} slot mới"
+    except Exception as e:
+        db.session.rollback()
+        return 0, f"Lỗi khi sinh slot: {str(e)}"
+
+
+def _template_slots(template, slot_minutes):
+    """Tập slot của một thiết lập (start_time, end_time, is_available) trong ngày"""
+    if not template:
+        return set()
+    start_time, end_time, is_available = template
+    if not is_available:
+        return set()
+    return set(split_into_slots(start_time, end_time, slot_minutes))
+
+
+def reconcile_day_slots(doctor_id, day_of_week, old_template, new_template,
+                        weeks=SLOT_HORIZON_WEEKS, slot_minutes=SLOT_DURATION_MINUTES, now=None):
+    """
+    Đồng bộ slot tương lai khi bác sĩ sửa lịch một ngày trong tuần:
+    chỉ thêm slot còn thiếu và xóa slot chưa đặt nằm ngoài giờ mới, không đụng slot đã đặt
+    hay slot đã qua giờ trong hôm nay (lịch sử cho thống kê vắng mặt và gợi ý lịch).
+    old_template/new_template: (start_time, end_time, is_available) hoặc None.
+    Không commit - hàm gọi chịu trách nhiệm commit.
+    """
+    old_slots = _template_slots(old_template, slot_minutes)
+    new_slots = _template_slots(new_template, slot_minutes)
+    removed = old_slots - new_slots
+    added = new_slots - old_slots
+    if not removed and not added:
+        return 0, 0
+
+    now = now or datetime.now()
+    slot_dates = get_horizon_dates(day_of_week, now.date(), weeks)
+
+    deleted_count = 0
+    if removed:
+        deleted_count = (AvailableSlot.query
+                         .filter(AvailableSlot.doctor_id == doctor_id,
+                                 AvailableSlot.slot_date.in_(slot_dates),
+                                 AvailableSlot.start_time.in_([start for start, _ in removed]),
+                                 AvailableSlot.slot_start > now,
+                                 AvailableSlot.is_booked == False,
+                                 AvailableSlot.booked_count == 0)
+                         .delete(synchronize_session=False))
+
+    rows = []
+    if added:
+        end_date = slot_dates[-1] + timedelta(days=1)
+        existing = get_existing_slot_keys(slot_dates[0], end_date, doctor_id)
+        off_days = get_blocked_dates(slot_dates[0], end_date, doctor_id).get(doctor_id, ())
+        rows = [row for row in expand_slot_rows(doctor_id, [d for d in slot_dates if d not in off_days], sorted(added),
+                                                now=now)
+                if (row['doctor_id'], row['slot_date'], row['start_time']) not in existing]
+        bulk_insert_slots(rows)
+
+    dao_available_slot.sync_day_counts(doctor_id, slot_dates[0], slot_dates[-1])
+    dao_available_slot.refresh_next_slot(doctor_id)
+    return len(rows), deleted_count
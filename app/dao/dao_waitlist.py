@@ -0,0 +1,180 @@
+from datetime import datetime, date, timedelta
+from sqlalchemy import update
+from sqlalchemy.orm import joinedload
+from app.extensions import db
+from app.models import WaitlistEntry, WaitlistStatus, AvailableSlot, Doctor
+from app.dao import dao_available_slot
+from app.email_service import send_waitlist_offer
+from app import WAITLIST_OFFER_MINUTES
+
+
+def join_waitlist(patient_id, date_from, date_to, doctor_id=None, specialty_id=None):
+    """
+    Bệnh nhân đăng ký chờ slot của một bác sĩ hoặc một chuyên khoa trong khoảng ngày
+    """
+    if not doctor_id and not specialty_id:
+        return None, "Vui lòng chọn bác sĩ hoặc chuyên khoa"
+    if date_from < date.today() or date_to < date_from:
+        return None, "Khoảng ngày không hợp lệ"
+    try:
+        entry = WaitlistEntry(
+            patient_id=patient_id,
+            doctor_id=doctor_id,
+            # Chờ theo bác sĩ thì không so theo chuyên khoa
+            specialty_id=None if doctor_id else specialty_id,
+            date_from=date_from,
+            date_to=date_to,
+            status=WaitlistStatus.Waiting
+        )
+        db.session.add(entry)
+        db.session.commit()
+        return entry, "Đã đăng ký danh sách chờ"
+    except Exception as e:
+        db.session.rollback()
+        return None, f"Lỗi khi đăng ký danh sách chờ: {str(e)}"
+
+
+def cancel_waitlist_entry(waitlist_id, patient_id):
+    """
+    Bệnh nhân rời danh sách chờ (đang chờ hoặc đang được đề nghị slot)
+    """
+    try:
+        result = db.session.execute(
+            update(WaitlistEntry)
+            .where(WaitlistEntry.waitlist_id == waitlist_id,
+                   WaitlistEntry.patient_id == patient_id,
+                   WaitlistEntry.status.in_([WaitlistStatus.Waiting, WaitlistStatus.Offered]))
+            .values(status=WaitlistStatus.Cancelled)
+        )
+        db.session.commit()
+        if result.rowcount != 1:
+            return False, "Không tìm thấy đăng ký chờ"
+        return True, "Đã rời danh sách chờ"
+    except Exception as e:
+        db.session.rollback()
+        return False, f"Lỗi khi rời danh sách chờ: {str(e)}"
+
+
+def get_patient_waitlist(patient_id):
+    return (WaitlistEntry.query
+            .options(joinedload(WaitlistEntry.doctor).joinedload(Doctor.user),
+                     joinedload(WaitlistEntry.specialty),
+                     joinedload(WaitlistEntry.offered_slot))
+            .filter(WaitlistEntry.patient_id == patient_id)
+            .order_by(WaitlistEntry.created_at.desc())
+            .all())
+
+
+def find_waitlist_match(doctor_id, specialty_id, slot_date):
+    """
+    Người chờ phù hợp nhất cho slot (doctor_id, slot_date): ưu tiên người chờ đúng bác sĩ,
+    sau đó người chờ theo chuyên khoa; cùng nhóm thì ai đăng ký trước được trước.
+    Mỗi nhóm là một lần đọc index (doctor_id|specialty_id, status, date_from) LIMIT 1.
+    """
+    scopes = [WaitlistEntry.doctor_id == doctor_id,
+              (WaitlistEntry.specialty_id == specialty_id) & WaitlistEntry.doctor_id.is_(None)]
+    for scope in scopes:
+        entry = (WaitlistEntry.query
+                 .filter(scope,
+                         WaitlistEntry.status == WaitlistStatus.Waiting,
+                         WaitlistEntry.date_from <= slot_date,
+                         WaitlistEntry.date_to >= slot_date)
+                 .order_by(WaitlistEntry.created_at, WaitlistEntry.waitlist_id)
+                 .first())
+        if entry:
+            return entry
+    return None
+
+
+def offer_released_slot(slot_id, minutes=WAITLIST_OFFER_MINUTES):
+    """
+    Đề nghị slot vừa được mở lại cho người chờ phù hợp nhất: giữ chỗ slot riêng cho người đó
+    trong minutes phút và gửi email. Trả về WaitlistEntry được đề nghị hoặc None.
+    """
+    try:
+        slot = AvailableSlot.query.get(slot_id)
+        if not slot or slot.is_booked or slot.slot_start <= datetime.now():
+            return None
+
+        entry = find_waitlist_match(slot.doctor_id, slot.doctor.specialty_id, slot.slot_date)
+        if not entry:
+            return None
+
+        # Chuyển trạng thái có điều kiện để hai lần mở slot cùng lúc không đề nghị trùng một người
+        offered = db.session.execute(
+            update(WaitlistEntry)
+            .where(WaitlistEntry.waitlist_id == entry.waitlist_id,
+                   WaitlistEntry.status == WaitlistStatus.Waiting)
+            .values(status=WaitlistStatus.Offered,
+                    offered_slot_id=slot.slot_id,
+                    offer_expires_at=datetime.now() + timedelta(minutes=minutes))
+        ).rowcount == 1
+        if not offered or not dao_available_slot.hold_slot_for(slot.slot_id, entry.patient_id, minutes):
+            db.session.rollback()
+            return None
+
+        db.session.commit()
+        db.session.refresh(entry)
+        send_waitlist_offer(entry, slot)
+        return entry
+    except Exception:
+        db.session.rollback()
+        return None
+
+
+def mark_offer_fulfilled(patient_id, slot_id):
+    """
+    Đánh dấu đề nghị đã được dùng khi bệnh nhân đặt đúng slot được đề nghị. Không commit.
+    """
+    db.session.execute(
+        update(WaitlistEntry)
+        .where(WaitlistEntry.patient_id == patient_id,
+               WaitlistEntry.offered_slot_id == slot_id,
+               WaitlistEntry.status == WaitlistStatus.Offered)
+        .values(status=WaitlistStatus.Fulfilled)
+    )
+
+
+def requeue_offers(slot_ids):
+    """
+    Các đề nghị đang chờ trả lời cho slot sắp bị xóa quay lại danh sách chờ (giữ thứ tự đăng ký).
+    Không commit. Trả về số đề nghị đã chuyển.
+    """
+    if not slot_ids:
+        return 0
+    return db.session.execute(
+        update(WaitlistEntry)
+        .where(WaitlistEntry.offered_slot_id.in_(slot_ids),
+               WaitlistEntry.status == WaitlistStatus.Offered)
+        .values(status=WaitlistStatus.Waiting, offered_slot_id=None, offer_expires_at=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def expire_offers():
+    """
+    Đề nghị quá hạn chuyển sang Expired và slot được đề nghị tiếp cho người chờ kế tiếp
+    """
+    try:
+        now = datetime.now()
+        expired = (db.session.query(WaitlistEntry.waitlist_id, WaitlistEntry.offered_slot_id)
+                   .filter(WaitlistEntry.status == WaitlistStatus.Offered,
+                           WaitlistEntry.offer_expires_at <= now)
+                   .all())
+        if not expired:
+            return 0, 0
+        db.session.execute(
+            update(WaitlistEntry)
+            .where(WaitlistEntry.waitlist_id.in_([e.waitlist_id for e in expired]))
+            .values(status=WaitlistStatus.Expired)
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        return 0, 0
+
+    reoffered = 0
+    for slot_id in {e.offered_slot_id for e in expired if e.offered_slot_id}:
+        if offer_released_slot(slot_id):
+            reoffered += 1
+    return len(expired), reoffered
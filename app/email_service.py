@@ -1,5 +1,5 @@
 from flask_mail import Message
-from flask import render_template, current_app
+from flask import render_template, current_app, url_for, has_request_context
 from app.extensions import mail
 from app.dao import dao_user, dao_doctor , dao_appointment
 
@@ -87,4 +87,140 @@ def send_appointment_notification(appointment, action):
         **template_data
     )
 
-    return True
\ No newline at end of file
+    return True
+
+
+def send_series_notification(appointments):
+    """
+    Gửi một email tổng hợp cho chuỗi lịch hẹn hàng tuần (cùng bệnh nhân, cùng bác sĩ)
+    thay vì một email cho mỗi buổi
+    """
+    first = appointments[0]
+    patient = dao_appointment.get_info_by_id(first.patient_id)
+    patient_name = f"{patient.first_name} {patient.last_name}"
+    doctor_user = dao_appointment.get_info_by_id(first.doctor_id)
+    doctor_name = f"{doctor_user.first_name} {doctor_user.last_name}"
+    doctor = dao_appointment.get_doctor_by_userid(first.doctor_id)
+    hospital_name = doctor.hospital.name if doctor and doctor.hospital else "Không xác định"
+
+    subject = f"Xác nhận đặt {len(appointments)} buổi khám định kỳ"
+    template_data = {
+        'appointments': appointments,
+        'doctor_name': doctor_name,
+        'patient_name': patient_name,
+        'hospital_name': hospital_name
+    }
+    for email, name in ((patient.email, patient_name), (doctor_user.email, doctor_name)):
+        send_email(
+            to=email,
+            subject=subject,
+            template='email/appointment_series_booking.html',
+            recipient_name=name,
+            **template_data
+        )
+    return True
+
+
+def send_waitlist_offer(entry, slot):
+    """
+    Gửi email đề nghị slot vừa mở lại cho bệnh nhân trong danh sách chờ
+    """
+    patient = dao_appointment.get_info_by_id(entry.patient_id)
+    doctor_user = dao_appointment.get_info_by_id(slot.doctor_id)
+    # Chạy từ CLI (không có request) thì không tạo được link tuyệt đối
+    book_url = url_for('book_appointment', slot_id=slot.slot_id, _external=True) if has_request_context() else None
+
+    return send_email(
+        to=patient.email,
+        subject="Có lịch khám trống phù hợp với đăng ký chờ của bạn",
+        template='email/waitlist_offer.html',
+        recipient_name=f"{patient.first_name} {patient.last_name}",
+        doctor_name=f"{doctor_user.first_name} {doctor_user.last_name}",
+        hospital_name=slot.doctor.hospital.name if slot.doctor.hospital else "Không xác định",
+        slot=slot,
+        expires_at=entry.offer_expires_at,
+        book_url=book_url
+    )
+
+
+def _send_batch(appointments, build_message):
+    """
+    Gửi email cho một lô lịch hẹn qua một kết nối SMTP, build_message(appointment) tạo Message.
+    Trả về danh sách appointment_id đã gửi được
+    """
+    sent = []
+    try:
+        with mail.connect() as conn:
+            for appointment in appointments:
+                try:
+                    conn.send(build_message(appointment))
+                    sent.append(appointment.appointment_id)
+                except Exception as e:
+                    current_app.logger.error(f"Lỗi gửi email lịch hẹn #{appointment.appointment_id}: {str(e)}")
+    except Exception as e:
+        current_app.logger.error(f"Lỗi kết nối máy chủ email: {str(e)}")
+    return sent
+
+
+def _patient_message(appointment, subject, template, **kwargs):
+    """Email gửi bệnh nhân của lịch hẹn (appointment đã nạp sẵn bệnh nhân, bác sĩ, bệnh viện)"""
+    patient = appointment.patient.user
+    doctor = appointment.doctor
+    msg = Message(
+        subject=subject,
+        sender=current_app.config['MAIL_USERNAME'],
+        recipients=[patient.email]
+    )
+    msg.html = render_template(
+        template,
+        appointment=appointment,
+        recipient_name=f"{patient.first_name} {patient.last_name}",
+        patient_name=f"{patient.first_name} {patient.last_name}",
+        doctor_name=f"{doctor.user.first_name} {doctor.user.last_name}",
+        hospital_name=doctor.hospital.name if doctor.hospital else "Không xác định",
+        **kwargs
+    )
+    return msg
+
+
+def send_reminder_batch(appointments, hours):
+    """
+    Gửi email nhắc hẹn (trước hours giờ) cho bệnh nhân của một lô lịch hẹn qua một kết nối SMTP.
+    Trả về danh sách appointment_id đã gửi được
+    """
+    return _send_batch(appointments, lambda appointment: _patient_message(
+        appointment,
+        f"Nhắc lịch khám lúc {appointment.appointment_time.strftime('%H:%M %d/%m/%Y')}"
+        f" - #{appointment.appointment_id}",
+        'email/appointment_reminder.html',
+        hours=hours
+    ))
+
+
+def send_cancellation_batch(appointments):
+    """Gửi email hủy lịch cho bệnh nhân của một lô lịch hẹn qua một kết nối SMTP"""
+    return _send_batch(appointments, lambda appointment: _patient_message(
+        appointment,
+        f"Thông báo hủy lịch hẹn - #{appointment.appointment_id}",
+        'email/appointment_cancellation.html'
+    ))
+
+
+BATCH_SENDERS = {
+    'cancellation': send_cancellation_batch,
+}
+
+
+def send_notification_batch(batch):
+    """
+    Gửi một lô thông báo từ hàng đợi (app.notifications): [(loại thông báo, appointment_id)],
+    mỗi loại một truy vấn lịch hẹn và một kết nối SMTP
+    """
+    by_action = {}
+    for action, appointment_id in batch:
+        by_action.setdefault(action, []).append(appointment_id)
+    sent = []
+    for action, appointment_ids in by_action.items():
+        appointments = dao_appointment.get_appointments_for_email(appointment_ids)
+        sent += BATCH_SENDERS[action](appointments)
+    return sent
@@ -0,0 +1,135 @@
+import hashlib
+from datetime import datetime, timedelta
+
+from flask import current_app
+from itsdangerous import URLSafeSerializer, BadSignature
+
+PRODID = '-//Flask Schedule Health//Lich kham//VI'
+FEED_SALT = 'calendar-feed'
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt=FEED_SALT)
+
+
+def make_feed_token(user_id):
+    """Token ký bằng SECRET_KEY để ứng dụng lịch tải feed mà không cần đăng nhập"""
+    return _serializer().dumps(user_id)
+
+
+def load_feed_token(token):
+    """Trả về user_id trong token, None nếu token sai"""
+    try:
+        return _serializer().loads(token)
+    except BadSignature:
+        return None
+
+
+def make_etag(user_id, role, version):
+    """ETag của feed: đổi khi phiên bản dữ liệu (dao_appointment.get_calendar_version) đổi"""
+    return hashlib.sha1(f'{user_id}:{role.value}:{version}'.encode('utf-8')).hexdigest()
+
+
+def escape_text(value):
+    """Escape TEXT theo RFC 5545"""
+    return (str(value or '')
+            .replace('\\', '\\\\')
+            .replace(';', '\\;')
+            .replace(',', '\\,')
+            .replace('\r\n', '\\n')
+            .replace('\n', '\\n'))
+
+
+def fold_line(line):
+    """Gấp dòng dài hơn 75 byte (UTF-8) thành nhiều dòng bắt đầu bằng khoảng trắng"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    limit = 75
+    while encoded:
+        cut = min(limit, len(encoded))
+        # Không cắt giữa một ký tự UTF-8 nhiều byte
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+        limit = 74  # các dòng sau mất 1 byte cho khoảng trắng đầu dòng
+    return '\r\n '.join(parts)
+
+
+def format_dt(value):
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def build_event(uid, start, end, summary, description=None, location=None, stamp=None,
+                status='CONFIRMED', transparent=False):
+    """Một VEVENT dạng chuỗi (kết thúc bằng CRLF)"""
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:{uid}',
+        f'DTSTAMP:{format_dt(stamp or datetime.now())}',
+        f'DTSTART:{format_dt(start)}',
+        f'DTEND:{format_dt(end)}',
+        f'SUMMARY:{escape_text(summary)}',
+        f'STATUS:{status}',
+        f'TRANSP:{"TRANSPARENT" if transparent else "OPAQUE"}',
+    ]
+    if description:
+        lines.append(f'DESCRIPTION:{escape_text(description)}')
+    if location:
+        lines.append(f'LOCATION:{escape_text(location)}')
+    lines.append('END:VEVENT')
+    return ''.join(fold_line(line) + '\r\n' for line in lines)
+
+
+def appointment_event(row, for_doctor):
+    """
+    VEVENT cho một lịch hẹn (row từ dao_appointment.iter_calendar_appointments).
+    Lịch đã hủy vẫn được gửi với STATUS:CANCELLED để ứng dụng lịch xóa sự kiện cũ.
+    """
+    status = row.status.value if row.status else 'Scheduled'
+    if for_doctor:
+        summary = f'Khám: {row.first_name} {row.last_name}'
+    else:
+        summary = f'Khám với BS. {row.first_name} {row.last_name}'
+    return build_event(
+        uid=f'appointment-{row.appointment_id}@flask-schedule-health',
+        start=row.appointment_time,
+        end=row.appointment_time + timedelta(minutes=row.duration_minutes or 30),
+        summary=summary,
+        description=row.reason,
+        location=row.hospital_name,
+        stamp=row.updated_at,
+        status='CANCELLED' if status.startswith('Cancelled') else 'CONFIRMED'
+    )
+
+
+def free_slot_event(row):
+    """VEVENT cho một slot trống của bác sĩ (không chiếm thời gian trong lịch)"""
+    return build_event(
+        uid=f'slot-{row.slot_id}@flask-schedule-health',
+        start=row.slot_start,
+        end=datetime.combine(row.slot_date, row.end_time),
+        summary='Slot trống',
+        stamp=row.updated_at,
+        status='TENTATIVE',
+        transparent=True
+    )
+
+
+def stream_calendar(name, *event_groups):
+    """
+    Sinh nội dung .ics từng phần: header, từng VEVENT khi đọc từ cursor, footer.
+    Không dựng toàn bộ lịch trong bộ nhớ.
+    """
+    yield ('BEGIN:VCALENDAR\r\n'
+           'VERSION:2.0\r\n'
+           f'PRODID:{PRODID}\r\n'
+           'CALSCALE:GREGORIAN\r\n'
+           'METHOD:PUBLISH\r\n'
+           f'{fold_line("X-WR-CALNAME:" + escape_text(name))}\r\n')
+    for events in event_groups:
+        for event in events:
+            yield event
+    yield 'END:VCALENDAR\r\n'
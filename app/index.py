@@ -8,7 +8,8 @@ from app.extensions import db
 # Hàm này luôn truyền các info vào -> .html nao cung co
 @app.context_processor
 def common_attr():
-    if current_user.is_authenticated:
+    # Email render ngoài request (process nhắc hẹn, cron) không có current_user
+    if current_user and current_user.is_authenticated:
         user = dao_authen.get_info_by_id(current_user.user_id)
         doctor = dao_authen.get_doctor_by_userid(current_user.user_id)
         return {
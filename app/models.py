@@ -72,6 +72,14 @@ class PaymentStatus(enum.Enum):
     Refunded = "Refunded"
 
 
+class WaitlistStatus(enum.Enum):
+    Waiting = "Waiting"
+    Offered = "Offered"
+    Fulfilled = "Fulfilled"
+    Expired = "Expired"
+    Cancelled = "Cancelled"
+
+
 # User
 class User(BaseModel ,UserMixin):
     __tablename__ = 'user'
@@ -146,6 +154,8 @@ class Doctor(db.Model):
     bio = db.Column(db.Text)
     consultation_fee = db.Column(db.Numeric(10, 2), default=0.00)
     average_rating = db.Column(db.Numeric(3, 2), default=0.00)
+    # Bộ đếm thay đổi phòng chờ khám online, tăng cùng transaction với mỗi check-in/gọi/đổi ưu tiên
+    queue_version = db.Column(db.Integer, nullable=False, default=0)
 
     hospital = db.relationship('Hospital', backref='doctors')
     specialty = db.relationship('Specialty', backref='doctor')
@@ -188,12 +198,50 @@ class DoctorAvailability(BaseModel):
     is_available = db.Column(db.Boolean, default=True)
     start_time = db.Column(db.Time, nullable=False)
     end_time = db.Column(db.Time, nullable=False)
+    # 48 bit nửa giờ làm việc trong ngày (0 nếu nghỉ), tính sẵn cho bộ lọc tìm bác sĩ theo giờ
+    slot_mask = db.Column(db.BigInteger, nullable=False, default=0)
     # Đảm bảo mỗi bác sĩ chỉ có một thiết lập cho mỗi ngày trong tuần
     __table_args__ = (
         db.UniqueConstraint('doctor_id', 'day_of_week', name='unique_doctor_day'),
     )
 
 
+# Ngày nghỉ ngoài lịch tuần (nghỉ phép của bác sĩ, bệnh viện nghỉ lễ), áp dụng cho [start_date, end_date]
+class AvailabilityException(BaseModel):
+    __tablename__ = 'availabilityexception'
+
+    exception_id = db.Column(db.Integer, primary_key=True)
+    # Nghỉ của một bác sĩ (doctor_id) hoặc cả bệnh viện (hospital_id)
+    doctor_id = db.Column(
+        db.Integer,
+        db.ForeignKey('doctor.doctor_id', ondelete='CASCADE'),
+        nullable=True
+    )
+    hospital_id = db.Column(
+        db.Integer,
+        db.ForeignKey('hospital.hospital_id', ondelete='CASCADE'),
+        nullable=True
+    )
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    reason = db.Column(db.String(255))
+
+    doctor = db.relationship('Doctor', backref='availability_exceptions')
+    hospital = db.relationship('Hospital', backref='availability_exceptions')
+
+    __table_args__ = (
+        db.CheckConstraint('doctor_id IS NOT NULL OR hospital_id IS NOT NULL', name='check_exception_scope'),
+        db.Index('idx_exception_doctor_dates', 'doctor_id', 'start_date', 'end_date'),
+        db.Index('idx_exception_hospital_dates', 'hospital_id', 'start_date', 'end_date'),
+    )
+
+
+def slot_start_default(context):
+    """Ghép slot_date + start_time khi insert slot"""
+    params = context.get_current_parameters()
+    return datetime.combine(params['slot_date'], params['start_time'])
+
+
 class AvailableSlot(BaseModel):
     __tablename__ = 'availableslot'
 
@@ -207,12 +255,70 @@ class AvailableSlot(BaseModel):
     is_booked = db.Column(db.Boolean, default=False)
     start_time = db.Column(db.Time, nullable=False)
     end_time = db.Column(db.Time, nullable=False)
+    # Thời điểm bắt đầu (slot_date + start_time) để lọc slot tương lai bằng một điều kiện range dùng được index
+    slot_start = db.Column(db.DateTime, nullable=True, default=slot_start_default)
+    # Giữ chỗ tạm thời khi bệnh nhân đang điền form đặt lịch
+    held_by = db.Column(
+        db.Integer,
+        db.ForeignKey('patient.patient_id', ondelete='SET NULL'),
+        nullable=True
+    )
+    held_until = db.Column(db.DateTime, nullable=True)
+    # Số lượt đặt tối đa (> 1 khi đặt vượt ở khung giờ hay vắng) và số lượt đã đặt;
+    # is_booked = booked_count >= capacity nên các truy vấn slot trống vẫn lọc theo is_booked
+    capacity = db.Column(db.Integer, nullable=False, default=1)
+    booked_count = db.Column(db.Integer, nullable=False, default=0)
 
     doctor = db.relationship('Doctor', backref='available_slots', lazy=True)
     # Để tối ưu hiệu suất truy vấn
     __table_args__ = (
+        # Mỗi bác sĩ chỉ có một slot bắt đầu tại một thời điểm (chống sinh trùng)
+        db.UniqueConstraint('doctor_id', 'slot_date', 'start_time', name='unique_doctor_slot'),
         db.Index('idx_doctor_date', 'doctor_id', 'slot_date'),
         db.Index('idx_available_slots', 'doctor_id', 'slot_date', 'is_booked'),
+        db.Index('idx_slot_held_until', 'held_until'),
+        db.Index('idx_slot_booked_start', 'is_booked', 'slot_start'),
+        db.Index('idx_slot_doctor_booked_start', 'doctor_id', 'is_booked', 'slot_start'),
+    )
+
+
+# Slot trống sớm nhất của từng bác sĩ, cập nhật khi đặt/hủy/đổi lịch và khi sinh slot
+class DoctorNextSlot(db.Model):
+    __tablename__ = 'doctornextslot'
+
+    doctor_id = db.Column(
+        db.Integer,
+        db.ForeignKey('doctor.doctor_id', ondelete='CASCADE'),
+        primary_key=True
+    )
+    slot_id = db.Column(
+        db.Integer,
+        db.ForeignKey('availableslot.slot_id', ondelete='SET NULL'),
+        nullable=True
+    )
+    slot_start = db.Column(db.DateTime, nullable=True)  # NULL khi bác sĩ không còn slot trống
+
+    __table_args__ = (
+        db.Index('idx_next_slot_start', 'slot_start'),
+    )
+
+
+# Số lượt còn đặt được / đã đặt theo (bác sĩ, ngày) cho lịch tháng và phân bác sĩ theo tải,
+# cập nhật khi đặt/hủy/đổi lịch và khi sinh slot
+class DoctorDayCount(db.Model):
+    __tablename__ = 'doctordaycount'
+
+    doctor_id = db.Column(
+        db.Integer,
+        db.ForeignKey('doctor.doctor_id', ondelete='CASCADE'),
+        primary_key=True
+    )
+    slot_date = db.Column(db.Date, primary_key=True)
+    free_count = db.Column(db.Integer, nullable=False, default=0)
+    booked_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('idx_day_count_date', 'slot_date'),
     )
 # Patient
 class Patient(db.Model):
@@ -244,16 +350,82 @@ class Appointment(BaseModel):
         db.ForeignKey('doctor.doctor_id', ondelete='CASCADE'),
         nullable=False
     )
+    # Slot đã đặt - mở lại slot bằng khóa chính thay vì dò theo giờ hẹn
+    slot_id = db.Column(
+        db.Integer,
+        db.ForeignKey('availableslot.slot_id', ondelete='SET NULL'),
+        nullable=True,
+        index=True
+    )
     appointment_time = db.Column(db.DateTime, nullable=False)
     duration_minutes = db.Column(db.Integer, default=30)
+    # Số slot liên tiếp đã đặt (lịch khám dài), bắt đầu từ slot_id
+    slot_count = db.Column(db.Integer, default=1)
     reason = db.Column(db.Text)
     status = db.Column(db.Enum(AppointmentStatus), default=AppointmentStatus.Scheduled)
     consultation_type = db.Column(db.Enum(ConsultationType), default=ConsultationType.Offline)
     cancellation_reason = db.Column(db.Text)
+    # Phòng chờ khám online: giờ check-in, độ ưu tiên (lớn hơn được gọi trước), giờ bác sĩ gọi vào khám
+    checked_in_at = db.Column(db.DateTime, nullable=True)
+    queue_priority = db.Column(db.Integer, nullable=False, default=0)
+    called_at = db.Column(db.DateTime, nullable=True)
+    # Các lượt nhắc hẹn đã gửi, bit i ứng với REMINDER_HOURS[i]; đổi lịch thì đặt lại 0
+    reminder_mask = db.Column(db.Integer, nullable=False, default=0)
 
     invoice = db.relationship('Invoice', backref='appointment', uselist=False)
     health_record = db.relationship('HealthRecord', backref='appointment', uselist=False)
     doctor = db.relationship('Doctor')  # vẫn giữ nguyên vì không có đối ứng
+    slot = db.relationship('AvailableSlot')
+
+    __table_args__ = (
+        # Quét lịch hẹn quá hạn theo trạng thái (NoShow) và lọc lịch sắp tới
+        db.Index('idx_appointment_status_time', 'status', 'appointment_time'),
+    )
+
+
+# Danh sách chờ: bệnh nhân đăng ký chờ slot của một bác sĩ hoặc một chuyên khoa trong khoảng ngày
+class WaitlistEntry(BaseModel):
+    __tablename__ = 'waitlistentry'
+
+    waitlist_id = db.Column(db.Integer, primary_key=True)
+    patient_id = db.Column(
+        db.Integer,
+        db.ForeignKey('patient.patient_id', ondelete='CASCADE'),
+        nullable=False
+    )
+    # Chờ theo bác sĩ (doctor_id) hoặc theo chuyên khoa (specialty_id, doctor_id = NULL)
+    doctor_id = db.Column(
+        db.Integer,
+        db.ForeignKey('doctor.doctor_id', ondelete='CASCADE'),
+        nullable=True
+    )
+    specialty_id = db.Column(
+        db.Integer,
+        db.ForeignKey('specialty.specialty_id', ondelete='CASCADE'),
+        nullable=True
+    )
+    date_from = db.Column(db.Date, nullable=False)
+    date_to = db.Column(db.Date, nullable=False)
+    status = db.Column(db.Enum(WaitlistStatus), default=WaitlistStatus.Waiting, nullable=False)
+    # Slot đang được đề nghị riêng cho bệnh nhân này và hạn trả lời
+    offered_slot_id = db.Column(
+        db.Integer,
+        db.ForeignKey('availableslot.slot_id', ondelete='SET NULL'),
+        nullable=True
+    )
+    offer_expires_at = db.Column(db.DateTime, nullable=True)
+
+    patient = db.relationship('Patient', backref='waitlist_entries')
+    doctor = db.relationship('Doctor')
+    specialty = db.relationship('Specialty')
+    offered_slot = db.relationship('AvailableSlot')
+
+    __table_args__ = (
+        # Tìm người chờ khi slot được mở lại: theo (bác sĩ, ngày) hoặc (chuyên khoa, ngày)
+        db.Index('idx_waitlist_doctor_date', 'doctor_id', 'status', 'date_from'),
+        db.Index('idx_waitlist_specialty_date', 'specialty_id', 'status', 'date_from'),
+        db.Index('idx_waitlist_offer_expires', 'status', 'offer_expires_at'),
+    )
 
 
 # HealthRecord
@@ -303,6 +475,21 @@ class Invoice(BaseModel):
 
     payment = db.relationship('Payment', backref='invoice', uselist=False)
 
+    __table_args__ = (
+        # Quét hóa đơn quá hạn (Pending -> Overdue) và tìm hóa đơn chưa thanh toán theo hạn
+        db.Index('idx_invoice_status_due', 'status', 'due_date'),
+    )
+
+
+# Số hóa đơn chưa thanh toán (Pending/Overdue) và tổng tiền theo hạn thanh toán, cho bảng tuổi nợ ở trang admin.
+# Cập nhật khi tạo/hủy/thanh toán hóa đơn; chuyển Pending -> Overdue không làm đổi bảng này
+class InvoiceAging(db.Model):
+    __tablename__ = 'invoiceaging'
+
+    due_date = db.Column(db.Date, primary_key=True)
+    outstanding_count = db.Column(db.Integer, nullable=False, default=0)
+    outstanding_amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
 
 # Payment
 class Payment(db.Model):
@@ -0,0 +1,62 @@
+"""
+Hàng đợi email thông báo gửi nền cho các thao tác hàng loạt (hủy cả ngày khám của bác sĩ).
+
+Request chỉ đưa (loại thông báo, appointment_id) vào hàng đợi rồi trả về ngay. Một thread nền của process
+lấy tối đa NOTIFICATION_BATCH_SIZE thông báo mỗi lần, đọc lịch hẹn bằng một truy vấn và gửi cả lô qua
+một kết nối SMTP (email_service.send_notification_batch).
+
+Hàng đợi nằm trong bộ nhớ: thông báo chưa gửi sẽ mất nếu process dừng, trạng thái lịch hẹn trong DB
+không bị ảnh hưởng.
+"""
+import queue
+import threading
+
+from app import app, NOTIFICATION_BATCH_SIZE
+
+
+class NotificationQueue:
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def enqueue(self, action, appointment_ids):
+        for appointment_id in appointment_ids:
+            self._queue.put((action, appointment_id))
+        self._ensure_worker()
+
+    def next_batch(self, timeout=None):
+        """Tối đa batch_size thông báo; chờ thông báo đầu tiên tối đa timeout giây (None là chờ mãi)"""
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='notification-queue', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        from app.email_service import send_notification_batch
+        while True:
+            batch = self.next_batch()
+            with app.app_context():
+                try:
+                    send_notification_batch(batch)
+                except Exception as e:
+                    app.logger.error(f"Lỗi gửi thông báo theo lô: {str(e)}")
+
+
+outbox = NotificationQueue(NOTIFICATION_BATCH_SIZE)
@@ -0,0 +1,75 @@
+"""
+Lịch nhắc hẹn (24h và 2h trước giờ khám): heap các lượt nhắc sắp đến hạn trong bộ nhớ.
+
+Mỗi REMINDER_WINDOW_MINUTES phút, dao_appointment.load_reminder_window đọc lịch hẹn Scheduled có lượt nhắc
+rơi vào cửa sổ tiếp theo bằng một truy vấn theo khoảng appointment_time, thay vì hỏi DB mỗi phút.
+Lượt nhắc đã gửi được đánh dấu trong appointment.reminder_mask nên không gửi lại.
+
+Web worker không chạm vào heap này (nó nằm ở process khác); mọi thay đổi đi qua DB:
+- Đặt lịch / đổi lịch: cửa sổ mới lùi lại một cửa sổ nên lần nạp kế tiếp (trong vòng một cửa sổ) thấy
+  lịch vừa đặt hoặc giờ mới. Đổi lịch đặt lại reminder_mask theo giờ mới (passed_mask); lượt nhắc theo giờ
+  mới thay phần tử cũ trong heap, phần tử cũ bị bỏ qua khi lên đỉnh (lazy deletion).
+- Hủy / hoàn thành / đổi giờ: từng lô được đọc lại từ DB ngay trước khi gửi, lịch không còn Scheduled
+  hoặc giờ hẹn đã khác thì bỏ qua.
+Chạy một process duy nhất: `flask --app app.index run-reminders`.
+"""
+import heapq
+import threading
+from datetime import timedelta
+
+from app import REMINDER_HOURS, REMINDER_WINDOW_MINUTES
+
+
+class ReminderScheduler:
+    def __init__(self, hours, window_minutes):
+        self.hours = tuple(hours)
+        self.window = timedelta(minutes=window_minutes)
+        self.lock = threading.RLock()
+        self.loaded_until = None  # Lượt nhắc trước mốc này đã được nạp vào heap
+        self._heap = []
+        self._entries = {}  # (appointment_id, hours) -> thời điểm nhắc đang hiệu lực
+
+    def __len__(self):
+        return len(self._entries)
+
+    def bit(self, hours):
+        """Bit của lượt nhắc trong appointment.reminder_mask"""
+        return 1 << self.hours.index(hours)
+
+    def needs_load(self, now):
+        return self.loaded_until is None or now + self.window > self.loaded_until
+
+    def load_range(self, now):
+        """Khoảng thời điểm nhắc [start, end) cần nạp: lùi một cửa sổ, tới hết cửa sổ kế tiếp"""
+        return now - self.window, now + 2 * self.window
+
+    def push(self, appointment_id, appointment_time, hours):
+        fire_at = appointment_time - timedelta(hours=hours)
+        with self.lock:
+            key = (appointment_id, hours)
+            if self._entries.get(key) == fire_at:
+                return
+            self._entries[key] = fire_at
+            heapq.heappush(self._heap, (fire_at, appointment_id, hours, appointment_time))
+
+    def passed_mask(self, appointment_time, now):
+        """reminder_mask cho lịch hẹn vừa đổi sang appointment_time: các lượt nhắc đã qua thời điểm nhắc"""
+        mask = 0
+        for hours in self.hours:
+            if appointment_time - timedelta(hours=hours) <= now:
+                mask |= self.bit(hours)
+        return mask
+
+    def pop_due(self, now):
+        """Các lượt nhắc đã đến hạn: danh sách (appointment_id, appointment_time, hours)"""
+        due = []
+        with self.lock:
+            while self._heap and self._heap[0][0] <= now:
+                fire_at, appointment_id, hours, appointment_time = heapq.heappop(self._heap)
+                if self._entries.get((appointment_id, hours)) == fire_at:
+                    del self._entries[(appointment_id, hours)]
+                    due.append((appointment_id, appointment_time, hours))
+        return due
+
+
+scheduler = ReminderScheduler(REMINDER_HOURS, REMINDER_WINDOW_MINUTES)
@@ -0,0 +1,249 @@
+"""
+Kênh sự kiện slot (đặt/mở lại/xóa) cho endpoint Server-Sent Events.
+
+Mặc định là hub trong bộ nhớ của process. Khi chạy nhiều worker, đặt SLOT_EVENT_BROKER=host:port
+và chạy `flask --app app.index slot-event-broker`: mỗi worker gửi sự kiện lên broker, broker phát lại
+cho tất cả worker, mỗi worker chuyển tiếp cho các client SSE của mình.
+"""
+import json
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+from app import app
+
+BOOKED = 'booked'
+RELEASED = 'released'
+DELETED = 'deleted'  # Slot bị xóa (ngày nghỉ của bác sĩ)
+FILTER_KEYS = ('hospital_id', 'specialty_id', 'doctor_id')
+
+
+def slot_event(kind, slot):
+    """Dữ liệu sự kiện của một slot; tạo trước khi commit, publish sau khi commit"""
+    return {
+        'type': kind,
+        'slot_id': slot.slot_id,
+        'doctor_id': slot.doctor_id,
+        'hospital_id': slot.doctor.hospital_id,
+        'specialty_id': slot.doctor.specialty_id,
+        'slot_date': slot.slot_date.isoformat(),
+        'start_time': slot.start_time.strftime('%H:%M'),
+    }
+
+
+def format_sse(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+class Subscription:
+    """Một client SSE: hàng đợi riêng và bộ lọc hospital/specialty/doctor"""
+
+    def __init__(self, filters, maxsize=100):
+        self.filters = {key: value for key, value in filters.items() if value}
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def matches(self, event):
+        return all(event.get(key) == value for key, value in self.filters.items())
+
+    def put(self, event):
+        # Client đọc chậm: bỏ sự kiện cũ nhất thay vì chặn người publish
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class SlotEventHub:
+    def __init__(self, broker=None):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._broker = _parse_address(broker) if broker else None
+        self._conn = None
+        self._conn_lock = threading.Lock()
+        self._retry_at = 0
+
+    def subscribe(self, **filters):
+        subscription = Subscription({key: filters.get(key) for key in FILTER_KEYS})
+        with self._lock:
+            self._subscribers.add(subscription)
+        if self._broker:
+            self._connect()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def dispatch(self, event):
+        """Chuyển sự kiện cho các client SSE của process này"""
+        with self._lock:
+            subscribers = [s for s in self._subscribers if s.matches(event)]
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def publish(self, event):
+        """
+        Phát sự kiện. Có broker thì gửi lên broker (broker phát lại cho cả process này),
+        không kết nối được broker thì phát trong process. Không bao giờ raise cho nơi gọi
+        (lỗi được ghi log, lịch hẹn đã commit không bị ảnh hưởng).
+        """
+        try:
+            if self._broker and self._send(event):
+                return
+            self.dispatch(event)
+        except Exception:
+            app.logger.exception(f"Lỗi khi phát sự kiện slot {event.get('slot_id')}")
+
+    # ---------- broker ----------
+    def _connect(self):
+        with self._conn_lock:
+            if self._conn or time.monotonic() < self._retry_at:
+                return self._conn
+            try:
+                conn = socket.create_connection(self._broker, timeout=1)
+                conn.settimeout(None)
+            except OSError:
+                self._retry_at = time.monotonic() + 5
+                return None
+            self._conn = conn
+            threading.Thread(target=self._read_broker, args=(conn,), daemon=True).start()
+            return conn
+
+    def _send(self, event):
+        conn = self._connect()
+        if not conn:
+            return False
+        try:
+            with self._conn_lock:
+                conn.sendall((json.dumps(event) + '\n').encode('utf-8'))
+            return True
+        except OSError:
+            self._drop(conn)
+            return False
+
+    def _read_broker(self, conn):
+        try:
+            for line in conn.makefile('r', encoding='utf-8'):
+                if line.strip():
+                    self.dispatch(json.loads(line))
+        except (OSError, ValueError):
+            pass
+        self._drop(conn)
+
+    def _drop(self, conn):
+        with self._conn_lock:
+            if self._conn is conn:
+                self._conn = None
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+
+def _parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class _BrokerClient:
+    """
+    Một worker đang kết nối tới broker: hàng đợi dòng cần gửi và thread ghi riêng, nên một socket
+    chậm/treo chỉ làm đầy hàng đợi của chính nó (rồi bị ngắt) chứ không chặn việc phát cho worker khác.
+    Chỉ thread ghi chạm vào wfile nên các dòng không xen vào nhau.
+    """
+
+    def __init__(self, server, connection, wfile, maxsize=1000):
+        self.server = server
+        self.connection = connection
+        self.wfile = wfile
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.closed = False
+        threading.Thread(target=self._write, daemon=True).start()
+
+    def put(self, line):
+        """Đưa một dòng vào hàng đợi gửi; False nếu client đã đóng hoặc hàng đợi đầy (client treo)"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(line)
+            return True
+        except queue.Full:
+            return False
+
+    def _write(self):
+        while True:
+            line = self.queue.get()
+            if line is None or self.closed:
+                return
+            try:
+                self.wfile.write(line)
+                self.wfile.flush()
+            except (OSError, ValueError):
+                self.server.drop(self)
+                return
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        try:
+            # Ngắt cả lệnh ghi đang treo và vòng đọc của handler
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        client = _BrokerClient(self.server, self.connection, self.wfile)
+        with self.server.lock:
+            self.server.clients.add(client)
+        try:
+            for line in self.rfile:
+                # Chỉ giữ lock khi sao chép danh sách client, việc ghi do thread của từng client đảm nhận
+                with self.server.lock:
+                    clients = list(self.server.clients)
+                for other in clients:
+                    if not other.put(line):
+                        self.server.drop(other)
+        except OSError:
+            pass
+        finally:
+            self.server.drop(client)
+
+
+class SlotEventBroker(socketserver.ThreadingTCPServer):
+    """Broker cục bộ: nhận từng dòng JSON từ một worker và phát lại cho mọi worker đang kết nối"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(_parse_address(address), _BrokerHandler)
+        self.clients = set()
+        self.lock = threading.Lock()
+
+    def drop(self, client):
+        """Ngắt một worker (ghi lỗi, treo hoặc đã đóng kết nối)"""
+        with self.lock:
+            self.clients.discard(client)
+        client.close()
+
+
+hub = SlotEventHub(app.config.get('SLOT_EVENT_BROKER'))
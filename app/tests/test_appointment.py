@@ -2,8 +2,12 @@
 import unittest
 from unittest.mock import patch, MagicMock
 from datetime import datetime, date, time, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
 from app.dao import dao_appointment
-from app.models import Appointment, AvailableSlot, Invoice, AppointmentStatus, InvoiceStatus, ConsultationType
+from app import waiting_room, reminders
+from app.models import Appointment, AvailableSlot, Invoice, AppointmentStatus, InvoiceStatus, ConsultationType, \
+    DayOfWeekEnum
 
 
 class TestDAOAppointment(unittest.TestCase):
@@ -12,19 +16,23 @@ class TestDAOAppointment(unittest.TestCase):
         self.mock_db = MagicMock()
 
     # ---------- book_appointment ----------
+    @patch("app.dao.dao_appointment.dao_invoice")
+    @patch("app.dao.dao_appointment.dao_waitlist")
+    @patch("app.dao.dao_appointment.dao_available_slot")
     @patch("app.dao.dao_appointment.AvailableSlot")
     @patch("app.dao.dao_appointment.db")
     @patch("app.dao.dao_appointment.send_appointment_notification")
-    def test_book_appointment_success(self, mock_send_notification, mock_db, mock_slot):
+    def test_book_appointment_success(self, mock_send_notification, mock_db, mock_slot, mock_slot_dao, mock_waitlist,
+                                      mock_invoice):
         # Mock data
         mock_slot_instance = MagicMock()
-        mock_slot_instance.is_booked = False
         mock_slot_instance.doctor_id = 1
         mock_slot_instance.slot_date = date(2024, 1, 1)
         mock_slot_instance.start_time = time(9, 0)
         mock_slot_instance.end_time = time(10, 0)
         mock_slot_instance.doctor.consultation_fee = 200000
 
+        mock_slot_dao.claim_slot.return_value = True
         mock_slot.query.get.return_value = mock_slot_instance
 
         # Mock appointment and invoice creation
@@ -43,15 +51,22 @@ class TestDAOAppointment(unittest.TestCase):
         # Assert
         self.assertIsNotNone(result)
         self.assertEqual(message, "Đặt lịch thành công")
+        mock_slot_dao.claim_slot.assert_called_once_with(1, 1)
         mock_slot.query.get.assert_called_once_with(1)
-        self.assertTrue(mock_slot_instance.is_booked)
+        mock_waitlist.mark_offer_fulfilled.assert_called_once_with(1, 1)
+        mock_slot_dao.refresh_next_slot.assert_called_once_with(mock_slot_instance.doctor_id)
+        mock_slot_dao.adjust_free_count.assert_called_once_with(mock_slot_instance.doctor_id,
+                                                                mock_slot_instance.slot_date, -1)
+        mock_invoice.adjust_invoice_aging.assert_called_once_with(date(2024, 1, 1), 200000, 1)
         mock_db.session.add.assert_called()
         mock_db.session.commit.assert_called_once()
         mock_send_notification.assert_called_once()
 
+    @patch("app.dao.dao_appointment.dao_available_slot")
     @patch("app.dao.dao_appointment.AvailableSlot")
     @patch("app.dao.dao_appointment.db")
-    def test_book_appointment_slot_not_found(self, mock_db, mock_slot):
+    def test_book_appointment_slot_not_found(self, mock_db, mock_slot, mock_slot_dao):
+        mock_slot_dao.claim_slot.return_value = False
         mock_slot.query.get.return_value = None
 
         result, message = dao_appointment.book_appointment(1, 99, "Khám")
@@ -60,24 +75,55 @@ class TestDAOAppointment(unittest.TestCase):
         self.assertEqual(message, "Slot không tồn tại")
         mock_db.session.rollback.assert_not_called()
 
+    @patch("app.dao.dao_appointment.dao_available_slot")
     @patch("app.dao.dao_appointment.AvailableSlot")
     @patch("app.dao.dao_appointment.db")
-    def test_book_appointment_slot_already_booked(self, mock_db, mock_slot):
-        mock_slot_instance = MagicMock()
-        mock_slot_instance.is_booked = True
-        mock_slot.query.get.return_value = mock_slot_instance
+    def test_book_appointment_slot_already_booked(self, mock_db, mock_slot, mock_slot_dao):
+        # UPDATE có điều kiện không cập nhật được dòng nào -> slot đã bị người khác đặt
+        mock_slot_dao.claim_slot.return_value = False
+        mock_slot.query.get.return_value = MagicMock(is_booked=True)
 
         result, message = dao_appointment.book_appointment(1, 1, "Khám")
 
         self.assertIsNone(result)
         self.assertEqual(message, "Slot đã được đặt")
+        mock_db.session.add.assert_not_called()
 
+    @patch("app.dao.dao_appointment.dao_available_slot")
     @patch("app.dao.dao_appointment.AvailableSlot")
     @patch("app.dao.dao_appointment.db")
-    def test_book_appointment_exception(self, mock_db, mock_slot):
-        mock_slot_instance = MagicMock()
-        mock_slot_instance.is_booked = False
-        mock_slot.query.get.return_value = mock_slot_instance
+    def test_book_appointment_slot_held_by_other(self, mock_db, mock_slot, mock_slot_dao):
+        # Slot chưa đặt nhưng đang được bệnh nhân khác giữ chỗ
+        mock_slot_dao.claim_slot.return_value = False
+        mock_slot.query.get.return_value = MagicMock(is_booked=False, booked_count=0)
+
+        result, message = dao_appointment.book_appointment(1, 1, "Khám")
+
+        self.assertIsNone(result)
+        self.assertEqual(message, "Slot đang được bệnh nhân khác giữ chỗ")
+
+    @patch("app.dao.dao_appointment.Appointment")
+    @patch("app.dao.dao_appointment.dao_available_slot")
+    @patch("app.dao.dao_appointment.AvailableSlot")
+    @patch("app.dao.dao_appointment.db")
+    def test_book_appointment_overbooked_slot_already_booked(self, mock_db, mock_slot, mock_slot_dao, mock_appointment):
+        # Slot đặt vượt còn lượt nhưng bệnh nhân đã đặt một lượt
+        mock_slot_dao.claim_slot.return_value = False
+        mock_slot.query.get.return_value = MagicMock(is_booked=False, booked_count=1)
+        mock_appointment.query.filter_by.return_value.first.return_value = MagicMock()
+
+        result, message = dao_appointment.book_appointment(1, 1, "Khám")
+
+        self.assertIsNone(result)
+        self.assertEqual(message, "Bạn đã đặt slot này")
+
+    @patch("app.dao.dao_appointment.dao_waitlist")
+    @patch("app.dao.dao_appointment.dao_available_slot")
+    @patch("app.dao.dao_appointment.AvailableSlot")
+    @patch("app.dao.dao_appointment.db")
+    def test_book_appointment_exception(self, mock_db, mock_slot, mock_slot_dao, mock_waitlist):
+        mock_slot_dao.claim_slot.return_value = True
+        mock_slot.query.get.return_value = MagicMock()
         mock_db.session.commit.side_effect = Exception("Database error")
 
         result, message = dao_appointment.book_appointment(1, 1, "Khám")
@@ -86,6 +132,145 @@ class TestDAOAppointment(unittest.TestCase):
         self.assertIn("Lỗi khi đặt lịch", message)
         mock_db.session.rollback.assert_called_once()
 
+    @patch("app.dao.dao_appointment.dao_invoice")
+    @patch("app.dao.dao_appointment.send_appointment_notification")
+    @patch("app.dao.dao_appointment.slot_events")
+    @patch("app.dao.dao_appointment.dao_waitlist")
+    @patch("app.dao.dao_appointment.dao_available_slot")
+    @patch("app.dao.dao_appointment.db")
+    def test_book_appointment_multi_slot(self, mock_db, mock_slot_dao, mock_waitlist, mock_events, mock_send,
+                                         mock_invoice):
+        run = [MagicMock(slot_id=i, doctor_id=1, slot_date=date(2030, 1, 7), start_time=start, end_time=end)
+               for i, start, end in ((4, time(9, 0), time(9, 30)), (5, time(9, 30), time(10, 0)),
+                                     (6, time(10, 0), time(10, 30)))]
+        mock_slot_dao.get_slot_run.return_value = run
+        mock_slot_dao.claim_slots.return_value = True
+
+        appointment, message = dao_appointment.book_appointment(2, 4, "Tư vấn dài", slot_count=3)
+
+        self.assertEqual(message, "Đặt lịch thành công")
+        mock_slot_dao.claim_slots.assert_called_once_with([4, 5, 6], 2)
+        mock_slot_dao.claim_slot.assert_not_called()
+        self.assertEqual(appointment.slot_count, 3)
+        self.assertEqual(appointment.duration_minutes, 90)
+        mock_slot_dao.adjust_free_count.assert_called_once_with(1, date(2030, 1, 7), -3)
+        self.assertEqual(mock_events.hub.publish.call_count, 3)
+
+    @patch("app.dao.dao_appointment.dao_available_slot")
+    @patch("app.dao.dao_appointment.db")
+    def test_book_appointment_multi_slot_not_enough(self, mock_db, mock_slot_dao):
+        mock_slot_dao.get_slot_run.return_value = None
+
+        appointment, message = dao_appointment.book_appointment(2, 4, "Tư vấn dài", slot_count=2)
+
+        self.assertIsNone(appointment)
+        self.assertEqual(message, "Không còn đủ 2 slot liên tiếp từ giờ đã chọn")
+        mock_slot_dao.claim_slots.assert_not_called()
+
+    # ---------- book_any_doctor ----------
+    @patch("app.dao.dao_appointment.book_appointment")
+    @patch("app.dao.dao_appointment.dao_available_slot")
+    def test_book_any_doctor_tries_next_slot_when_taken(self, mock_slot_dao, mock_book):
+        # Slot đã sắp theo tải bác sĩ; slot đầu vừa bị người khác chiếm
+        mock_slot_dao.find_assignable_slots.return_value = [MagicMock(slot_id=4), MagicMock(slot_id=9)]
+        appointment = MagicMock()
+        mock_book.side_effect = [(None, "Slot đã được đặt"), (appointment, "Đặt lịch thành công")]
+
+        result, message = dao_appointment.book_any_doctor(1, 2, 3, date(2030, 1, 7), time(8, 0), time(12, 0), "Khám")
+
+        self.assertEqual(result, appointment)
+        self.assertEqual([c.args[1] for c in mock_book.call_args_list], [4, 9])
+        mock_slot_dao.find_assignable_slots.assert_called_once_with(2, 3, date(2030, 1, 7), time(8, 0), time(12, 0),
+                                                                    patient_id=1)
+
+    @patch("app.dao.dao_appointment.book_appointment")
+    @patch("app.dao.dao_appointment.dao_available_slot")
+    def test_book_any_doctor_no_slot(self, mock_slot_dao, mock_book):
+        mock_slot_dao.find_assignable_slots.return_value = []
+
+        result, message = dao_appointment.book_any_doctor(1, 2, 3, date(2030, 1, 7), time(8, 0), time(12, 0), "Khám")
+
+        self.assertIsNone(result)
+        self.assertEqual(message, "Không còn bác sĩ nào trống trong khung giờ này")
+        mock_book.assert_not_called()
+
+    # ---------- book_appointment_series ----------
+    def test_book_appointment_series_invalid_count(self):
+        result, message = dao_appointment.book_appointment_series(1, 2, DayOfWeekEnum.MONDAY, time(9, 0), 0, "Khám")
+
+        self.assertIsNone(result)
+        self.assertIn("Số buổi phải từ 1 đến", message)
+
+    @patch("app.dao.dao_appointment.dao_available_slot")
+    @patch("app.dao.dao_appointment._series_slots")
+    @patch("app.dao.dao_appointment.db")
+    def test_book_appointment_series_missing_week(self, mock_db, mock_series_slots, mock_slot_dao):
+        # 2030-01-07 là thứ Hai; thiếu slot tuần thứ hai
+        mock_series_slots.return_value = [MagicMock(slot_date=date(2030, 1, 7))]
+
+        result, message = dao_appointment.book_appointment_series(1, 2, DayOfWeekEnum.MONDAY, time(9, 0), 2, "Khám",
+                                                                  start_date=date(2030, 1, 7))
+
+        self.assertIsNone(result)
+        self.assertEqual(message, "Không còn slot trống vào các ngày: 14/01/2030")
+        mock_slot_dao.claim_slots.assert_not_called()
+
+    @patch("app.dao.dao_appointment.dao_available_slot")
+    @patch("app.dao.dao_appointment._series_slots")
+    @patch("app.dao.dao_appointment.db")
+    def test_book_appointment_series_claim_lost(self, mock_db, mock_series_slots, mock_slot_dao):
+        mock_series_slots.return_value = [MagicMock(slot_id=1, slot_date=date(2030, 1, 7)),
+                                          MagicMock(slot_id=2, slot_date=date(2030, 1, 14))]
+        mock_slot_dao.claim_slots.return_value = False
+
+        result, message = dao_appointment.book_appointment_series(1, 2, DayOfWeekEnum.MONDAY, time(9, 0), 2, "Khám",
+                                                                  start_date=date(2030, 1, 7))
+
+        self.assertIsNone(result)
+        mock_slot_dao.claim_slots.assert_called_once_with([1, 2], 1)
+        mock_db.session.rollback.assert_called_once()
+        mock_db.session.execute.assert_not_called()
+        mock_db.session.commit.assert_not_called()
+
+    @patch("app.dao.dao_appointment.dao_waitlist")
+    @patch("app.dao.dao_appointment.dao_invoice")
+    @patch("app.dao.dao_appointment.insert")
+    @patch("app.dao.dao_appointment.send_series_notification")
+    @patch("app.dao.dao_appointment.slot_events")
+    @patch("app.dao.dao_appointment.Appointment")
+    @patch("app.dao.dao_appointment.dao_available_slot")
+    @patch("app.dao.dao_appointment._series_slots")
+    @patch("app.dao.dao_appointment.db")
+    def test_book_appointment_series_success(self, mock_db, mock_series_slots, mock_slot_dao, mock_appointment,
+                                             mock_events, mock_send, mock_insert, mock_invoice, mock_waitlist):
+        slots = [MagicMock(slot_id=i, slot_date=d, start_time=time(9, 0), end_time=time(9, 30))
+                 for i, d in ((1, date(2030, 1, 7)), (2, date(2030, 1, 14)))]
+        mock_series_slots.return_value = slots
+        mock_slot_dao.claim_slots.return_value = True
+        appointments = [MagicMock(appointment_id=10, appointment_time=datetime(2030, 1, 7, 9, 0)),
+                        MagicMock(appointment_id=11, appointment_time=datetime(2030, 1, 14, 9, 0))]
+        mock_appointment.query.filter.return_value.order_by.return_value.all.return_value = appointments
+
+        result, message = dao_appointment.book_appointment_series(1, 2, DayOfWeekEnum.MONDAY, time(9, 0), 2, "Khám",
+                                                                  start_date=date(2030, 1, 7))
+
+        self.assertEqual(result, appointments)
+        self.assertEqual(message, "Đã đặt 2 buổi khám hàng tuần")
+        # Một câu insert nhiều dòng cho lịch hẹn và một cho hóa đơn
+        self.assertEqual(mock_db.session.execute.call_count, 2)
+        invoice_rows = mock_db.session.execute.call_args_list[1].args[1]
+        self.assertEqual([row['appointment_id'] for row in invoice_rows], [10, 11])
+        mock_slot_dao.sync_day_counts.assert_called_once_with(2, date(2030, 1, 7), date(2030, 1, 14))
+        mock_slot_dao.refresh_next_slot.assert_called_once_with(2)
+        # Tuổi nợ của cả chuỗi được tính lại một lần
+        mock_invoice.sync_invoice_aging.assert_called_once_with([date(2030, 1, 7), date(2030, 1, 14)])
+        mock_invoice.adjust_invoice_aging.assert_not_called()
+        # Đề nghị danh sách chờ cho các slot vừa chiếm được đánh dấu đã dùng
+        self.assertEqual([c.args for c in mock_waitlist.mark_offer_fulfilled.call_args_list], [(1, 1), (1, 2)])
+        mock_db.session.commit.assert_called_once()
+        self.assertEqual(mock_events.hub.publish.call_count, 2)
+        mock_send.assert_called_once_with(appointments)
+
     # ---------- get_appointment_by_id ----------
     @patch("app.dao.dao_appointment.Appointment")
     def test_get_appointment_by_id_success(self, mock_appointment):
@@ -134,21 +319,26 @@ class TestDAOAppointment(unittest.TestCase):
         mock_query.filter_by.assert_called_once_with(doctor_id=1)
 
     # ---------- cancel_appointment ----------
+    @patch("app.dao.dao_appointment.slot_events")
+    @patch("app.dao.dao_appointment.dao_waitlist")
+    @patch("app.dao.dao_appointment.dao_available_slot")
     @patch("app.dao.dao_appointment.Appointment")
-    @patch("app.dao.dao_appointment.AvailableSlot")
     @patch("app.dao.dao_appointment.db")
     @patch("app.dao.dao_appointment.send_appointment_notification")
-    def test_cancel_appointment_success_by_patient(self, mock_send_notification, mock_db, mock_slot, mock_appointment):
+    def test_cancel_appointment_success_by_patient(self, mock_send_notification, mock_db, mock_appointment,
+                                                   mock_slot_dao, mock_waitlist, mock_events):
         # Mock appointment
         mock_appointment_instance = MagicMock()
         mock_appointment_instance.appointment_time = datetime.now() + timedelta(days=2)  # 2 days later
         mock_appointment_instance.doctor_id = 1
+        mock_appointment_instance.slot_id = 5
+        mock_appointment_instance.slot_count = 1
+        mock_appointment_instance.slot.slot_id = 5
         mock_appointment_instance.invoice = MagicMock()
         mock_appointment.query.get.return_value = mock_appointment_instance
 
-        # Mock slot
-        mock_slot_instance = MagicMock()
-        mock_slot.query.filter_by.return_value.first.return_value = mock_slot_instance
+        # Slot được mở lại theo khóa chính
+        mock_slot_dao.release_slot.return_value = True
 
         # Execute
         success, message = dao_appointment.cancel_appointment(1, "Bận việc", True)
@@ -158,8 +348,15 @@ class TestDAOAppointment(unittest.TestCase):
         self.assertIn("thành công", message)
         self.assertEqual(mock_appointment_instance.status, AppointmentStatus.CancelledByPatient)
         self.assertEqual(mock_appointment_instance.invoice.status, InvoiceStatus.Cancelled)
-        self.assertFalse(mock_slot_instance.is_booked)
+        mock_slot_dao.release_slot.assert_called_once_with(5)
+        # Slot vừa mở được đề nghị cho danh sách chờ
+        mock_waitlist.offer_released_slot.assert_called_once_with(5)
+        mock_slot_dao.refresh_next_slot.assert_called_once_with(1)
+        mock_slot_dao.adjust_free_count.assert_called_once_with(1, mock_appointment_instance.appointment_time.date(), 1)
         mock_db.session.commit.assert_called_once()
+        # Sự kiện slot mở lại được phát cho các client SSE
+        mock_events.slot_event.assert_called_once_with(mock_events.RELEASED, mock_appointment_instance.slot)
+        mock_events.hub.publish.assert_called_once_with(mock_events.slot_event.return_value)
         mock_send_notification.assert_called_once()
 
     @patch("app.dao.dao_appointment.Appointment")
@@ -184,22 +381,53 @@ class TestDAOAppointment(unittest.TestCase):
         self.assertFalse(success)
         self.assertEqual(message, "Chỉ có thể hủy lịch hẹn trước 24 giờ")
 
+    @patch("app.dao.dao_appointment.dao_waitlist")
+    @patch("app.dao.dao_appointment.dao_available_slot")
     @patch("app.dao.dao_appointment.Appointment")
-    @patch("app.dao.dao_appointment.AvailableSlot")
     @patch("app.dao.dao_appointment.db")
-    def test_cancel_appointment_slot_not_found(self, mock_db, mock_slot, mock_appointment):
+    @patch("app.dao.dao_appointment.send_appointment_notification")
+    def test_cancel_appointment_slot_not_found(self, mock_send_notification, mock_db, mock_appointment,
+                                               mock_slot_dao, mock_waitlist):
         mock_appointment_instance = MagicMock()
         mock_appointment_instance.appointment_time = datetime.now() + timedelta(days=2)
         mock_appointment_instance.doctor_id = 1
+        mock_appointment_instance.slot_id = None
+        mock_appointment_instance.slot_count = 1
         mock_appointment_instance.invoice = MagicMock()
         mock_appointment.query.get.return_value = mock_appointment_instance
 
-        mock_slot.query.filter_by.return_value.first.return_value = None
+        mock_slot_dao.release_slot.return_value = False
 
         success, message = dao_appointment.cancel_appointment(1, "Lý do")
 
         self.assertTrue(success)
         self.assertIn("không tìm thấy slot liên quan", message)
+        mock_slot_dao.refresh_next_slot.assert_not_called()
+        mock_slot_dao.adjust_free_count.assert_not_called()
+        mock_waitlist.offer_released_slot.assert_not_called()
+
+    @patch("app.dao.dao_appointment.slot_events")
+    @patch("app.dao.dao_appointment.dao_waitlist")
+    @patch("app.dao.dao_appointment.dao_available_slot")
+    @patch("app.dao.dao_appointment.Appointment")
+    @patch("app.dao.dao_appointment.db")
+    @patch("app.dao.dao_appointment.send_appointment_notification")
+    def test_cancel_appointment_multi_slot(self, mock_send_notification, mock_db, mock_appointment,
+                                           mock_slot_dao, mock_waitlist, mock_events):
+        appointment_time = datetime.now() + timedelta(days=2)
+        mock_appointment.query.get.return_value = MagicMock(appointment_time=appointment_time, doctor_id=1,
+                                                            slot_id=4, slot_count=2, duration_minutes=60)
+        mock_slot_dao.release_slot_range.return_value = [MagicMock(slot_id=4), MagicMock(slot_id=5)]
+
+        success, message = dao_appointment.cancel_appointment(1, "Bận việc")
+
+        self.assertTrue(success)
+        # Mở lại cả dãy slot theo khoảng giờ của lịch hẹn
+        mock_slot_dao.release_slot_range.assert_called_once_with(1, appointment_time,
+                                                                 appointment_time + timedelta(minutes=60))
+        mock_slot_dao.release_slot.assert_not_called()
+        mock_slot_dao.adjust_free_count.assert_called_once_with(1, appointment_time.date(), 2)
+        self.assertEqual([c.args[0] for c in mock_waitlist.offer_released_slot.call_args_list], [4, 5])
 
     # ---------- complete_appointment ----------
     @patch("app.dao.dao_appointment.Appointment")
@@ -226,15 +454,23 @@ class TestDAOAppointment(unittest.TestCase):
         self.assertEqual(message, "Lịch hẹn không tồn tại")
 
     # ---------- reschedule_appointment ----------
+    @patch("app.dao.dao_appointment.slot_events")
+    @patch("app.dao.dao_appointment.dao_waitlist")
+    @patch("app.dao.dao_appointment.dao_available_slot")
     @patch("app.dao.dao_appointment.Appointment")
     @patch("app.dao.dao_appointment.AvailableSlot")
     @patch("app.dao.dao_appointment.db")
     @patch("app.dao.dao_appointment.send_appointment_notification")
-    def test_reschedule_appointment_success(self, mock_send_notification, mock_db, mock_slot, mock_appointment):
+    def test_reschedule_appointment_success(self, mock_send_notification, mock_db, mock_slot, mock_appointment,
+                                            mock_slot_dao, mock_waitlist, mock_events):
         # Mock appointment
         mock_appointment_instance = MagicMock()
-        mock_appointment_instance.appointment_time = datetime.now() + timedelta(days=2)
+        old_time = datetime.now() + timedelta(days=2)
+        mock_appointment_instance.appointment_time = old_time
         mock_appointment_instance.doctor_id = 1
+        mock_appointment_instance.slot_id = 7
+        mock_appointment_instance.slot_count = 1
+        mock_appointment_instance.slot.slot_id = 7
         mock_appointment.query.get.return_value = mock_appointment_instance
 
         # Mock new slot
@@ -245,17 +481,27 @@ class TestDAOAppointment(unittest.TestCase):
         mock_new_slot.start_time = time(10, 0)
         mock_new_slot.end_time = time(11, 0)
         mock_slot.query.get.return_value = mock_new_slot
-
-        # Mock old slot
-        mock_old_slot = MagicMock()
-        mock_slot.query.filter_by.return_value.first.return_value = mock_old_slot
+        mock_new_slot.slot_id = 2
+        mock_slot_dao.claim_slot.return_value = True
 
         success, message = dao_appointment.reschedule_appointment(1, 2, "Đổi lịch")
 
         self.assertTrue(success)
         self.assertEqual(message, "Sửa lịch hẹn thành công")
-        self.assertFalse(mock_old_slot.is_booked)
-        self.assertTrue(mock_new_slot.is_booked)
+        mock_slot_dao.claim_slot.assert_called_once_with(2, mock_appointment_instance.patient_id)
+        mock_slot_dao.release_slot.assert_called_once_with(7)
+        self.assertEqual(mock_appointment_instance.slot_id, 2)
+        # Giờ mới đã qua cả hai thời điểm nhắc: không nhắc lại
+        self.assertEqual(mock_appointment_instance.reminder_mask, 3)
+        # Cập nhật slot sớm nhất cho cả bác sĩ cũ và bác sĩ mới
+        refreshed = {c.args[0] for c in mock_slot_dao.refresh_next_slot.call_args_list}
+        self.assertEqual(refreshed, {1, 2})
+        mock_slot_dao.adjust_free_count.assert_any_call(1, old_time.date(), 1)
+        mock_slot_dao.adjust_free_count.assert_any_call(2, date(2024, 1, 2), -1)
+        mock_waitlist.offer_released_slot.assert_called_once_with(7)
+        # Phát sự kiện slot mới được đặt và slot cũ được mở lại
+        self.assertEqual(mock_events.hub.publish.call_count, 2)
+        mock_events.slot_event.assert_any_call(mock_events.BOOKED, mock_new_slot)
         mock_send_notification.assert_called_once()
 
     @patch("app.dao.dao_appointment.Appointment")
@@ -313,6 +559,95 @@ class TestDAOAppointment(unittest.TestCase):
         self.assertFalse(success)
         self.assertEqual(message, "Slot mới đã được đặt")
 
+    @patch("app.dao.dao_appointment.dao_available_slot")
+    @patch("app.dao.dao_appointment.Appointment")
+    @patch("app.dao.dao_appointment.AvailableSlot")
+    def test_reschedule_appointment_new_slot_claim_lost(self, mock_slot, mock_appointment, mock_slot_dao):
+        mock_appointment_instance = MagicMock(slot_count=1)
+        mock_appointment_instance.appointment_time = datetime.now() + timedelta(days=2)
+        mock_appointment.query.get.return_value = mock_appointment_instance
+
+        mock_new_slot = MagicMock()
+        mock_new_slot.is_booked = False
+        mock_slot.query.get.return_value = mock_new_slot
+        mock_slot_dao.claim_slot.return_value = False
+
+        success, message = dao_appointment.reschedule_appointment(1, 2)
+
+        self.assertFalse(success)
+        self.assertEqual(message, "Slot mới đã được đặt")
+
+    @patch("app.dao.dao_appointment.slot_events")
+    @patch("app.dao.dao_appointment.dao_waitlist")
+    @patch("app.dao.dao_appointment.dao_available_slot")
+    @patch("app.dao.dao_appointment.Appointment")
+    @patch("app.dao.dao_appointment.AvailableSlot")
+    @patch("app.dao.dao_appointment.db")
+    @patch("app.dao.dao_appointment.send_appointment_notification")
+    def test_reschedule_appointment_keeps_slot_count(self, mock_send_notification, mock_db, mock_slot,
+                                                     mock_appointment, mock_slot_dao, mock_waitlist, mock_events):
+        old_time = datetime.now() + timedelta(days=2)
+        appointment = MagicMock(doctor_id=1, slot_count=2, appointment_time=old_time, duration_minutes=60)
+        mock_appointment.query.get.return_value = appointment
+        run = [MagicMock(slot_id=i, doctor_id=2, slot_date=date(2030, 1, 7), start_time=start, end_time=end)
+               for i, start, end in ((5, time(9, 0), time(9, 30)), (6, time(9, 30), time(10, 0)))]
+        mock_slot.query.get.return_value = run[0]
+        run[0].is_booked = False
+        mock_slot_dao.get_slot_run.return_value = run
+        mock_slot_dao.claim_slots.return_value = True
+        mock_slot_dao.release_slot_range.return_value = [MagicMock(), MagicMock()]
+
+        success, message = dao_appointment.reschedule_appointment(1, 5)
+
+        self.assertTrue(success)
+        mock_slot_dao.get_slot_run.assert_called_once_with(5, 2, appointment.patient_id)
+        mock_slot_dao.claim_slots.assert_called_once_with([5, 6], appointment.patient_id)
+        mock_slot_dao.claim_slot.assert_not_called()
+        mock_slot_dao.release_slot_range.assert_called_once_with(1, old_time, old_time + timedelta(minutes=60))
+        mock_slot_dao.adjust_free_count.assert_any_call(2, date(2030, 1, 7), -2)
+        self.assertEqual((appointment.slot_count, appointment.duration_minutes), (2, 60))
+        self.assertEqual(appointment.appointment_time, datetime(2030, 1, 7, 9, 0))
+
+    @patch("app.dao.dao_appointment.db")
+    @patch("app.dao.dao_appointment.dao_available_slot")
+    @patch("app.dao.dao_appointment.Appointment")
+    @patch("app.dao.dao_appointment.AvailableSlot")
+    def test_reschedule_appointment_rejects_short_run(self, mock_slot, mock_appointment, mock_slot_dao, mock_db):
+        appointment = MagicMock(slot_count=3, appointment_time=datetime.now() + timedelta(days=2))
+        mock_appointment.query.get.return_value = appointment
+        mock_slot.query.get.return_value = MagicMock(slot_id=5, is_booked=False)
+        mock_slot_dao.get_slot_run.return_value = None
+
+        success, message = dao_appointment.reschedule_appointment(1, 5)
+
+        self.assertFalse(success)
+        self.assertEqual(message, "Không còn đủ 3 slot liên tiếp từ giờ mới đã chọn")
+        mock_slot_dao.claim_slot.assert_not_called()
+        mock_db.session.commit.assert_not_called()
+        self.assertEqual(appointment.slot_count, 3)
+
+    # ---------- backfill_appointment_slot_ids ----------
+    @patch("app.dao.dao_appointment.db")
+    def test_backfill_appointment_slot_ids(self, mock_db):
+        appointment_time = datetime(2024, 1, 1, 9, 0)
+        batch = [MagicMock(appointment_id=1, doctor_id=3, appointment_time=appointment_time),
+                 MagicMock(appointment_id=2, doctor_id=3, appointment_time=datetime(2024, 1, 1, 10, 0))]
+        slots = [MagicMock(slot_id=11, doctor_id=3, slot_date=date(2024, 1, 1), start_time=time(9, 0))]
+
+        appointment_query = MagicMock()
+        appointment_query.filter.return_value.order_by.return_value.limit.return_value.all.side_effect = [batch, []]
+        slot_query = MagicMock()
+        slot_query.filter.return_value.all.return_value = slots
+        mock_db.session.query.side_effect = [appointment_query, slot_query, appointment_query]
+
+        total, message = dao_appointment.backfill_appointment_slot_ids(batch_size=2)
+
+        self.assertEqual(total, 1)
+        self.assertEqual(message, "Đã cập nhật slot_id cho 1 lịch hẹn")
+        mappings = mock_db.session.execute.call_args[0][1]
+        self.assertEqual(mappings, [{'appointment_id': 1, 'slot_id': 11}])
+        self.assertEqual(mock_db.session.commit.call_count, 1)
+
     # ---------- get_patient_appointments_paginated ----------
     @patch("app.dao.dao_appointment.Appointment")
     @patch("app.dao.dao_appointment.joinedload")
@@ -397,6 +732,284 @@ class TestDAOAppointment(unittest.TestCase):
         self.assertEqual(result, fake_patient)
         mock_patient.query.filter_by.assert_called_once_with(patient_id=1)
 
+    # ---------- phòng chờ khám online ----------
+    def make_online_appointment(self, appointment_id=1, hour=9):
+        appointment = MagicMock(appointment_id=appointment_id, patient_id=1, doctor_id=2,
+                                consultation_type=ConsultationType.Online, status=AppointmentStatus.Scheduled,
+                                appointment_time=datetime(2030, 1, 7, hour, 0), queue_priority=0,
+                                checked_in_at=None, called_at=None)
+        return appointment
+
+    @patch("app.dao.dao_appointment.waiting_room.rooms", new_callable=waiting_room.WaitingRoom)
+    @patch("app.dao.dao_appointment._waiting_rows")
+    @patch("app.dao.dao_appointment._queue_version", return_value=4)
+    @patch("app.dao.dao_appointment._bump_queue_version", return_value=4)
+    @patch("app.dao.dao_appointment.db")
+    @patch("app.dao.dao_appointment.Appointment")
+    def test_check_in_appointment_joins_queue(self, mock_appointment, mock_db, mock_bump, mock_version, mock_rows,
+                                              mock_rooms):
+        mock_appointment.query.get.return_value = self.make_online_appointment()
+        mock_rooms.load(2, date(2030, 1, 7), [], version=3)
+
+        position, message = dao_appointment.check_in_appointment(1, 1, now=datetime(2030, 1, 7, 8, 45))
+
+        self.assertEqual(position, 1)
+        self.assertEqual(message, "Đã vào phòng chờ")
+        mock_db.session.commit.assert_called_once()
+        mock_bump.assert_called_once_with(2)
+        # Hàng đợi ở ngay phiên bản trước: thêm tại chỗ, không đọc lại các dòng đang chờ
+        mock_rows.assert_not_called()
+        self.assertEqual(mock_rooms.get(2, date(2030, 1, 7)).ordered(), [1])
+
+    @patch("app.dao.dao_appointment.db")
+    @patch("app.dao.dao_appointment.Appointment")
+    def test_check_in_appointment_too_early(self, mock_appointment, mock_db):
+        mock_appointment.query.get.return_value = self.make_online_appointment()
+
+        position, message = dao_appointment.check_in_appointment(1, 1, now=datetime(2030, 1, 7, 7, 0))
+
+        self.assertIsNone(position)
+        mock_db.session.commit.assert_not_called()
+
+    @patch("app.dao.dao_appointment.db")
+    @patch("app.dao.dao_appointment.Appointment")
+    def test_check_in_appointment_offline(self, mock_appointment, mock_db):
+        appointment = self.make_online_appointment()
+        appointment.consultation_type = ConsultationType.Offline
+        mock_appointment.query.get.return_value = appointment
+
+        position, message = dao_appointment.check_in_appointment(1, 1, now=datetime(2030, 1, 7, 8, 45))
+
+        self.assertIsNone(position)
+        self.assertEqual(message, "Chỉ lịch khám online mới có phòng chờ")
+
+    @patch("app.dao.dao_appointment.update")
+    @patch("app.dao.dao_appointment._queue_version", return_value=3)
+    @patch("app.dao.dao_appointment._bump_queue_version", return_value=5)
+    @patch("app.dao.dao_appointment._waiting_rows")
+    @patch("app.dao.dao_appointment.waiting_room.rooms", new_callable=waiting_room.WaitingRoom)
+    @patch("app.dao.dao_appointment.db")
+    @patch("app.dao.dao_appointment.Appointment")
+    def test_call_next_patient_skips_already_called(self, mock_appointment, mock_db, mock_rooms, mock_rows,
+                                                    mock_bump, mock_version, mock_update):
+        mock_rows.return_value = [
+            MagicMock(appointment_id=1, appointment_time=datetime(2030, 1, 7, 9, 0),
+                      checked_in_at=datetime(2030, 1, 7, 8, 50), queue_priority=0),
+            MagicMock(appointment_id=2, appointment_time=datetime(2030, 1, 7, 9, 30),
+                      checked_in_at=datetime(2030, 1, 7, 8, 55), queue_priority=0)]
+        # Lịch 1 đã được worker khác gọi: UPDATE không khớp dòng nào
+        mock_db.session.execute.side_effect = [MagicMock(rowcount=0), MagicMock(rowcount=1)]
+        mock_appointment.query.get.return_value = "appointment-2"
+
+        appointment, message = dao_appointment.call_next_patient(2, now=datetime(2030, 1, 7, 9, 5))
+
+        self.assertEqual(appointment, "appointment-2")
+        mock_appointment.query.get.assert_called_once_with(2)
+        queue = mock_rooms.get(2, date(2030, 1, 7))
+        self.assertEqual(len(queue), 0)
+        # Worker khác đã gọi lịch 1 (bộ đếm nhảy 3 -> 5): giữ phiên bản cũ để lần đọc sau dựng lại
+        self.assertEqual(queue.version, 3)
+
+    @patch("app.dao.dao_appointment._bump_queue_version")
+    @patch("app.dao.dao_appointment._queue_version")
+    @patch("app.dao.dao_appointment._waiting_rows")
+    @patch("app.dao.dao_appointment.db")
+    @patch("app.dao.dao_appointment.Appointment")
+    def test_waiting_queue_sees_check_in_from_other_worker(self, mock_appointment, mock_db, mock_rows, mock_version,
+                                                           mock_bump):
+        db_rows = [MagicMock(appointment_id=5, appointment_time=datetime(2030, 1, 7, 9, 30),
+                             checked_in_at=datetime(2030, 1, 7, 8, 40), queue_priority=0)]
+        counter = [0]
+
+        def bump(doctor_id):
+            counter[0] += 1
+            return counter[0]
+
+        mock_rows.side_effect = lambda doctor_id, day: list(db_rows)
+        mock_version.side_effect = lambda doctor_id: counter[0]
+        mock_bump.side_effect = bump
+        appointment = self.make_online_appointment()
+        mock_appointment.query.get.return_value = appointment
+        mock_db.session.commit.side_effect = lambda: db_rows.append(
+            MagicMock(appointment_id=1, appointment_time=appointment.appointment_time,
+                      checked_in_at=appointment.checked_in_at, queue_priority=0))
+        worker_1, worker_2 = waiting_room.WaitingRoom(), waiting_room.WaitingRoom()
+
+        with patch("app.dao.dao_appointment.waiting_room.rooms", worker_1):
+            self.assertEqual(dao_appointment.get_waiting_queue(2, date(2030, 1, 7)).ordered(), [5])
+            # Không có thay đổi: không đọc lại các dòng đang chờ
+            dao_appointment.get_waiting_queue(2, date(2030, 1, 7))
+            self.assertEqual(mock_rows.call_count, 1)
+        with patch("app.dao.dao_appointment.waiting_room.rooms", worker_2):
+            dao_appointment.check_in_appointment(1, 1, now=datetime(2030, 1, 7, 8, 45))
+        # Worker 1 đã có hàng đợi trong ngày nhưng vẫn thấy lượt check-in ở worker 2 và ưu tiên vừa đổi
+        db_rows[0].queue_priority = 1
+        bump(2)
+        with patch("app.dao.dao_appointment.waiting_room.rooms", worker_1):
+            self.assertEqual(dao_appointment.get_waiting_queue(2, date(2030, 1, 7)).ordered(), [5, 1])
+
+    # ---------- mark_no_shows ----------
+    @patch("app.dao.dao_appointment._stale_scheduled_ids")
+    @patch("app.dao.dao_appointment.db")
+    def test_mark_no_shows_in_batches(self, mock_db, mock_stale_ids):
+        mock_stale_ids.side_effect = [[1, 2], [3]]
+        mock_db.session.execute.side_effect = [MagicMock(rowcount=2), MagicMock(rowcount=1)]
+        now = datetime(2030, 1, 7, 12, 0)
+
+        total, message = dao_appointment.mark_no_shows(now=now, grace_minutes=60, batch_size=2)
+
+        self.assertEqual(total, 3)
+        self.assertEqual(message, "Đã chuyển 3 lịch hẹn sang không đến khám")
+        mock_stale_ids.assert_called_with(datetime(2030, 1, 7, 11, 0), datetime(2030, 1, 7), 2)
+        self.assertEqual(mock_db.session.commit.call_count, 2)
+
+    @patch("app.dao.dao_appointment.db")
+    def test_stale_scheduled_ids_sweeps_abandoned_check_ins(self, mock_db):
+        engine = create_engine("sqlite://")
+        Appointment.__table__.create(engine)
+        mock_db.session = Session(engine)
+        self.addCleanup(mock_db.session.close)
+        yesterday, today = datetime(2030, 1, 6), datetime(2030, 1, 7)
+        mock_db.session.add_all([
+            # Hôm qua, không check-in
+            Appointment(appointment_id=1, patient_id=1, doctor_id=2, appointment_time=yesterday.replace(hour=8)),
+            # Hôm qua, đã check-in nhưng bác sĩ không gọi: phòng chờ đã đóng
+            Appointment(appointment_id=2, patient_id=1, doctor_id=2, appointment_time=yesterday.replace(hour=9),
+                        checked_in_at=yesterday.replace(hour=8, minute=50)),
+            # Hôm qua, đã được gọi vào khám
+            Appointment(appointment_id=3, patient_id=1, doctor_id=2, appointment_time=yesterday.replace(hour=10),
+                        checked_in_at=yesterday.replace(hour=9, minute=50), called_at=yesterday.replace(hour=10)),
+            # Hôm nay, đã check-in và vẫn đang chờ dù quá giờ hẹn
+            Appointment(appointment_id=4, patient_id=1, doctor_id=2, appointment_time=today.replace(hour=8),
+                        checked_in_at=today.replace(hour=7, minute=55)),
+            # Hôm nay, không check-in, quá thời gian chờ
+            Appointment(appointment_id=5, patient_id=1, doctor_id=2, appointment_time=today.replace(hour=8, minute=30)),
+            # Hôm nay, chưa quá thời gian chờ
+            Appointment(appointment_id=6, patient_id=1, doctor_id=2, appointment_time=today.replace(hour=11)),
+        ])
+        mock_db.session.commit()
+
+        ids = dao_appointment._stale_scheduled_ids(today.replace(hour=10), today, 10)
+
+        self.assertEqual(ids, [1, 2, 5])
+
+    @patch("app.dao.dao_appointment._stale_scheduled_ids", return_value=[])
+    @patch("app.dao.dao_appointment.db")
+    def test_mark_no_shows_nothing_stale(self, mock_db, mock_stale_ids):
+        total, message = dao_appointment.mark_no_shows()
+
+        self.assertEqual(total, 0)
+        mock_db.session.execute.assert_not_called()
+
+    # ---------- nhắc hẹn ----------
+    @patch("app.dao.dao_appointment.reminders.scheduler", new_callable=lambda: reminders.ReminderScheduler((24, 2), 10))
+    @patch("app.dao.dao_appointment._reminder_rows")
+    def test_load_reminder_window(self, mock_rows, mock_scheduler):
+        now = datetime(2030, 1, 7, 8, 0)
+        mock_rows.return_value = [
+            # Nhắc 24h lúc 08:05
+            MagicMock(appointment_id=1, appointment_time=datetime(2030, 1, 8, 8, 5),
+                      created_at=datetime(2030, 1, 1), reminder_mask=0),
+            # Nhắc 2h lúc 08:10 nhưng đã gửi
+            MagicMock(appointment_id=2, appointment_time=datetime(2030, 1, 7, 10, 10),
+                      created_at=datetime(2030, 1, 1), reminder_mask=2),
+            # Đặt sau thời điểm nhắc 2h
+            MagicMock(appointment_id=3, appointment_time=datetime(2030, 1, 7, 9, 55),
+                      created_at=datetime(2030, 1, 7, 7, 58), reminder_mask=0),
+        ]
+
+        dao_appointment.load_reminder_window(now)
+
+        mock_rows.assert_called_once_with(datetime(2030, 1, 7, 7, 50), datetime(2030, 1, 7, 8, 20))
+        self.assertEqual(mock_scheduler.loaded_until, datetime(2030, 1, 7, 8, 20))
+        self.assertEqual(mock_scheduler.pop_due(datetime(2030, 1, 7, 8, 20)),
+                         [(1, datetime(2030, 1, 8, 8, 5), 24)])
+
+    @patch("app.dao.dao_appointment.send_reminder_batch")
+    @patch("app.dao.dao_appointment.get_appointments_for_email")
+    @patch("app.dao.dao_appointment.db")
+    @patch("app.dao.dao_appointment.reminders.scheduler", new_callable=lambda: reminders.ReminderScheduler((24, 2), 10))
+    def test_send_due_reminders_in_batches(self, mock_scheduler, mock_db, mock_appointments, mock_send):
+        time_1 = datetime(2030, 1, 7, 10, 0)
+        for appointment_id in (1, 2, 3):
+            mock_scheduler.push(appointment_id, time_1, 2)
+        mock_appointments.side_effect = [
+            [MagicMock(appointment_id=1, status=AppointmentStatus.Scheduled, appointment_time=time_1, reminder_mask=0),
+             # Đã đổi giờ ở process khác
+             MagicMock(appointment_id=2, status=AppointmentStatus.Scheduled,
+                       appointment_time=datetime(2030, 1, 9, 10, 0), reminder_mask=0)],
+            # Đã hủy ở process khác
+            [MagicMock(appointment_id=3, status=AppointmentStatus.CancelledByDoctor, appointment_time=time_1,
+                       reminder_mask=0)],
+        ]
+        mock_send.side_effect = lambda appointments, hours: [a.appointment_id for a in appointments]
+
+        total, message = dao_appointment.send_due_reminders(datetime(2030, 1, 7, 8, 0), batch_size=2)
+
+        self.assertEqual(total, 1)
+        self.assertEqual(message, "Đã gửi 1 email nhắc hẹn")
+        self.assertEqual([c.args[0] for c in mock_appointments.call_args_list], [[1, 2], [3]])
+        self.assertEqual(mock_send.call_count, 1)
+        self.assertEqual(mock_db.session.commit.call_count, 2)
+        self.assertEqual(len(mock_scheduler), 0)
+
+    # ---------- cancel_doctor_appointments ----------
+    @patch("app.dao.dao_appointment.notifications.outbox")
+    @patch("app.dao.dao_appointment.slot_events")
+    @patch("app.dao.dao_appointment.dao_waitlist")
+    @patch("app.dao.dao_appointment._bump_queue_version", return_value=7)
+    @patch("app.dao.dao_appointment.waiting_room.rooms")
+    @patch("app.dao.dao_appointment.dao_doctor")
+    @patch("app.dao.dao_appointment.dao_invoice")
+    @patch("app.dao.dao_appointment.db")
+    def test_cancel_doctor_appointments(self, mock_db, mock_invoice, mock_doctor, mock_rooms, mock_bump,
+                                        mock_waitlist, mock_events, mock_outbox):
+        ids_result, slots_result, due_result = MagicMock(), MagicMock(), MagicMock()
+        ids_result.scalars.return_value.all.return_value = [4, 5]
+        slots_result.scalars.return_value.all.return_value = [MagicMock(slot_id=8), MagicMock(slot_id=9)]
+        due_result.scalars.return_value.all.return_value = [date(2030, 1, 14)]
+        mock_db.session.execute.side_effect = [ids_result, slots_result, due_result,
+                                               MagicMock(), MagicMock(), MagicMock()]
+        mock_events.slot_event.side_effect = lambda kind, slot: (kind, slot.slot_id)
+        mock_db.session.commit.side_effect = lambda: mock_events.hub.publish.assert_not_called()
+        mock_doctor.invalidate_exception_slots.return_value = (6, 0)
+
+        count, message = dao_appointment.cancel_doctor_appointments(
+            3, date(2030, 1, 7), date(2030, 1, 8), "Bác sĩ nghỉ đột xuất", now=datetime(2030, 1, 7, 6, 0))
+
+        self.assertEqual(count, 2)
+        self.assertEqual(message, "Đã hủy 2 lịch hẹn và 6 slot trống")
+        # SELECT id, SELECT slot bị xóa, SELECT hạn hóa đơn, UPDATE lịch hẹn, UPDATE hóa đơn, UPDATE slot
+        self.assertEqual(mock_db.session.execute.call_count, 6)
+        # Đề nghị cho slot bị xóa quay lại hàng chờ trong cùng transaction, sự kiện phát sau commit
+        mock_waitlist.requeue_offers.assert_called_once_with([8, 9])
+        self.assertEqual([c.args[0] for c in mock_events.hub.publish.call_args_list],
+                         [(mock_events.DELETED, 8), (mock_events.DELETED, 9)])
+        mock_invoice.sync_invoice_aging.assert_called_once_with([date(2030, 1, 14)])
+        mock_doctor.invalidate_exception_slots.assert_called_once_with(date(2030, 1, 7), date(2030, 1, 8),
+                                                                       doctor_id=3)
+        mock_db.session.commit.assert_called_once()
+        mock_rooms.advance.assert_called_once_with(3, date(2030, 1, 7), 7)
+        mock_outbox.enqueue.assert_called_once_with('cancellation', [4, 5])
+
+    @patch("app.dao.dao_appointment.notifications.outbox")
+    @patch("app.dao.dao_appointment.dao_doctor")
+    @patch("app.dao.dao_appointment.db")
+    def test_cancel_doctor_appointments_error_rolls_back(self, mock_db, mock_doctor, mock_outbox):
+        mock_db.session.execute.side_effect = Exception("lock timeout")
+
+        count, message = dao_appointment.cancel_doctor_appointments(3, date(2030, 1, 7), date(2030, 1, 8), "Nghỉ")
+
+        self.assertIsNone(count)
+        mock_db.session.rollback.assert_called_once()
+        mock_outbox.enqueue.assert_not_called()
+
+    def test_cancel_doctor_appointments_invalid_range(self):
+        count, message = dao_appointment.cancel_doctor_appointments(3, date(2030, 1, 8), date(2030, 1, 7), "Nghỉ")
+
+        self.assertIsNone(count)
+        self.assertEqual(message, "Ngày kết thúc phải sau ngày bắt đầu")
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
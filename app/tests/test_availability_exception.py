@@ -0,0 +1,53 @@
+import unittest
+from unittest.mock import patch
+from datetime import date
+from app.models import AvailableSlot
+from app.dao import dao_doctor
+
+
+class TestInvalidateExceptionSlots(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch("app.dao.dao_doctor.AvailableSlot")
+        self.mock_slot = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_slot.slot_date = AvailableSlot.slot_date
+        self.mock_slot.slot_start = AvailableSlot.slot_start
+        self.mock_slot.booked_count = AvailableSlot.booked_count
+        in_range = self.mock_slot.query.filter.return_value
+        in_range.filter.return_value.delete.return_value = 4
+        in_range.filter.return_value.count.return_value = 1
+
+    @patch("app.dao.dao_doctor.dao_available_slot")
+    @patch("app.dao.dao_doctor.db")
+    def test_hospital_exception_syncs_only_its_doctors(self, mock_db, mock_slot_dao):
+        mock_db.session.execute.return_value.scalars.return_value.all.return_value = [3, 5]
+
+        result = dao_doctor.invalidate_exception_slots(date(2030, 1, 7), date(2030, 1, 8), hospital_id=2)
+
+        self.assertEqual(result, (4, 1))
+        mock_slot_dao.sync_day_counts.assert_called_once_with(start_date=date(2030, 1, 7), end_date=date(2030, 1, 8),
+                                                              doctor_ids=[3, 5])
+        mock_slot_dao.sync_next_slots.assert_called_once_with(doctor_ids=[3, 5])
+
+    @patch("app.dao.dao_doctor.dao_available_slot")
+    @patch("app.dao.dao_doctor.db")
+    def test_doctor_exception_skips_hospital_lookup(self, mock_db, mock_slot_dao):
+        dao_doctor.invalidate_exception_slots(date(2030, 1, 7), date(2030, 1, 8), doctor_id=3)
+
+        mock_db.session.execute.assert_not_called()
+        mock_slot_dao.sync_next_slots.assert_called_once_with(doctor_ids=[3])
+
+    @patch("app.dao.dao_doctor.dao_available_slot")
+    @patch("app.dao.dao_doctor.db")
+    def test_hospital_without_doctors(self, mock_db, mock_slot_dao):
+        mock_db.session.execute.return_value.scalars.return_value.all.return_value = []
+
+        result = dao_doctor.invalidate_exception_slots(date(2030, 1, 7), date(2030, 1, 8), hospital_id=2)
+
+        self.assertEqual(result, (0, 0))
+        mock_slot_dao.sync_day_counts.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
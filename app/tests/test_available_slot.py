@@ -210,5 +210,273 @@ class TestDAOAvailableSlot(unittest.TestCase):
         mock_query.join.assert_called_with(Doctor, AvailableSlot.doctor_id == Doctor.doctor_id)
         mock_query.join.return_value.filter.assert_called_with(AvailableSlot.is_booked == 0)
 
+    # ---------- claim_slot ----------
+    @patch("app.dao.dao_available_slot.db")
+    def test_claim_slot_success(self, mock_db):
+        mock_db.session.execute.return_value.rowcount = 1
+
+        self.assertTrue(dao_available_slot.claim_slot(1))
+        mock_db.session.execute.assert_called_once()
+        mock_db.session.commit.assert_not_called()
+
+    @patch("app.dao.dao_available_slot.db")
+    def test_claim_slot_already_booked(self, mock_db):
+        mock_db.session.execute.return_value.rowcount = 0
+
+        self.assertFalse(dao_available_slot.claim_slot(1))
+
+    @patch("app.dao.dao_available_slot.db")
+    def test_claim_slot_respects_capacity(self, mock_db):
+        mock_db.session.execute.return_value.rowcount = 1
+
+        dao_available_slot.claim_slot(1, patient_id=2)
+
+        # Một câu UPDATE: chỉ chiếm khi còn lượt, slot kín khi lượt này là lượt cuối
+        sql = str(mock_db.session.execute.call_args.args[0].compile())
+        self.assertIn("availableslot.booked_count < availableslot.capacity", sql)
+        self.assertIn("SET is_booked=CASE WHEN (availableslot.booked_count + :booked_count_1 >= availableslot.capacity)",
+                      sql)
+        self.assertIn("booked_count=(availableslot.booked_count + :booked_count_2)", sql)
+        self.assertIn("NOT (EXISTS (SELECT", sql)
+
+    # ---------- release_slot ----------
+    @patch("app.dao.dao_available_slot.db")
+    def test_release_slot_success(self, mock_db):
+        mock_db.session.execute.return_value.rowcount = 1
+
+        self.assertTrue(dao_available_slot.release_slot(1))
+        mock_db.session.execute.assert_called_once()
+
+    @patch("app.dao.dao_available_slot.db")
+    def test_release_slot_without_slot_id(self, mock_db):
+        self.assertFalse(dao_available_slot.release_slot(None))
+        mock_db.session.execute.assert_not_called()
+
+    # ---------- hold_slot ----------
+    @patch("app.dao.dao_available_slot.db")
+    def test_hold_slot_success(self, mock_db):
+        mock_db.session.execute.return_value.rowcount = 1
+
+        self.assertTrue(dao_available_slot.hold_slot(1, patient_id=5))
+        mock_db.session.commit.assert_called_once()
+
+    @patch("app.dao.dao_available_slot.db")
+    def test_hold_slot_held_by_other(self, mock_db):
+        mock_db.session.execute.return_value.rowcount = 0
+
+        self.assertFalse(dao_available_slot.hold_slot(1, patient_id=5))
+
+    @patch("app.dao.dao_available_slot.db")
+    def test_hold_slot_exception(self, mock_db):
+        mock_db.session.execute.side_effect = Exception("Database error")
+
+        self.assertFalse(dao_available_slot.hold_slot(1, patient_id=5))
+        mock_db.session.rollback.assert_called_once()
+
+    # ---------- release_expired_holds ----------
+    @patch("app.dao.dao_available_slot.db")
+    def test_release_expired_holds(self, mock_db):
+        mock_db.session.execute.return_value.rowcount = 4
+
+        self.assertEqual(dao_available_slot.release_expired_holds(), 4)
+        mock_db.session.execute.assert_called_once()
+        mock_db.session.commit.assert_called_once()
+
+    # ---------- backfill_slot_start ----------
+    @patch("app.dao.dao_available_slot.db")
+    def test_backfill_slot_start(self, mock_db):
+        batch = [MagicMock(slot_id=3, slot_date=date(2030, 1, 7), start_time=time(8, 30))]
+        query = mock_db.session.query.return_value.filter.return_value.order_by.return_value.limit.return_value
+        query.all.side_effect = [batch, []]
+
+        total, message = dao_available_slot.backfill_slot_start(batch_size=1)
+
+        self.assertEqual(total, 1)
+        self.assertEqual(message, "Đã cập nhật slot_start cho 1 slot")
+        mappings = mock_db.session.execute.call_args[0][1]
+        self.assertEqual(mappings, [{'slot_id': 3, 'slot_start': datetime(2030, 1, 7, 8, 30)}])
+        mock_db.session.commit.assert_called_once()
+
+    # ---------- get_earliest_slots ----------
+    @patch("app.dao.dao_available_slot._doctor_free_slots")
+    @patch("app.dao.dao_available_slot.db")
+    def test_get_earliest_slots_merges_doctors(self, mock_db, mock_free_slots):
+        base = datetime.now() + timedelta(days=1)
+        heads = [MagicMock(doctor_id=1, slot_start=base), MagicMock(doctor_id=2, slot_start=base + timedelta(hours=1)),
+                 MagicMock(doctor_id=3, slot_start=base + timedelta(days=5))]
+        mock_db.session.query.return_value.join.return_value.filter.return_value \
+            .filter.return_value.all.return_value = heads
+        slots = {
+            1: [MagicMock(slot_id=10, slot_start=base), MagicMock(slot_id=11, slot_start=base + timedelta(hours=2))],
+            2: [MagicMock(slot_id=20, slot_start=base + timedelta(hours=1))],
+        }
+        mock_free_slots.side_effect = lambda doctor_id, after, limit, patient_id, now: slots[doctor_id][:limit]
+
+        result = dao_available_slot.get_earliest_slots(specialty_id=1, k=3)
+
+        self.assertEqual([s.slot_id for s in result], [10, 20, 11])
+        # Bác sĩ 3 có slot sớm nhất quá xa nên không cần truy vấn slot của bác sĩ này
+        self.assertEqual({c.args[0] for c in mock_free_slots.call_args_list}, {1, 2})
+
+    @patch("app.dao.dao_available_slot.db")
+    def test_get_earliest_slots_no_doctor(self, mock_db):
+        mock_db.session.query.return_value.join.return_value.filter.return_value.all.return_value = []
+
+        self.assertEqual(dao_available_slot.get_earliest_slots(k=5), [])
+
+    # ---------- refresh_next_slot ----------
+    @patch("app.dao.dao_available_slot.find_next_free_slot")
+    @patch("app.dao.dao_available_slot.db")
+    def test_refresh_next_slot(self, mock_db, mock_find):
+        mock_find.return_value = MagicMock(slot_id=8, slot_start=datetime(2030, 1, 7, 9, 0))
+
+        dao_available_slot.refresh_next_slot(3)
+
+        merged = mock_db.session.merge.call_args[0][0]
+        self.assertEqual((merged.doctor_id, merged.slot_id, merged.slot_start), (3, 8, datetime(2030, 1, 7, 9, 0)))
+        mock_db.session.commit.assert_not_called()
+
+    # ---------- get_free_count_calendar ----------
+    @patch("app.dao.dao_available_slot.db")
+    def test_get_free_count_calendar_future_month(self, mock_db):
+        year = date.today().year + 1
+        query = mock_db.session.query.return_value.filter.return_value
+        query.filter.return_value.group_by.return_value.all.return_value = [
+            (date(year, 3, 2), 5), (date(year, 3, 3), 0)
+        ]
+
+        result = dao_available_slot.get_free_count_calendar(year, 3, doctor_id=1)
+
+        self.assertEqual(result, {date(year, 3, 2): 5, date(year, 3, 3): 0})
+        # Chỉ một truy vấn GROUP BY cho cả tháng
+        mock_db.session.query.assert_called_once()
+
+    def test_get_free_count_calendar_past_month(self):
+        self.assertEqual(dao_available_slot.get_free_count_calendar(2000, 1), {})
+
+    # ---------- adjust_free_count ----------
+    @patch("app.dao.dao_available_slot.db")
+    def test_adjust_free_count(self, mock_db):
+        dao_available_slot.adjust_free_count(1, date(2030, 1, 7), -1)
+
+        mock_db.session.execute.assert_called_once()
+        mock_db.session.commit.assert_not_called()
+        # Đặt một slot: slot trống giảm 1, tải của bác sĩ tăng 1
+        sql = str(mock_db.session.execute.call_args.args[0].compile(compile_kwargs={"literal_binds": True}))
+        self.assertIn("free_count=(doctordaycount.free_count + -1)", sql)
+        self.assertIn("booked_count=(doctordaycount.booked_count - -1)", sql)
+
+    # ---------- get_reschedule_candidates ----------
+    def test_closest_slots_merges_both_sides(self):
+        target = datetime(2030, 1, 7, 9, 0)
+        after = [MagicMock(slot_id=1, slot_start=datetime(2030, 1, 7, 9, 30)),
+                 MagicMock(slot_id=2, slot_start=datetime(2030, 1, 8, 9, 0))]
+        before = [MagicMock(slot_id=3, slot_start=datetime(2030, 1, 7, 8, 0)),
+                  MagicMock(slot_id=4, slot_start=datetime(2030, 1, 6, 9, 0))]
+        after_query, before_query = MagicMock(), MagicMock()
+        after_query.order_by.return_value.limit.return_value.all.return_value = after
+        before_query.order_by.return_value.limit.return_value.all.return_value = before
+        query = MagicMock()
+        query.filter.side_effect = [after_query, before_query]
+
+        result = dao_available_slot._closest_slots(query, target, 3)
+
+        self.assertEqual([s.slot_id for s in result], [1, 3, 2])
+
+    def test_closest_slots_after_cursor(self):
+        target = datetime(2030, 1, 7, 9, 0)
+        query = MagicMock()
+        query.filter.return_value.order_by.return_value.limit.return_value.all.return_value = []
+
+        dao_available_slot._closest_slots(query, target, 3, after=(1800, 7))
+
+        # Mỗi phía thêm điều kiện keyset "xa hơn slot cuối trang trước"
+        self.assertEqual([len(c.args) for c in query.filter.call_args_list], [2, 2])
+        after_edge = str(query.filter.call_args_list[0].args[1])
+        self.assertIn("availableslot.slot_start >", after_edge)
+        self.assertIn("availableslot.slot_id >", after_edge)
+
+    @patch("app.dao.dao_available_slot._closest_slots")
+    @patch("app.dao.dao_available_slot._bookable_slots_query")
+    def test_get_reschedule_candidates_same_doctor_first(self, mock_query, mock_closest):
+        appointment = MagicMock(doctor_id=1, appointment_time=datetime(2030, 1, 7, 9, 0))
+        same_doctor = [MagicMock(slot_id=1, slot_start=datetime(2030, 1, 7, 9, 30))]
+        same_specialty = [MagicMock(slot_id=2, slot_start=datetime(2030, 1, 7, 8, 0)),
+                          MagicMock(slot_id=3, slot_start=datetime(2030, 1, 7, 11, 0))]
+        mock_closest.side_effect = [same_doctor, same_specialty]
+
+        slots, next_cursor = dao_available_slot.get_reschedule_candidates(appointment, limit=2, patient_id=5)
+
+        self.assertEqual([s.slot_id for s in slots], [1, 2])
+        # Slot cuối trang thuộc nhóm cùng chuyên khoa, lệch 1 giờ
+        self.assertEqual(next_cursor, (1, 3600, 2))
+        # Nhóm cùng chuyên khoa chỉ lấy phần còn thiếu (+1 để biết còn trang sau)
+        self.assertEqual(mock_closest.call_args_list[1].args[2], 2)
+
+    @patch("app.dao.dao_available_slot._closest_slots")
+    @patch("app.dao.dao_available_slot._bookable_slots_query")
+    def test_get_reschedule_candidates_enough_same_doctor(self, mock_query, mock_closest):
+        appointment = MagicMock(doctor_id=1, appointment_time=datetime(2030, 1, 7, 9, 0))
+        mock_closest.return_value = [MagicMock(slot_id=i, slot_start=datetime(2030, 1, 7, 10, i)) for i in range(3)]
+
+        slots, next_cursor = dao_available_slot.get_reschedule_candidates(appointment, limit=2)
+
+        self.assertEqual(len(slots), 2)
+        self.assertEqual(next_cursor, (0, 3660, 1))
+        mock_closest.assert_called_once()
+
+    @patch("app.dao.dao_available_slot._closest_slots")
+    @patch("app.dao.dao_available_slot._bookable_slots_query")
+    def test_get_reschedule_candidates_next_page_in_specialty_group(self, mock_query, mock_closest):
+        appointment = MagicMock(doctor_id=1, appointment_time=datetime(2030, 1, 7, 9, 0))
+        mock_closest.return_value = [MagicMock(slot_id=9, slot_start=datetime(2030, 1, 8, 9, 0))]
+
+        slots, next_cursor = dao_available_slot.get_reschedule_candidates(appointment, limit=2,
+                                                                          after=(1, 3600, 2))
+
+        # Đã hết nhóm cùng bác sĩ: chỉ đọc tiếp nhóm cùng chuyên khoa sau con trỏ
+        mock_closest.assert_called_once()
+        self.assertEqual(mock_closest.call_args.args[2:], (3, (3600, 2)))
+        self.assertEqual([s.slot_id for s in slots], [9])
+        self.assertIsNone(next_cursor)
+
+    def test_reschedule_cursor_round_trip(self):
+        self.assertEqual(dao_available_slot.parse_reschedule_cursor(
+            dao_available_slot.format_reschedule_cursor((1, 3600, 2))), (1, 3600, 2))
+        self.assertIsNone(dao_available_slot.parse_reschedule_cursor("abc"))
+        self.assertIsNone(dao_available_slot.parse_reschedule_cursor("5:0:1"))
+        self.assertIsNone(dao_available_slot.parse_reschedule_cursor(None))
+
+    # ---------- contiguous_runs ----------
+    def _slot(self, slot_id, day, start, end):
+        return MagicMock(slot_id=slot_id, slot_date=day, start_time=start, end_time=end)
+
+    def test_contiguous_runs_breaks_on_gap_and_day(self):
+        day = date(2030, 1, 7)
+        slots = [self._slot(1, day, time(8, 0), time(8, 30)),
+                 self._slot(2, day, time(8, 30), time(9, 0)),
+                 self._slot(3, day, time(9, 0), time(9, 30)),
+                 # 9:30 đã được đặt -> đứt dãy
+                 self._slot(4, day, time(10, 0), time(10, 30)),
+                 self._slot(5, day, time(10, 30), time(11, 0)),
+                 self._slot(6, day + timedelta(days=1), time(11, 0), time(11, 30))]
+
+        runs = dao_available_slot.contiguous_runs(slots, 2)
+
+        self.assertEqual([[s.slot_id for s in run] for run in runs], [[1, 2], [2, 3], [4, 5]])
+        self.assertEqual([[s.slot_id for s in run] for run in dao_available_slot.contiguous_runs(slots, 3)],
+                         [[1, 2, 3]])
+
+    @patch("app.dao.dao_available_slot.find_slot_runs")
+    @patch("app.dao.dao_available_slot.AvailableSlot")
+    def test_get_slot_run_starts_at_slot(self, mock_slot, mock_find_runs):
+        mock_slot.query.get.return_value = MagicMock(slot_id=2, doctor_id=3, slot_date=date(2030, 1, 7))
+        run = [MagicMock(slot_id=2), MagicMock(slot_id=3)]
+        mock_find_runs.return_value = [[MagicMock(slot_id=1), MagicMock(slot_id=2)], run]
+
+        self.assertEqual(dao_available_slot.get_slot_run(2, 2, patient_id=9), run)
+        mock_find_runs.assert_called_once_with(3, date(2030, 1, 7), 2, 9)
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,75 @@
+import unittest
+from unittest.mock import MagicMock
+from datetime import datetime, date, time
+from app import ical_service
+from app.models import AppointmentStatus, RoleEnum
+
+
+class TestICalService(unittest.TestCase):
+
+    # ---------- escape_text ----------
+    def test_escape_text(self):
+        self.assertEqual(ical_service.escape_text('Đau đầu; sốt, ho\nmệt'), 'Đau đầu\\; sốt\\, ho\\nmệt')
+        self.assertEqual(ical_service.escape_text(None), '')
+
+    # ---------- fold_line ----------
+    def test_fold_line_short_line_unchanged(self):
+        self.assertEqual(ical_service.fold_line('SUMMARY:Khám'), 'SUMMARY:Khám')
+
+    def test_fold_line_respects_octet_limit(self):
+        line = 'DESCRIPTION:' + 'Bệnh nhân đau đầu kéo dài ' * 10
+        folded = ical_service.fold_line(line)
+
+        parts = folded.split('\r\n')
+        self.assertGreater(len(parts), 1)
+        self.assertTrue(all(len(part.encode('utf-8')) <= 75 for part in parts))
+        self.assertTrue(all(part.startswith(' ') for part in parts[1:]))
+        # Bỏ CRLF + khoảng trắng thì ra lại dòng ban đầu
+        self.assertEqual(folded.replace('\r\n ', ''), line)
+
+    # ---------- appointment_event ----------
+    def test_appointment_event_cancelled(self):
+        row = MagicMock(appointment_id=7, appointment_time=datetime(2030, 1, 7, 9, 0), duration_minutes=30,
+                        reason='Tái khám', status=AppointmentStatus.CancelledByPatient,
+                        updated_at=datetime(2030, 1, 1, 8, 0), first_name='An', last_name='Nguyễn',
+                        hospital_name='BV Chợ Rẫy')
+
+        event = ical_service.appointment_event(row, for_doctor=False)
+
+        self.assertIn('UID:appointment-7@flask-schedule-health\r\n', event)
+        self.assertIn('DTSTART:20300107T090000\r\n', event)
+        self.assertIn('DTEND:20300107T093000\r\n', event)
+        self.assertIn('STATUS:CANCELLED\r\n', event)
+        self.assertIn('SUMMARY:Khám với BS. An Nguyễn\r\n', event)
+        self.assertTrue(event.endswith('END:VEVENT\r\n'))
+
+    def test_free_slot_event_is_transparent(self):
+        row = MagicMock(slot_id=3, slot_date=date(2030, 1, 7), slot_start=datetime(2030, 1, 7, 9, 0),
+                        end_time=time(9, 30), updated_at=None)
+
+        event = ical_service.free_slot_event(row)
+
+        self.assertIn('UID:slot-3@flask-schedule-health\r\n', event)
+        self.assertIn('DTEND:20300107T093000\r\n', event)
+        self.assertIn('TRANSP:TRANSPARENT\r\n', event)
+
+    # ---------- stream_calendar ----------
+    def test_stream_calendar_yields_events_lazily(self):
+        events = iter(['A\r\n', 'B\r\n'])
+        chunks = ical_service.stream_calendar('Lịch khám', events)
+
+        self.assertTrue(next(chunks).startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertEqual(next(chunks), 'A\r\n')
+        self.assertEqual(list(chunks), ['B\r\n', 'END:VCALENDAR\r\n'])
+
+    # ---------- make_etag ----------
+    def test_make_etag_changes_with_version(self):
+        etag = ical_service.make_etag(1, RoleEnum.PATIENT, '1700000000.0-3')
+
+        self.assertEqual(etag, ical_service.make_etag(1, RoleEnum.PATIENT, '1700000000.0-3'))
+        self.assertNotEqual(etag, ical_service.make_etag(1, RoleEnum.PATIENT, '1700000001.0-3'))
+        self.assertNotEqual(etag, ical_service.make_etag(1, RoleEnum.DOCTOR, '1700000000.0-3'))
+
+
+if __name__ == "__main__":
+    unittest.main()
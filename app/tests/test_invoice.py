@@ -0,0 +1,87 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from datetime import date
+from decimal import Decimal
+from sqlalchemy.exc import IntegrityError
+from app.dao import dao_invoice
+
+
+class TestDAOInvoice(unittest.TestCase):
+
+    # ---------- adjust_invoice_aging ----------
+    @patch("app.dao.dao_invoice.db")
+    def test_adjust_existing_day(self, mock_db):
+        mock_db.session.execute.return_value.rowcount = 1
+
+        dao_invoice.adjust_invoice_aging(date(2030, 1, 7), Decimal('200000'), 1)
+
+        mock_db.session.execute.assert_called_once()
+        mock_db.session.begin_nested.assert_not_called()
+
+    @patch("app.dao.dao_invoice.db")
+    def test_adjust_new_day_inserts_row(self, mock_db):
+        mock_db.session.execute.return_value.rowcount = 0
+
+        dao_invoice.adjust_invoice_aging(date(2030, 1, 7), Decimal('200000'), 1)
+
+        mock_db.session.begin_nested.assert_called_once()
+        self.assertEqual(mock_db.session.execute.call_count, 2)
+
+    @patch("app.dao.dao_invoice._add_aging")
+    @patch("app.dao.dao_invoice.db")
+    def test_adjust_concurrent_insert_falls_back_to_update(self, mock_db, mock_add):
+        mock_add.return_value = 0
+        mock_db.session.execute.side_effect = IntegrityError("insert", {}, Exception())
+
+        dao_invoice.adjust_invoice_aging(date(2030, 1, 7), Decimal('200000'), 1)
+
+        self.assertEqual(mock_add.call_count, 2)
+
+    @patch("app.dao.dao_invoice.db")
+    def test_adjust_without_due_date(self, mock_db):
+        dao_invoice.adjust_invoice_aging(None, Decimal('200000'), 1)
+
+        mock_db.session.execute.assert_not_called()
+
+    # ---------- mark_overdue_invoices ----------
+    @patch("app.dao.dao_invoice._pending_past_due_ids")
+    @patch("app.dao.dao_invoice.db")
+    def test_mark_overdue_in_batches(self, mock_db, mock_ids):
+        mock_ids.side_effect = [[1, 2], [3]]
+        mock_db.session.execute.side_effect = [MagicMock(rowcount=2), MagicMock(rowcount=1)]
+
+        total, message = dao_invoice.mark_overdue_invoices(today=date(2030, 1, 7), batch_size=2)
+
+        self.assertEqual(total, 3)
+        self.assertEqual(message, "Đã chuyển 3 hóa đơn sang quá hạn")
+        mock_ids.assert_called_with(date(2030, 1, 7), 2)
+        self.assertEqual(mock_db.session.commit.call_count, 2)
+
+    @patch("app.dao.dao_invoice._pending_past_due_ids", side_effect=Exception("lock timeout"))
+    @patch("app.dao.dao_invoice.db")
+    def test_mark_overdue_error_rolls_back(self, mock_db, mock_ids):
+        total, message = dao_invoice.mark_overdue_invoices()
+
+        self.assertEqual(total, 0)
+        mock_db.session.rollback.assert_called_once()
+
+    # ---------- get_invoice_aging_summary ----------
+    @patch("app.dao.dao_invoice.db")
+    def test_aging_summary_buckets(self, mock_db):
+        mock_db.session.execute.return_value.all.return_value = [
+            MagicMock(due_date=date(2030, 1, 10), outstanding_count=1, outstanding_amount=Decimal('100')),
+            MagicMock(due_date=date(2030, 1, 7), outstanding_count=2, outstanding_amount=Decimal('200')),
+            MagicMock(due_date=date(2029, 12, 31), outstanding_count=1, outstanding_amount=Decimal('50')),
+            MagicMock(due_date=date(2029, 12, 30), outstanding_count=3, outstanding_amount=Decimal('300')),
+            MagicMock(due_date=date(2029, 12, 1), outstanding_count=4, outstanding_amount=Decimal('400')),
+        ]
+
+        summary = dao_invoice.get_invoice_aging_summary(today=date(2030, 1, 7))
+
+        self.assertEqual([b['count'] for b in summary], [1, 3, 3, 4])
+        self.assertEqual([b['amount'] for b in summary],
+                         [Decimal('100'), Decimal('250'), Decimal('300'), Decimal('400')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+from unittest.mock import patch
+from app.notifications import NotificationQueue
+
+
+class TestNotificationQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.outbox = NotificationQueue(2)
+
+    @patch.object(NotificationQueue, "_ensure_worker")
+    def test_next_batch_limits_size(self, mock_worker):
+        self.outbox.enqueue('cancellation', [1, 2, 3])
+
+        self.assertEqual(self.outbox.next_batch(timeout=0), [('cancellation', 1), ('cancellation', 2)])
+        self.assertEqual(self.outbox.next_batch(timeout=0), [('cancellation', 3)])
+        mock_worker.assert_called_once()
+
+    def test_next_batch_empty(self):
+        self.assertEqual(self.outbox.next_batch(timeout=0), [])
+        self.assertEqual(len(self.outbox), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+from unittest.mock import patch
+from datetime import datetime, time
+import pandas as pd
+from app.dao import dao_overbooking
+
+
+def make_history(doctor_id, hour, total, no_shows):
+    return pd.DataFrame({
+        'doctor_id': [doctor_id] * total,
+        'appointment_time': [datetime(2030, 1, 7, hour, 0)] * total,
+        'no_show': [1] * no_shows + [0] * (total - no_shows),
+    })
+
+
+class TestOverbooking(unittest.TestCase):
+
+    # ---------- compute_overbooking_policy ----------
+    def test_high_no_show_band_gets_extra(self):
+        history = pd.concat([make_history(1, 8, 20, 10), make_history(1, 10, 20, 2)])
+
+        policy = dao_overbooking.compute_overbooking_policy(history).set_index('band')
+
+        self.assertEqual(policy.loc[4, 'rate'], 0.5)
+        self.assertEqual(policy.loc[4, 'extra'], 1)
+        self.assertEqual(policy.loc[5, 'extra'], 0)
+
+    def test_extra_is_bounded(self):
+        policy = dao_overbooking.compute_overbooking_policy(make_history(1, 8, 30, 30))
+
+        self.assertEqual(policy['extra'].tolist(), [dao_overbooking.OVERBOOKING_MAX_EXTRA])
+
+    def test_small_history_is_ignored(self):
+        policy = dao_overbooking.compute_overbooking_policy(make_history(1, 8, 5, 5))
+
+        self.assertEqual(policy['extra'].tolist(), [0])
+
+    def test_empty_history(self):
+        history = pd.DataFrame(columns=['doctor_id', 'appointment_time', 'no_show'])
+
+        self.assertTrue(dao_overbooking.compute_overbooking_policy(history).empty)
+
+    def test_band_bounds(self):
+        self.assertEqual(dao_overbooking.band_bounds(4), (time(8), time(10)))
+        self.assertEqual(dao_overbooking.band_bounds(11)[1], time.max)
+
+    # ---------- apply_overbooking_policy ----------
+    @patch("app.dao.dao_overbooking.dao_available_slot")
+    @patch("app.dao.dao_overbooking._history_frame")
+    @patch("app.dao.dao_overbooking.db")
+    def test_apply_policy_updates_bands_in_one_statement(self, mock_db, mock_history, mock_slot_dao):
+        mock_history.return_value = make_history(1, 8, 20, 10)
+
+        count, message = dao_overbooking.apply_overbooking_policy(enabled=True)
+
+        self.assertEqual(count, 1)
+        # Đưa capacity về 1, rồi một câu UPDATE executemany cho các khung giờ
+        self.assertEqual(mock_db.session.execute.call_count, 2)
+        params = mock_db.session.execute.call_args.args[1]
+        self.assertEqual(params, [{'b_doctor_id': 1, 'b_start': time(8), 'b_end': time(10), 'b_capacity': 2}])
+        mock_slot_dao.sync_day_counts.assert_called_once()
+        mock_db.session.commit.assert_called_once()
+
+    @patch("app.dao.dao_overbooking.dao_available_slot")
+    @patch("app.dao.dao_overbooking._history_frame")
+    @patch("app.dao.dao_overbooking.db")
+    def test_apply_policy_disabled_only_resets(self, mock_db, mock_history, mock_slot_dao):
+        count, message = dao_overbooking.apply_overbooking_policy(enabled=False)
+
+        self.assertEqual(count, 0)
+        mock_history.assert_not_called()
+        mock_db.session.execute.assert_called_once()
+        mock_db.session.commit.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
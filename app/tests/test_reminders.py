@@ -0,0 +1,57 @@
+import unittest
+from datetime import datetime, timedelta
+from app.reminders import ReminderScheduler
+
+NOW = datetime(2030, 1, 7, 8, 0)
+
+
+class TestReminderScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = ReminderScheduler((24, 2), 10)
+
+    def test_pop_due_in_time_order(self):
+        self.scheduler.push(1, NOW + timedelta(hours=2, minutes=5), 2)
+        self.scheduler.push(2, NOW + timedelta(hours=24, minutes=1), 24)
+        self.scheduler.push(3, NOW + timedelta(hours=2, minutes=30), 2)
+
+        due = self.scheduler.pop_due(NOW + timedelta(minutes=5))
+
+        self.assertEqual([(a, h) for a, t, h in due], [(2, 24), (1, 2)])
+        self.assertEqual(len(self.scheduler), 1)
+
+    def test_push_same_reminder_once(self):
+        self.scheduler.push(1, NOW + timedelta(hours=2), 2)
+        self.scheduler.push(1, NOW + timedelta(hours=2), 2)
+
+        self.assertEqual(len(self.scheduler.pop_due(NOW)), 1)
+
+    def test_push_new_time_replaces_old_entry(self):
+        self.scheduler.push(1, NOW + timedelta(hours=2), 2)
+        # Lần nạp sau đọc giờ hẹn mới (đổi lịch ở web worker): phần tử cũ bị bỏ qua
+        self.scheduler.push(1, NOW + timedelta(hours=2, minutes=15), 2)
+
+        self.assertEqual(self.scheduler.pop_due(NOW + timedelta(minutes=20)),
+                         [(1, NOW + timedelta(hours=2, minutes=15), 2)])
+
+    def test_passed_mask(self):
+        self.assertEqual(self.scheduler.passed_mask(NOW + timedelta(hours=30), NOW), 0)
+        self.assertEqual(self.scheduler.passed_mask(NOW + timedelta(hours=3), NOW), 1)
+        self.assertEqual(self.scheduler.passed_mask(NOW + timedelta(hours=1), NOW), 3)
+
+    def test_needs_load_and_range(self):
+        self.assertTrue(self.scheduler.needs_load(NOW))
+        start, end = self.scheduler.load_range(NOW)
+        self.scheduler.loaded_until = end
+
+        self.assertEqual(start, NOW - timedelta(minutes=10))
+        self.assertFalse(self.scheduler.needs_load(NOW + timedelta(minutes=9)))
+        self.assertTrue(self.scheduler.needs_load(NOW + timedelta(minutes=11)))
+
+    def test_bits(self):
+        self.assertEqual(self.scheduler.bit(24), 1)
+        self.assertEqual(self.scheduler.bit(2), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
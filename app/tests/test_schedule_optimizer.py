@@ -0,0 +1,128 @@
+import unittest
+from unittest.mock import patch
+from datetime import datetime, date, time, timedelta
+import pandas as pd
+from app.dao import dao_schedule_optimizer
+from app.models import DayOfWeekEnum
+
+MONDAY = datetime(2030, 1, 7)
+
+
+def make_history(hour, total, booked, days_to_book=1.0, doctor_id=1, weekday=0):
+    """total slot (bác sĩ, thứ, giờ) trong các tuần liên tiếp, booked slot đầu tiên được đặt"""
+    slot_dates = [MONDAY + timedelta(days=weekday, weeks=i) for i in range(total)]
+    opened = [d - timedelta(days=14) for d in slot_dates]
+    return pd.DataFrame({
+        'doctor_id': [doctor_id] * total,
+        'slot_date': slot_dates,
+        'hour': [hour] * total,
+        'booked': [1] * booked + [0] * (total - booked),
+        'opened_at': opened,
+        'booked_at': [o + timedelta(days=days_to_book) for o in opened[:booked]] + [pd.NaT] * (total - booked),
+    })
+
+
+def make_templates(start, end, is_available=True, doctor_id=1, day=0):
+    return pd.DataFrame({'doctor_id': [doctor_id], 'day': [day], 'start_time': [start],
+                         'end_time': [end], 'is_available': [is_available]})
+
+
+class TestScheduleOptimizer(unittest.TestCase):
+
+    # ---------- compute_hour_stats ----------
+    def test_hot_and_cold_hours(self):
+        history = pd.concat([make_history(8, 10, 10, days_to_book=1),
+                             make_history(9, 10, 10, days_to_book=10),
+                             make_history(16, 10, 1)])
+
+        stats = dao_schedule_optimizer.compute_hour_stats(history).set_index('hour')
+
+        self.assertTrue(stats.loc[8, 'hot'])
+        self.assertFalse(stats.loc[9, 'hot'])  # kín nhưng đặt chậm
+        self.assertTrue(stats.loc[16, 'cold'])
+        self.assertAlmostEqual(stats.loc[16, 'rate'], 0.1)
+        self.assertEqual(stats.loc[8, 'days_to_book'], 1)
+
+    def test_small_history_is_neutral(self):
+        stats = dao_schedule_optimizer.compute_hour_stats(make_history(8, 2, 0))
+
+        self.assertFalse(stats['cold'].iloc[0])
+        self.assertFalse(stats['hot'].iloc[0])
+
+    def test_empty_history(self):
+        history = pd.DataFrame(columns=['doctor_id', 'slot_date', 'hour', 'booked', 'opened_at', 'booked_at'])
+
+        self.assertTrue(dao_schedule_optimizer.compute_hour_stats(history).empty)
+
+    # ---------- build_recommendations ----------
+    def test_trims_cold_end_and_extends_hot_start(self):
+        history = pd.concat([make_history(h, 10, 10) for h in (8, 9, 10)] +
+                            [make_history(h, 10, 0) for h in (11, 12)])
+        stats = dao_schedule_optimizer.compute_hour_stats(history)
+
+        recs = dao_schedule_optimizer.build_recommendations(stats, make_templates(time(8, 0), time(13, 0)))
+
+        self.assertEqual(len(recs), 1)
+        self.assertEqual(recs[0]['day_of_week'], DayOfWeekEnum.MONDAY)
+        self.assertEqual(recs[0]['new_start_time'], time(7, 0))
+        self.assertEqual(recs[0]['new_end_time'], time(11, 0))
+        self.assertTrue(recs[0]['is_available'])
+        self.assertEqual(len(recs[0]['reasons']), 2)
+
+    def test_does_not_extend_past_bounds(self):
+        stats = dao_schedule_optimizer.compute_hour_stats(make_history(7, 10, 10))
+
+        recs = dao_schedule_optimizer.build_recommendations(stats, make_templates(time(7, 0), time(8, 0)))
+
+        self.assertEqual(recs[0]['new_start_time'], time(7, 0))
+        self.assertEqual(recs[0]['new_end_time'], time(9, 0))
+
+    def test_hours_without_history_are_kept(self):
+        # 8h không có dữ liệu, 9h ít người đặt: không được bỏ giờ 8h
+        stats = dao_schedule_optimizer.compute_hour_stats(make_history(9, 10, 0))
+
+        recs = dao_schedule_optimizer.build_recommendations(stats, make_templates(time(8, 0), time(10, 0)))
+
+        self.assertEqual(recs[0]['new_start_time'], time(8, 0))
+        self.assertEqual(recs[0]['new_end_time'], time(9, 0))
+
+    def test_all_cold_day_is_closed(self):
+        stats = dao_schedule_optimizer.compute_hour_stats(
+            pd.concat([make_history(h, 10, 1) for h in (8, 9)]))
+
+        recs = dao_schedule_optimizer.build_recommendations(stats, make_templates(time(8, 0), time(10, 0)))
+
+        self.assertFalse(recs[0]['is_available'])
+
+    def test_balanced_schedule_has_no_recommendation(self):
+        stats = dao_schedule_optimizer.compute_hour_stats(make_history(8, 10, 6))
+
+        recs = dao_schedule_optimizer.build_recommendations(stats, make_templates(time(8, 0), time(9, 0)))
+
+        self.assertEqual(recs, [])
+
+    def test_days_off_are_ignored(self):
+        stats = dao_schedule_optimizer.compute_hour_stats(make_history(8, 10, 0))
+
+        recs = dao_schedule_optimizer.build_recommendations(
+            stats, make_templates(time(8, 0), time(9, 0), is_available=False))
+
+        self.assertEqual(recs, [])
+
+    # ---------- recommend_schedules ----------
+    @patch('app.dao.dao_schedule_optimizer._templates')
+    @patch('app.dao.dao_schedule_optimizer._slot_history')
+    def test_recommend_uses_history_window(self, mock_history, mock_templates):
+        mock_history.return_value = make_history(8, 10, 0)
+        mock_templates.return_value = make_templates(time(8, 0), time(9, 0))
+
+        recs = dao_schedule_optimizer.recommend_schedules(doctor_id=1, today=date(2030, 6, 1))
+
+        since, until, doctor_id = mock_history.call_args[0]
+        self.assertEqual(until - since, timedelta(weeks=dao_schedule_optimizer.SCHEDULE_HISTORY_WEEKS))
+        self.assertEqual(doctor_id, 1)
+        self.assertFalse(recs[0]['is_available'])
+
+
+if __name__ == '__main__':
+    unittest.main()
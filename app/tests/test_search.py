@@ -1,6 +1,7 @@
 # tests/test_search_doctors.py
 import unittest
 from unittest.mock import patch, MagicMock
+from datetime import time
 
 # Đổi đường dẫn này nếu file của bạn có tên khác
 from app.dao import dao_search as dao
@@ -131,5 +132,23 @@ class TestSearchDoctors(unittest.TestCase):
         self.assertEqual(out, [])
 
 
+class TestAvailabilityMask(unittest.TestCase):
+    def test_morning_mask(self):
+        # 08:00-12:00 là các nửa giờ 16..23
+        self.assertEqual(dao.time_range_mask(time(8, 0), time(12, 0)), sum(1 << i for i in range(16, 24)))
+
+    def test_partial_half_hour_rounds_outward(self):
+        self.assertEqual(dao.time_range_mask(time(8, 15), time(8, 40)), (1 << 16) | (1 << 17))
+
+    def test_open_and_empty_ranges(self):
+        self.assertEqual(dao.time_range_mask(), (1 << 48) - 1)
+        self.assertEqual(dao.time_range_mask(time(12, 0), time(8, 0)), 0)
+
+    def test_available_on_uses_bitwise_and(self):
+        sql = str(dao.available_on("Saturday", time(8, 0), time(12, 0)).compile())
+        self.assertIn("doctoravailability.slot_mask &", sql)
+        self.assertIn("doctoravailability.day_of_week =", sql)
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -0,0 +1,81 @@
+import unittest
+from datetime import date
+import numpy as np
+import pandas as pd
+from app.dao import dao_simulation
+
+START = date(2030, 1, 7)  # thứ Hai
+
+
+def make_demand(days, cancelled=None):
+    return pd.DataFrame({
+        'hospital_id': [1] * len(days),
+        'specialty_id': [2] * len(days),
+        'requested_at': [pd.Timestamp(START) + pd.Timedelta(days=d, hours=9) for d in days],
+        'cancelled': cancelled or [0] * len(days),
+    })
+
+
+def make_supply(slots_per_day):
+    return pd.DataFrame({
+        'hospital_id': [1] * len(slots_per_day),
+        'specialty_id': [2] * len(slots_per_day),
+        'slot_date': [pd.Timestamp(START) + pd.Timedelta(days=d) for d in range(len(slots_per_day))],
+        'slots': slots_per_day,
+    })
+
+
+DOCTORS = pd.DataFrame({'hospital_id': [1], 'specialty_id': [2], 'doctors': [2]})
+
+
+class TestSimulation(unittest.TestCase):
+
+    # ---------- _assign ----------
+    def test_assign_takes_earliest_free_slot_in_arrival_order(self):
+        cum = np.cumsum([[1, 0, 2, 1]], axis=1)
+
+        served, day = dao_simulation._assign(np.array([0, 0, 0, 0]), np.array([0, 0, 1, 3]), cum, horizon_days=3)
+
+        self.assertEqual(day.tolist(), [0, 2, 2, 3])
+        self.assertTrue(served.all())
+
+    def test_assign_groups_do_not_share_slots(self):
+        cum = np.cumsum([[1, 0], [0, 1]], axis=1)
+
+        served, day = dao_simulation._assign(np.array([0, 0, 1]), np.array([0, 0, 0]), cum, horizon_days=1)
+
+        self.assertEqual(served.tolist(), [True, False, True])
+        self.assertEqual(day[[0, 2]].tolist(), [0, 1])
+
+    # ---------- simulate ----------
+    def test_simulate_reports_wait_utilization_and_unmet(self):
+        demand = make_demand([0, 0, 0, 1], cancelled=[0, 0, 0, 1])
+
+        result = dao_simulation.simulate(demand, make_supply([1, 1, 0]), DOCTORS, START, days=2, horizon_days=1)
+        row = result.iloc[0]
+
+        self.assertEqual((row.requests, row.cancelled, row.served, row.unmet), (4, 1, 2, 1))
+        self.assertEqual(row.supply, 2)
+        self.assertEqual(row.utilization, 1.0)
+        self.assertEqual(row.mean_wait, 0.5)
+
+    def test_simulate_extra_saturday_hours(self):
+        demand = make_demand([4, 4, 4])
+
+        base = dao_simulation.simulate(demand, make_supply([1] * 7), DOCTORS, START, days=7, horizon_days=1)
+        extra = dao_simulation.simulate(demand, make_supply([1] * 7), DOCTORS, START, days=7, horizon_days=1,
+                                        extra_weekday=5, extra_hours=1)
+
+        # Thứ Bảy thêm 1 giờ cho 2 bác sĩ = 4 slot 30 phút
+        self.assertEqual(extra.iloc[0].supply - base.iloc[0].supply, 4)
+        self.assertGreater(extra.iloc[0].served, base.iloc[0].served)
+
+    def test_simulate_shorter_slots_scale_supply(self):
+        result = dao_simulation.simulate(make_demand([0]), make_supply([2, 2]), DOCTORS, START, days=2,
+                                         horizon_days=0, slot_minutes=15)
+
+        self.assertEqual(result.iloc[0].supply, 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from datetime import date, time as dtime
+from app import slot_events
+
+
+class TestSlotEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.hub = slot_events.SlotEventHub()
+        self.event = {'type': slot_events.RELEASED, 'slot_id': 5, 'doctor_id': 3,
+                      'hospital_id': 1, 'specialty_id': 2, 'slot_date': '2030-01-07', 'start_time': '09:00'}
+
+    # ---------- slot_event ----------
+    def test_slot_event(self):
+        slot = MagicMock(slot_id=5, doctor_id=3, slot_date=date(2030, 1, 7), start_time=dtime(9, 0))
+        slot.doctor.hospital_id = 1
+        slot.doctor.specialty_id = 2
+
+        self.assertEqual(slot_events.slot_event(slot_events.RELEASED, slot), self.event)
+
+    # ---------- dispatch ----------
+    def test_dispatch_respects_filters(self):
+        same_hospital = self.hub.subscribe(hospital_id=1)
+        other_doctor = self.hub.subscribe(doctor_id=4)
+        everything = self.hub.subscribe()
+
+        self.hub.publish(self.event)
+
+        self.assertEqual(same_hospital.get(timeout=0), self.event)
+        self.assertIsNone(other_doctor.get(timeout=0))
+        self.assertEqual(everything.get(timeout=0), self.event)
+
+    def test_unsubscribe_stops_delivery(self):
+        subscription = self.hub.subscribe()
+        self.hub.unsubscribe(subscription)
+
+        self.hub.publish(self.event)
+
+        self.assertIsNone(subscription.get(timeout=0))
+
+    def test_slow_client_drops_oldest_event(self):
+        subscription = slot_events.Subscription({}, maxsize=2)
+        for slot_id in (1, 2, 3):
+            subscription.put({'slot_id': slot_id})
+
+        self.assertEqual([subscription.get(timeout=0)['slot_id'] for _ in range(2)], [2, 3])
+
+    def test_format_sse(self):
+        self.assertTrue(slot_events.format_sse(self.event).startswith('event: released\ndata: {'))
+        self.assertTrue(slot_events.format_sse(self.event).endswith('\n\n'))
+
+    # ---------- broker ----------
+    def test_publish_falls_back_to_local_when_broker_down(self):
+        hub = slot_events.SlotEventHub('127.0.0.1:1')
+        subscription = hub.subscribe()
+
+        hub.publish(self.event)
+
+        self.assertEqual(subscription.get(timeout=0), self.event)
+
+    def test_broker_fans_out_between_processes(self):
+        broker = slot_events.SlotEventBroker('127.0.0.1:0')
+        threading.Thread(target=broker.serve_forever, daemon=True).start()
+        address = '127.0.0.1:%d' % broker.server_address[1]
+        try:
+            publisher, listener = slot_events.SlotEventHub(address), slot_events.SlotEventHub(address)
+            subscription = listener.subscribe(doctor_id=3)
+            publisher.subscribe()
+            # Chờ broker ghi nhận cả hai kết nối
+            deadline = time.monotonic() + 2
+            while len(broker.clients) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            publisher.publish(self.event)
+
+            self.assertEqual(subscription.get(timeout=2), self.event)
+        finally:
+            broker.shutdown()
+            broker.server_close()
+
+
+    def test_stalled_client_does_not_block_fan_out(self):
+        broker = slot_events.SlotEventBroker('127.0.0.1:0')
+        threading.Thread(target=broker.serve_forever, daemon=True).start()
+        address = '127.0.0.1:%d' % broker.server_address[1]
+        release = threading.Event()
+        stalled_wfile = MagicMock()
+        stalled_wfile.write.side_effect = lambda line: release.wait(5)
+        stalled = slot_events._BrokerClient(broker, MagicMock(), stalled_wfile, maxsize=1)
+        broker.clients.add(stalled)
+        try:
+            hub = slot_events.SlotEventHub(address)
+            subscription = hub.subscribe()
+            deadline = time.monotonic() + 2
+            while len(broker.clients) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            for slot_id in (1, 2, 3):
+                hub.publish(dict(self.event, slot_id=slot_id))
+
+            self.assertEqual([subscription.get(timeout=2)['slot_id'] for _ in range(3)], [1, 2, 3])
+            # Client treo làm đầy hàng đợi nên bị ngắt
+            self.assertNotIn(stalled, broker.clients)
+        finally:
+            release.set()
+            broker.shutdown()
+            broker.server_close()
+
+    def test_broker_drops_client_when_write_fails(self):
+        server = MagicMock()
+        wfile = MagicMock()
+        wfile.write.side_effect = OSError("broken pipe")
+        client = slot_events._BrokerClient(server, MagicMock(), wfile)
+
+        client.put(b'{}\n')
+
+        deadline = time.monotonic() + 2
+        while not server.drop.called and time.monotonic() < deadline:
+            time.sleep(0.01)
+        server.drop.assert_called_once_with(client)
+
+    @patch("app.slot_events.app")
+    def test_publish_logs_errors(self, mock_app):
+        subscription = self.hub.subscribe()
+        subscription.put = MagicMock(side_effect=RuntimeError("boom"))
+
+        self.hub.publish(self.event)
+
+        mock_app.logger.exception.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,211 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from datetime import datetime, date, time
+from app.models import DayOfWeekEnum, AvailableSlot
+from app.dao import dao_slot_generator
+
+
+class TestDAOSlotGenerator(unittest.TestCase):
+
+    # ---------- get_horizon_dates ----------
+    def test_get_horizon_dates(self):
+        # 2024-01-03 là thứ Tư
+        result = dao_slot_generator.get_horizon_dates(DayOfWeekEnum.FRIDAY, date(2024, 1, 3), weeks=3)
+
+        self.assertEqual(result, [date(2024, 1, 5), date(2024, 1, 12), date(2024, 1, 19)])
+
+    def test_get_horizon_dates_same_day(self):
+        result = dao_slot_generator.get_horizon_dates(DayOfWeekEnum.WEDNESDAY, date(2024, 1, 3), weeks=2)
+
+        self.assertEqual(result, [date(2024, 1, 3), date(2024, 1, 10)])
+
+    # ---------- split_into_slots ----------
+    def test_split_into_slots(self):
+        result = dao_slot_generator.split_into_slots(time(8, 0), time(9, 45), slot_minutes=30)
+
+        self.assertEqual(result, [
+            (time(8, 0), time(8, 30)),
+            (time(8, 30), time(9, 0)),
+            (time(9, 0), time(9, 30)),
+        ])
+
+    def test_split_into_slots_too_short(self):
+        self.assertEqual(dao_slot_generator.split_into_slots(time(8, 0), time(8, 20), 30), [])
+
+    # ---------- build_slot_rows ----------
+    def test_build_slot_rows_skips_unavailable_and_past(self):
+        available = MagicMock(doctor_id=1, day_of_week=DayOfWeekEnum.MONDAY, is_available=True,
+                              start_time=time(8, 0), end_time=time(9, 0))
+        day_off = MagicMock(doctor_id=1, day_of_week=DayOfWeekEnum.TUESDAY, is_available=False,
+                            start_time=time(8, 0), end_time=time(9, 0))
+
+        # 2024-01-01 là thứ Hai, đã qua 8h30
+        rows = dao_slot_generator.build_slot_rows(
+            [available, day_off], date(2024, 1, 1), weeks=2, slot_minutes=30,
+            now=datetime(2024, 1, 1, 8, 30)
+        )
+
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['slot_date'], date(2024, 1, 8))
+        self.assertEqual(rows[0]['start_time'], time(8, 0))
+        self.assertEqual(rows[1]['start_time'], time(8, 30))
+        self.assertEqual(rows[1]['slot_start'], datetime(2024, 1, 8, 8, 30))
+        self.assertTrue(all(not r['is_booked'] for r in rows))
+
+    def test_build_slot_rows_skips_blocked_dates(self):
+        available = MagicMock(doctor_id=1, day_of_week=DayOfWeekEnum.MONDAY, is_available=True,
+                              start_time=time(8, 0), end_time=time(9, 0))
+
+        rows = dao_slot_generator.build_slot_rows(
+            [available], date(2030, 1, 7), weeks=3, slot_minutes=30,
+            now=datetime(2030, 1, 1), blocked={1: {date(2030, 1, 14)}, 2: {date(2030, 1, 7)}}
+        )
+
+        self.assertEqual(sorted({r['slot_date'] for r in rows}), [date(2030, 1, 7), date(2030, 1, 21)])
+
+    # ---------- get_blocked_dates ----------
+    @patch("app.dao.dao_slot_generator.db")
+    def test_get_blocked_dates_clips_to_range(self, mock_db):
+        query = mock_db.session.query.return_value.join.return_value.filter.return_value
+        query.all.return_value = [
+            (1, date(2030, 1, 1), date(2030, 1, 8)),   # nghỉ phép bác sĩ, bắt đầu trước khoảng sinh slot
+            (2, date(2030, 1, 20), date(2030, 2, 5)),  # bệnh viện nghỉ, kéo dài sau khoảng sinh slot
+        ]
+
+        blocked = dao_slot_generator.get_blocked_dates(date(2030, 1, 7), date(2030, 1, 21))
+
+        self.assertEqual(blocked, {1: {date(2030, 1, 7), date(2030, 1, 8)}, 2: {date(2030, 1, 20)}})
+
+    # ---------- generate_slots ----------
+    @patch("app.dao.dao_slot_generator.dao_available_slot")
+    @patch("app.dao.dao_slot_generator.get_existing_slot_keys")
+    @patch("app.dao.dao_slot_generator.DoctorAvailability")
+    @patch("app.dao.dao_slot_generator.db")
+    def test_generate_slots_skips_existing(self, mock_db, mock_availability, mock_existing, mock_slot_dao):
+        availability = MagicMock(doctor_id=1, day_of_week=DayOfWeekEnum.MONDAY, is_available=True,
+                                 start_time=time(8, 0), end_time=time(9, 0))
+        mock_availability.query.filter_by.return_value.filter_by.return_value.all.return_value = [availability]
+        mock_existing.return_value = {(1, date(2030, 1, 7), time(8, 0))}
+
+        count, message = dao_slot_generator.generate_slots(doctor_id=1, weeks=1, start_date=date(2030, 1, 7))
+
+        self.assertEqual(count, 1)
+        self.assertEqual(message, "Đã sinh 1 slot mới")
+        rows = mock_db.session.execute.call_args[0][1]
+        self.assertEqual(rows[0]['start_time'], time(8, 30))
+        mock_slot_dao.sync_next_slots.assert_called_once_with(1)
+        mock_slot_dao.sync_day_counts.assert_called_once_with(1, date(2030, 1, 7), date(2030, 1, 13))
+        mock_db.session.commit.assert_called_once()
+
+    @patch("app.dao.dao_slot_generator.DoctorAvailability")
+    @patch("app.dao.dao_slot_generator.db")
+    def test_generate_slots_no_availability(self, mock_db, mock_availability):
+        mock_availability.query.filter_by.return_value.all.return_value = []
+
+        count, message = dao_slot_generator.generate_slots()
+
+        self.assertEqual(count, 0)
+        self.assertEqual(message, "Không có lịch làm việc để sinh slot")
+        mock_db.session.execute.assert_not_called()
+
+    @patch("app.dao.dao_slot_generator.dao_available_slot")
+    @patch("app.dao.dao_slot_generator.get_existing_slot_keys")
+    @patch("app.dao.dao_slot_generator.DoctorAvailability")
+    @patch("app.dao.dao_slot_generator.db")
+    def test_generate_slots_exception(self, mock_db, mock_availability, mock_existing, mock_slot_dao):
+        availability = MagicMock(doctor_id=1, day_of_week=DayOfWeekEnum.MONDAY, is_available=True,
+                                 start_time=time(8, 0), end_time=time(9, 0))
+        mock_availability.query.filter_by.return_value.all.return_value = [availability]
+        mock_existing.return_value = set()
+        mock_db.session.commit.side_effect = Exception("Database error")
+
+        count, message = dao_slot_generator.generate_slots(start_date=date(2030, 1, 7), weeks=1)
+
+        self.assertEqual(count, 0)
+        self.assertIn("Lỗi khi sinh slot", message)
+        mock_db.session.rollback.assert_called_once()
+
+    # ---------- reconcile_day_slots ----------
+    @patch("app.dao.dao_slot_generator.db")
+    @patch("app.dao.dao_slot_generator.AvailableSlot")
+    def test_reconcile_day_slots_unchanged(self, mock_slot, mock_db):
+        template = (time(8, 0), time(10, 0), True)
+
+        result = dao_slot_generator.reconcile_day_slots(1, DayOfWeekEnum.MONDAY, template, template)
+
+        self.assertEqual(result, (0, 0))
+        mock_slot.query.filter.assert_not_called()
+        mock_db.session.execute.assert_not_called()
+
+    @patch("app.dao.dao_slot_generator.get_blocked_dates")
+    @patch("app.dao.dao_slot_generator.dao_available_slot")
+    @patch("app.dao.dao_slot_generator.bulk_insert_slots")
+    @patch("app.dao.dao_slot_generator.get_existing_slot_keys")
+    @patch("app.dao.dao_slot_generator.AvailableSlot")
+    def test_reconcile_day_slots_diff(self, mock_slot, mock_existing, mock_bulk_insert, mock_slot_dao,
+                                      mock_blocked):
+        mock_slot.query.filter.return_value.delete.return_value = 3
+        mock_slot.slot_start = AvailableSlot.slot_start
+        mock_existing.return_value = set()
+        mock_blocked.return_value = {}
+
+        added, deleted = dao_slot_generator.reconcile_day_slots(
+            1, DayOfWeekEnum.MONDAY,
+            (time(8, 0), time(10, 0), True),
+            (time(9, 0), time(11, 0), True),
+            weeks=2
+        )
+
+        # Chỉ xóa slot 8:00, 8:30 chưa đặt; chỉ thêm 10:00, 10:30
+        self.assertEqual(deleted, 3)
+        mock_slot.query.filter.return_value.delete.assert_called_once_with(synchronize_session=False)
+        rows = mock_bulk_insert.call_args[0][0]
+        self.assertEqual({r['start_time'] for r in rows}, {time(10, 0), time(10, 30)})
+        self.assertEqual(added, len(rows))
+        mock_slot_dao.refresh_next_slot.assert_called_once_with(1)
+
+    @patch("app.dao.dao_slot_generator.dao_available_slot")
+    @patch("app.dao.dao_slot_generator.db")
+    @patch("app.dao.dao_slot_generator.AvailableSlot")
+    def test_reconcile_day_slots_day_off(self, mock_slot, mock_db, mock_slot_dao):
+        mock_slot.query.filter.return_value.delete.return_value = 8
+        mock_slot.slot_start = AvailableSlot.slot_start
+
+        added, deleted = dao_slot_generator.reconcile_day_slots(
+            1, DayOfWeekEnum.MONDAY,
+            (time(8, 0), time(10, 0), True),
+            (time(8, 0), time(10, 0), False)
+        )
+
+        self.assertEqual((added, deleted), (0, 8))
+        mock_db.session.execute.assert_not_called()
+
+    @patch("app.dao.dao_slot_generator.get_blocked_dates", return_value={})
+    @patch("app.dao.dao_slot_generator.dao_available_slot")
+    @patch("app.dao.dao_slot_generator.bulk_insert_slots")
+    @patch("app.dao.dao_slot_generator.get_existing_slot_keys", return_value=set())
+    @patch("app.dao.dao_slot_generator.AvailableSlot")
+    def test_reconcile_day_slots_keeps_past_slots_today(self, mock_slot, mock_existing, mock_bulk_insert,
+                                                        mock_slot_dao, mock_blocked):
+        mock_slot.slot_start = AvailableSlot.slot_start
+        # 2030-01-07 là thứ Hai, sửa lịch lúc 9:00
+        now = datetime(2030, 1, 7, 9, 0)
+
+        dao_slot_generator.reconcile_day_slots(
+            1, DayOfWeekEnum.MONDAY,
+            (time(8, 0), time(10, 0), True),
+            (time(7, 0), time(9, 0), True),
+            weeks=2, now=now
+        )
+
+        # Slot 9:00, 9:30 đã qua giờ hôm nay không bị xóa
+        criteria = {str(c): c for c in mock_slot.query.filter.call_args.args}
+        self.assertEqual(criteria["availableslot.slot_start > :slot_start_1"].right.value, now)
+        # Slot 7:00, 7:30 hôm nay đã qua nên chỉ sinh cho tuần sau
+        rows = mock_bulk_insert.call_args[0][0]
+        self.assertEqual({(r['slot_date'], r['start_time']) for r in rows},
+                         {(date(2030, 1, 14), time(7, 0)), (date(2030, 1, 14), time(7, 30))})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+from unittest.mock import MagicMock
+from datetime import datetime, date
+from app import waiting_room
+
+
+class TestWaitingRoom(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = waiting_room.DoctorQueue(date(2030, 1, 7))
+
+    def push(self, appointment_id, hour, minute=0, priority=0):
+        self.queue.push(appointment_id, datetime(2030, 1, 7, hour, minute), datetime(2030, 1, 7, 8, 0), priority)
+
+    # ---------- thứ tự gọi ----------
+    def test_pop_by_appointment_time(self):
+        self.push(1, 10)
+        self.push(2, 9)
+        self.push(3, 9, 30)
+
+        self.assertEqual([self.queue.pop() for _ in range(4)], [2, 3, 1, None])
+
+    def test_priority_overrides_appointment_time(self):
+        self.push(1, 9)
+        self.push(2, 11)
+        # Đổi ưu tiên: phần tử cũ bị đánh dấu xóa, không được gọi hai lần
+        self.push(2, 11, priority=1)
+
+        self.assertEqual(self.queue.ordered(), [2, 1])
+        self.assertEqual([self.queue.pop() for _ in range(3)], [2, 1, None])
+
+    def test_remove_is_skipped_on_pop(self):
+        self.push(1, 9)
+        self.push(2, 10)
+        self.queue.remove(1)
+
+        self.assertEqual(len(self.queue), 1)
+        self.assertEqual(self.queue.pop(), 2)
+        self.assertIsNone(self.queue.pop())
+
+    # ---------- position ----------
+    def test_position(self):
+        self.push(1, 10)
+        self.push(2, 9)
+
+        self.assertEqual(self.queue.position(2), 1)
+        self.assertEqual(self.queue.position(1), 2)
+        self.assertIsNone(self.queue.position(99))
+
+    # ---------- WaitingRoom ----------
+    def test_load_and_day_change(self):
+        rooms = waiting_room.WaitingRoom()
+        rows = [MagicMock(appointment_id=5, appointment_time=datetime(2030, 1, 7, 9, 0),
+                          checked_in_at=datetime(2030, 1, 7, 8, 50), queue_priority=0)]
+
+        queue = rooms.load(3, date(2030, 1, 7), rows)
+
+        self.assertIs(rooms.get(3, date(2030, 1, 7)), queue)
+        self.assertEqual(queue.position(5), 1)
+        # Sang ngày mới thì phải dựng lại từ DB
+        self.assertIsNone(rooms.get(3, date(2030, 1, 8)))
+
+    def test_sync_rebuilds_only_when_version_changes(self):
+        rooms = waiting_room.WaitingRoom()
+        rows = [MagicMock(appointment_id=5, appointment_time=datetime(2030, 1, 7, 9, 0),
+                          checked_in_at=datetime(2030, 1, 7, 8, 50), queue_priority=0)]
+        load_rows = MagicMock(return_value=rows)
+
+        queue = rooms.sync(3, date(2030, 1, 7), 1, load_rows)
+
+        self.assertIs(rooms.sync(3, date(2030, 1, 7), 1, load_rows), queue)
+        load_rows.assert_called_once()
+        rows.append(MagicMock(appointment_id=6, appointment_time=datetime(2030, 1, 7, 8, 30),
+                              checked_in_at=datetime(2030, 1, 7, 8, 55), queue_priority=0))
+        self.assertEqual(rooms.sync(3, date(2030, 1, 7), 2, load_rows).ordered(), [6, 5])
+
+    def test_advance_only_from_previous_version(self):
+        rooms = waiting_room.WaitingRoom()
+        queue = rooms.load(3, date(2030, 1, 7), [], version=4)
+
+        # Worker khác đã thay đổi xen giữa (4 -> 6): không áp dụng tại chỗ
+        self.assertIsNone(rooms.advance(3, date(2030, 1, 7), 6))
+        self.assertIs(rooms.advance(3, date(2030, 1, 7), 5), queue)
+        self.assertEqual(queue.version, 5)
+        self.assertIsNone(rooms.advance(4, date(2030, 1, 7), 1))
+
+    def test_position_follows_changes(self):
+        self.push(1, 10)
+        self.push(2, 9)
+        self.assertEqual(self.queue.position(1), 2)
+
+        self.push(1, 10, priority=1)
+        self.assertEqual(self.queue.position(1), 1)
+        self.queue.pop()
+        self.assertIsNone(self.queue.position(1))
+        self.assertEqual(self.queue.position(2), 1)
+
+if __name__ == "__main__":
+    unittest.main()
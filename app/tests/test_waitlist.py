@@ -0,0 +1,119 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from datetime import datetime, date, timedelta
+from app.dao import dao_waitlist
+
+
+class TestDAOWaitlist(unittest.TestCase):
+
+    # ---------- join_waitlist ----------
+    def test_join_waitlist_requires_doctor_or_specialty(self):
+        entry, message = dao_waitlist.join_waitlist(1, date.today(), date.today())
+
+        self.assertIsNone(entry)
+        self.assertEqual(message, "Vui lòng chọn bác sĩ hoặc chuyên khoa")
+
+    def test_join_waitlist_invalid_range(self):
+        entry, message = dao_waitlist.join_waitlist(1, date.today() + timedelta(days=3), date.today(),
+                                                    specialty_id=2)
+
+        self.assertIsNone(entry)
+        self.assertEqual(message, "Khoảng ngày không hợp lệ")
+
+    @patch("app.dao.dao_waitlist.WaitlistEntry")
+    @patch("app.dao.dao_waitlist.db")
+    def test_join_waitlist_by_doctor(self, mock_db, mock_entry):
+        entry, message = dao_waitlist.join_waitlist(1, date.today(), date.today() + timedelta(days=7),
+                                                    doctor_id=3, specialty_id=2)
+
+        self.assertIsNotNone(entry)
+        self.assertEqual(message, "Đã đăng ký danh sách chờ")
+        # Chờ theo bác sĩ thì bỏ chuyên khoa
+        self.assertIsNone(mock_entry.call_args.kwargs['specialty_id'])
+        mock_db.session.commit.assert_called_once()
+
+    # ---------- offer_released_slot ----------
+    @patch("app.dao.dao_waitlist.send_waitlist_offer")
+    @patch("app.dao.dao_waitlist.find_waitlist_match")
+    @patch("app.dao.dao_waitlist.AvailableSlot")
+    @patch("app.dao.dao_waitlist.db")
+    def test_offer_released_slot_no_waiting_patient(self, mock_db, mock_slot, mock_match, mock_send):
+        mock_slot.query.get.return_value = MagicMock(is_booked=False, slot_start=datetime.now() + timedelta(days=1))
+        mock_match.return_value = None
+
+        self.assertIsNone(dao_waitlist.offer_released_slot(5))
+        mock_db.session.execute.assert_not_called()
+        mock_send.assert_not_called()
+
+    @patch("app.dao.dao_waitlist.send_waitlist_offer")
+    @patch("app.dao.dao_waitlist.dao_available_slot")
+    @patch("app.dao.dao_waitlist.find_waitlist_match")
+    @patch("app.dao.dao_waitlist.AvailableSlot")
+    @patch("app.dao.dao_waitlist.db")
+    def test_offer_released_slot_success(self, mock_db, mock_slot, mock_match, mock_slot_dao, mock_send):
+        slot = MagicMock(slot_id=5, doctor_id=3, slot_date=date(2030, 1, 7), is_booked=False,
+                         slot_start=datetime.now() + timedelta(days=1))
+        mock_slot.query.get.return_value = slot
+        entry = MagicMock(waitlist_id=9, patient_id=1)
+        mock_match.return_value = entry
+        mock_db.session.execute.return_value.rowcount = 1
+        mock_slot_dao.hold_slot_for.return_value = True
+
+        result = dao_waitlist.offer_released_slot(5, minutes=30)
+
+        self.assertEqual(result, entry)
+        mock_match.assert_called_once_with(3, slot.doctor.specialty_id, date(2030, 1, 7))
+        mock_slot_dao.hold_slot_for.assert_called_once_with(5, 1, 30)
+        mock_db.session.commit.assert_called_once()
+        mock_send.assert_called_once_with(entry, slot)
+
+    @patch("app.dao.dao_waitlist.send_waitlist_offer")
+    @patch("app.dao.dao_waitlist.dao_available_slot")
+    @patch("app.dao.dao_waitlist.find_waitlist_match")
+    @patch("app.dao.dao_waitlist.AvailableSlot")
+    @patch("app.dao.dao_waitlist.db")
+    def test_offer_released_slot_hold_lost(self, mock_db, mock_slot, mock_match, mock_slot_dao, mock_send):
+        # Slot vừa bị người khác giữ chỗ -> không đề nghị
+        mock_slot.query.get.return_value = MagicMock(is_booked=False, slot_start=datetime.now() + timedelta(days=1))
+        mock_match.return_value = MagicMock(waitlist_id=9, patient_id=1)
+        mock_db.session.execute.return_value.rowcount = 1
+        mock_slot_dao.hold_slot_for.return_value = False
+
+        self.assertIsNone(dao_waitlist.offer_released_slot(5))
+        mock_db.session.rollback.assert_called_once()
+        mock_db.session.commit.assert_not_called()
+        mock_send.assert_not_called()
+
+    # ---------- expire_offers ----------
+    @patch("app.dao.dao_waitlist.offer_released_slot")
+    @patch("app.dao.dao_waitlist.db")
+    def test_expire_offers_reoffers_slots(self, mock_db, mock_offer):
+        mock_db.session.query.return_value.filter.return_value.all.return_value = [
+            MagicMock(waitlist_id=1, offered_slot_id=5), MagicMock(waitlist_id=2, offered_slot_id=None)
+        ]
+        mock_offer.return_value = MagicMock()
+
+        expired, reoffered = dao_waitlist.expire_offers()
+
+        self.assertEqual((expired, reoffered), (2, 1))
+        mock_offer.assert_called_once_with(5)
+        mock_db.session.commit.assert_called_once()
+
+
+    # ---------- requeue_offers ----------
+    @patch("app.dao.dao_waitlist.db")
+    def test_requeue_offers(self, mock_db):
+        mock_db.session.execute.return_value.rowcount = 2
+
+        self.assertEqual(dao_waitlist.requeue_offers([5, 6]), 2)
+        mock_db.session.execute.assert_called_once()
+        mock_db.session.commit.assert_not_called()
+
+    @patch("app.dao.dao_waitlist.db")
+    def test_requeue_offers_no_slots(self, mock_db):
+        self.assertEqual(dao_waitlist.requeue_offers([]), 0)
+        mock_db.session.execute.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+Phòng chờ khám online: mỗi bác sĩ một hàng đợi ưu tiên (heap) các bệnh nhân đã check-in.
+
+Thứ tự gọi: queue_priority lớn hơn trước, sau đó theo giờ hẹn, rồi giờ check-in.
+Check-in và gọi bệnh nhân tiếp theo là O(log n); đổi ưu tiên hay hủy thì đánh dấu phần tử cũ
+là đã xóa (lazy deletion) và bỏ qua khi nó lên đỉnh heap.
+
+Trạng thái chỉ nằm trong bộ nhớ của process. Cơ sở dữ liệu (checked_in_at, called_at, queue_priority)
+là nguồn chính, Doctor.queue_version đếm số lần phòng chờ của bác sĩ thay đổi. Thay đổi ở process này
+được áp dụng tại chỗ lên heap (WaitingRoom.advance); mỗi lần đọc chỉ so bộ đếm (một câu truy vấn theo khóa chính)
+và chỉ dựng lại heap từ DB khi bộ đếm cho thấy worker khác đã thay đổi (hoặc sau khi khởi động lại server).
+"""
+import heapq
+import itertools
+import threading
+
+
+def queue_key(priority, appointment_time, checked_in_at, appointment_id):
+    return -(priority or 0), appointment_time, checked_in_at, appointment_id
+
+
+class DoctorQueue:
+    """Hàng đợi của một bác sĩ trong một ngày"""
+
+    def __init__(self, day, version=None):
+        self.day = day
+        self.version = version  # Doctor.queue_version mà hàng đợi đang phản ánh
+        self._heap = []
+        self._entries = {}  # appointment_id -> phần tử đang hiệu lực trong heap
+        self._counter = itertools.count()
+        self._ranks = None  # appointment_id -> vị trí, tính lại sau mỗi thay đổi (xem _order)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, appointment_id):
+        return appointment_id in self._entries
+
+    def push(self, appointment_id, appointment_time, checked_in_at, priority=0):
+        """Thêm hoặc cập nhật (đổi ưu tiên) một bệnh nhân"""
+        self.remove(appointment_id)
+        entry = [queue_key(priority, appointment_time, checked_in_at, appointment_id),
+                 next(self._counter), appointment_id, True]
+        self._entries[appointment_id] = entry
+        heapq.heappush(self._heap, entry)
+        self._ranks = None
+
+    def remove(self, appointment_id):
+        entry = self._entries.pop(appointment_id, None)
+        if entry:
+            entry[-1] = False
+            self._ranks = None
+
+    def pop(self):
+        """Lấy bệnh nhân tiếp theo, None nếu hàng đợi rỗng"""
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if entry[-1]:
+                del self._entries[entry[2]]
+                self._ranks = None
+                return entry[2]
+        return None
+
+    def _order(self):
+        """Thứ tự gọi, sắp một lần sau mỗi thay đổi và dùng lại cho mọi lượt polling vị trí"""
+        if self._ranks is None:
+            self._ranks = {entry[2]: rank for rank, entry in enumerate(sorted(self._entries.values()), 1)}
+        return self._ranks
+
+    def position(self, appointment_id):
+        """Vị trí (bắt đầu từ 1) của bệnh nhân trong hàng, None nếu không có trong hàng"""
+        return self._order().get(appointment_id)
+
+    def ordered(self):
+        """Danh sách appointment_id theo thứ tự sẽ được gọi"""
+        return list(self._order())
+
+
+class WaitingRoom:
+    """Tập các hàng đợi theo bác sĩ, dùng chung giữa các thread của process"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._queues = {}
+
+    def get(self, doctor_id, day):
+        """Hàng đợi của bác sĩ trong ngày, None nếu chưa dựng (hoặc là hàng đợi của ngày cũ)"""
+        queue = self._queues.get(doctor_id)
+        return queue if queue is not None and queue.day == day else None
+
+    def load(self, doctor_id, day, rows, version=None):
+        """Dựng lại hàng đợi từ DB; rows có appointment_id, appointment_time, checked_in_at, queue_priority"""
+        queue = DoctorQueue(day, version)
+        for row in rows:
+            queue.push(row.appointment_id, row.appointment_time, row.checked_in_at, row.queue_priority)
+        self._queues[doctor_id] = queue
+        return queue
+
+    def sync(self, doctor_id, day, version, load_rows):
+        """
+        Hàng đợi ở phiên bản version (Doctor.queue_version vừa đọc). Chỉ gọi load_rows() để đọc lại
+        các dòng đang chờ và dựng lại heap khi hàng đợi trong bộ nhớ ở phiên bản khác.
+        """
+        queue = self.get(doctor_id, day)
+        if queue is not None and queue.version == version:
+            return queue
+        return self.load(doctor_id, day, load_rows(), version)
+
+    def advance(self, doctor_id, day, version):
+        """
+        Sau khi process này ghi một thay đổi và tăng bộ đếm lên version: nếu hàng đợi đang ở ngay
+        phiên bản trước (không worker nào khác thay đổi xen giữa) thì chuyển sang version và trả về
+        để áp dụng thay đổi tại chỗ. Ngược lại trả về None, lần đọc sau sẽ dựng lại từ DB.
+        """
+        queue = self.get(doctor_id, day)
+        if queue is None or queue.version is None or queue.version + 1 != version:
+            return None
+        queue.version = version
+        return queue
+
+
+rooms = WaitingRoom()
@@ -0,0 +1,127 @@
+"""
+So sánh điều kiện lọc slot tương lai cũ (OR trên slot_date/start_time) với điều kiện range trên slot_start.
+
+Chạy: python benchmarks/bench_slot_start.py [--rows 1000000]
+Dùng SQLite trong bộ nhớ nên không cần MySQL; in ra EXPLAIN QUERY PLAN và thời gian của từng câu truy vấn.
+"""
+import argparse
+import random
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+
+SCHEMA = """
+CREATE TABLE availableslot (
+    slot_id INTEGER PRIMARY KEY,
+    doctor_id INTEGER NOT NULL,
+    slot_date DATE NOT NULL,
+    is_booked BOOLEAN,
+    start_time TIME NOT NULL,
+    end_time TIME NOT NULL,
+    slot_start DATETIME
+);
+CREATE INDEX idx_doctor_date ON availableslot (doctor_id, slot_date);
+CREATE INDEX idx_available_slots ON availableslot (doctor_id, slot_date, is_booked);
+CREATE INDEX idx_slot_booked_start ON availableslot (is_booked, slot_start);
+CREATE INDEX idx_slot_doctor_booked_start ON availableslot (doctor_id, is_booked, slot_start);
+"""
+
+# Cửa sổ 2 năm: phần lớn slot đã qua, chỉ ~1/8 là slot tương lai như dữ liệu thực tế
+DAYS_PAST = 640
+DAYS_FUTURE = 90
+SLOTS_PER_DAY = 16
+
+OLD_PREDICATE = "(slot_date > :today OR (slot_date = :today AND start_time > :now_time))"
+NEW_PREDICATE = "slot_start > :now"
+
+QUERIES = {
+    "Đếm slot trống": "SELECT COUNT(*) FROM availableslot WHERE is_booked = 0 AND {predicate}",
+    "Trang đầu slot trống": ("SELECT slot_id FROM availableslot WHERE is_booked = 0 AND {predicate} "
+                             "ORDER BY {order} LIMIT 8"),
+    "Slot trống của một bác sĩ": ("SELECT COUNT(*) FROM availableslot "
+                                  "WHERE doctor_id = 7 AND is_booked = 0 AND {predicate}"),
+}
+ORDERS = {
+    OLD_PREDICATE: "slot_date DESC, start_time DESC",
+    NEW_PREDICATE: "slot_start DESC",
+}
+
+
+def generate_rows(total, now):
+    """Sinh dữ liệu slot giả: chia đều cho các bác sĩ, 16 slot 30 phút mỗi ngày từ 8:00"""
+    first_day = now.date() - timedelta(days=DAYS_PAST)
+    days = DAYS_PAST + DAYS_FUTURE
+    doctors = max(1, total // (days * SLOTS_PER_DAY))
+    rng = random.Random(42)
+    count = 0
+    for doctor_id in range(1, doctors + 1):
+        for d in range(days):
+            slot_date = first_day + timedelta(days=d)
+            for i in range(SLOTS_PER_DAY):
+                if count >= total:
+                    return
+                start = datetime.combine(slot_date, datetime.min.time()) + timedelta(hours=8, minutes=30 * i)
+                end = start + timedelta(minutes=30)
+                is_booked = 1 if slot_date < now.date() or rng.random() < 0.3 else 0
+                yield (doctor_id, slot_date.isoformat(), is_booked, start.time().isoformat(),
+                       end.time().isoformat(), start.isoformat(sep=' '))
+                count += 1
+
+
+def build_database(total, now):
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(SCHEMA)
+    conn.executemany(
+        "INSERT INTO availableslot (doctor_id, slot_date, is_booked, start_time, end_time, slot_start) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        generate_rows(total, now)
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    return conn
+
+
+def run(conn, sql, params, repeat):
+    plan = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = conn.execute(sql, params).fetchall()
+    elapsed = (time.perf_counter() - started) / repeat * 1000
+    return plan, elapsed, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    now = datetime.now().replace(hour=12, minute=0, second=0, microsecond=0)
+    params = {
+        "today": now.date().isoformat(),
+        "now_time": now.time().isoformat(),
+        "now": now.isoformat(sep=' '),
+    }
+
+    started = time.perf_counter()
+    conn = build_database(args.rows, now)
+    total = conn.execute("SELECT COUNT(*) FROM availableslot").fetchone()[0]
+    print(f"Đã tạo {total} slot trong {time.perf_counter() - started:.1f}s\n")
+
+    for name, template in QUERIES.items():
+        print(f"== {name} ==")
+        results = []
+        for label, predicate in (("OR slot_date/start_time", OLD_PREDICATE), ("slot_start range", NEW_PREDICATE)):
+            sql = template.format(predicate=predicate, order=ORDERS[predicate])
+            plan, elapsed, result = run(conn, sql, params, args.repeat)
+            results.append(result)
+            print(f"-- {label}: {elapsed:.1f} ms")
+            for step in plan:
+                print(f"   {step}")
+        # Hai điều kiện phải trả về cùng kết quả (slot_date + start_time == slot_start)
+        assert results[0] == results[1] or name.startswith("Trang"), "Kết quả hai điều kiện khác nhau"
+        print()
+
+
+if __name__ == "__main__":
+    main()